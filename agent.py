@@ -1,16 +1,24 @@
 # agent.py
 import os
 import logging
+import threading
+import uuid
+from typing import Dict
 # Ensure an LLM is installed, e.g., Ollama and a model like llama2
 # pip install langchain langchain_community ollama
 # ollama pull llama2
-from langchain.agents import initialize_agent, Tool
-from langchain_community.llms import Ollama
+from langchain_core.tools import Tool
 
 from tools.file_system import read_file, write_file
+from tools.edit import edit_file_command
 from tools.shell import run_command
 from tools.testing import run_tests
 from tools.git import git_commit
+from tools.output import compact_tools
+from llm_cache import get_llm_cache
+from rate_limit import limiter_stats, rate_limited
+from tracing import (span, current_run_id, instrument_tools, trace_compaction, llm_trace_handler,
+                     load_spans, summarize, format_summary)
 
 # --- Logging Configuration ---
 logging.basicConfig(
@@ -24,14 +32,59 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- LLM Configuration ---
+# Set AGENT_FAKE_LLM_SCRIPT to a script file to run offline against scripted responses (see fake_llm.py).
+FAKE_LLM_SCRIPT = os.getenv("AGENT_FAKE_LLM_SCRIPT")
+# The LLM and the agent are created on first use, so importing this module is cheap and
+# does not contact Ollama. AGENT_LLM_WARMUP=1 sends a test prompt in the background at startup.
+LLM_WARMUP = os.getenv("AGENT_LLM_WARMUP", "off").lower() in ("1", "true", "on", "yes")
+OLLAMA_MODEL = "llama2"
 llm = None
-try:
-    llm = Ollama(model="llama2")
-    llm.invoke("Hello, world!") 
-    logger.info("Ollama LLM configured successfully.")
-except Exception as e:
-    logger.error(f"Failed to initialize Ollama LLM: {e}")
-    llm = None
+_init_errors: Dict[str, str] = {}  # a failed LLM or agent is not retried on every call
+_init_lock = threading.RLock()
+
+
+def get_llm():
+    """The agent's LLM, created on first use; None if it cannot be initialized."""
+    global llm
+    with _init_lock:
+        if llm is None and "llm" not in _init_errors:
+            try:
+                if FAKE_LLM_SCRIPT:
+                    from fake_llm import llm_from_script_file
+                    llm = rate_limited(llm_from_script_file(FAKE_LLM_SCRIPT, cache=False, callbacks=[llm_trace_handler]),
+                                       "scripted")
+                    logger.info(f"Scripted LLM configured from {FAKE_LLM_SCRIPT}.")
+                else:
+                    from langchain_community.llms import Ollama
+                    llm = rate_limited(Ollama(model=OLLAMA_MODEL, cache=get_llm_cache(), callbacks=[llm_trace_handler]),
+                                       "ollama")
+                    logger.info(f"Ollama LLM configured successfully (model: {OLLAMA_MODEL}).")
+            except Exception as e:
+                _init_errors["llm"] = str(e)
+                logger.error(f"Failed to initialize {'scripted' if FAKE_LLM_SCRIPT else 'Ollama'} LLM: {e}")
+                llm = None
+    return llm
+
+
+def warm_up_llm() -> bool:
+    """Sends a test prompt so the model is loaded before the first task; returns whether it answered."""
+    model = get_llm()
+    if model is None:
+        return False
+    try:
+        model.invoke("Hello, world!")
+        logger.info("LLM warm-up call succeeded.")
+        return True
+    except Exception as e:
+        logger.error(f"LLM warm-up call failed: {e}")
+        return False
+
+
+def start_warm_up() -> threading.Thread:
+    """Runs warm_up_llm in a background thread so startup is not blocked on the model."""
+    thread = threading.Thread(target=warm_up_llm, name="llm-warm-up", daemon=True)
+    thread.start()
+    return thread
 
 # --- Tool Definition ---
 tools = [
@@ -43,7 +96,12 @@ tools = [
     Tool(
         name="WriteFile",
         func=lambda params: write_file(path=params.split(',')[0].strip(), content=",".join(params.split(',')[1:]).strip()),
-        description="Writes content to a specified file. Input should be a file path and the content to write, separated by a comma (e.g., 'path/to/file.txt, new file content')."
+        description="Writes content to a specified file. Input should be a file path and the content to write, separated by a comma (e.g., 'path/to/file.txt, new file content'). To change part of an existing file use EditFile."
+    ),
+    Tool(
+        name="EditFile",
+        func=edit_file_command,
+        description="Changes part of an existing file without rewriting it. Input: the file path on the first line, then either a unified diff of the file or SEARCH/REPLACE blocks ('<<<<<<< SEARCH', the exact current lines, '=======', the new lines, '>>>>>>> REPLACE')."
     ),
     Tool(
         name="RunShellCommand",
@@ -53,48 +111,70 @@ tools = [
     Tool(
         name="RunTests",
         func=run_tests,
-        description="Runs the project's test suite. Input is ignored. This tool will report success or failure of the test run."
+        description="Runs the project's test suite. Only tests affected by changes since the last run are executed; the others come from cache. Input: empty, or 'full' to rerun everything. This tool will report success or failure of the test run with a summary of failures."
     ),
     Tool(
         name="GitCommit",
-        func=lambda params: git_commit(message=params.split(',')[0].strip(), branch_name=params.split(',')[1].strip() if len(params.split(',')) > 1 else "main"),
-        description="Commits changes to the git repository. Input should be the commit message, optionally followed by a comma and the branch name. Ensure files are staged first if needed."
+        func=lambda params: git_commit(message=params.split(',')[0].strip(),
+                                       branch_name=(params.split(',')[1].strip() or None) if len(params.split(',')) > 1 else None,
+                                       all_changes=len(params.split(',')) > 2 and params.split(',')[2].strip().lower() == "all"),
+        description="Commits the files changed with WriteFile to the git repository. Input should be the commit message, optionally followed by a comma and the branch name (created if needed), optionally followed by ',all' to commit every change in the working tree."
     )
 ]
 
+# Long outputs are compacted before they reach the agent's prompt (see tools/output.py).
+compact_tools(tools, spill_exempt={"ReadFile"}, on_compacted=trace_compaction)
+# Record latency, exit status and output size of every tool call in the run trace.
+instrument_tools(tools)
+
 # --- Agent Initialization ---
 agent = None
-if llm:
-    try:
-        agent = initialize_agent(
-            tools,
-            llm,
-            agent="zero-shot-react-description",
-            verbose=True, # LangChain's own verbose logging
-            handle_parsing_errors=True
-        )
-        logger.info("LangChain agent initialized successfully.")
-    except Exception as e:
-        logger.error(f"Error initializing LangChain agent: {e}")
-        agent = None
-else:
-    logger.warning("LLM not available, LangChain agent cannot be initialized.")
+
+
+def get_agent():
+    """The ReAct agent, created on first use; None if the LLM or the agent cannot be initialized."""
+    global agent
+    with _init_lock:
+        if agent is None and "agent" not in _init_errors:
+            model = get_llm()
+            if not model:
+                logger.warning("LLM not available, LangChain agent cannot be initialized.")
+                return None
+            try:
+                # langchain.agents is slow to import, so it is only loaded when the agent is built.
+                from langchain.agents import initialize_agent
+                agent = initialize_agent(
+                    tools,
+                    model,
+                    agent="zero-shot-react-description",
+                    verbose=True, # LangChain's own verbose logging
+                    handle_parsing_errors=True
+                )
+                logger.info("LangChain agent initialized successfully.")
+            except Exception as e:
+                _init_errors["agent"] = str(e)
+                logger.error(f"Error initializing LangChain agent: {e}")
+                agent = None
+    return agent
 
 
 # --- Agent Task Execution ---
 def run_agent_task(prompt: str):
+    """Runs the agent on `prompt` and returns its final answer (None if the run failed)."""
+    agent = get_agent()
     if not agent:
         logger.error("Agent not initialized. Cannot run task.")
         return
-    if not llm:
-        logger.error("LLM not configured. Agent cannot run task.") # Should be redundant
-        return
 
     logger.info(f"--- Running Agent with Prompt ---")
     logger.info(f"User Prompt: {prompt}")
+    run_id = uuid.uuid4().hex
+    current_run_id.set(run_id)
+    final_output = None
     try:
         # The agent.invoke method is generally preferred for newer LangChain versions
-        response = agent.invoke({"input": prompt})
+        with span("node", "agent"):
+            response = agent.invoke({"input": prompt})
         final_output = response.get('output', 'No output field found.')
         logger.info(f"--- Agent Execution Finished ---")
         logger.info(f"Final Response: {final_output}")
@@ -102,9 +182,13 @@ def run_agent_task(prompt: str):
         logger.error(f"Error during agent execution: {e}", exc_info=True) # exc_info=True logs stack trace
         if "Could not parse LLM output" in str(e):
             logger.warning("This often means the LLM's response wasn't in the expected format for the ReAct agent.")
+    logger.info(format_summary(summarize(load_spans(run_id))))
+    return final_output
 
 if __name__ == "__main__":
-    if agent:
+    if LLM_WARMUP:
+        start_warm_up()
+    if get_agent():
         logger.info("--- Agent Ready ---")
         logger.info(f"Available tools: {[tool.name for tool in tools]}")
         
@@ -112,5 +196,9 @@ if __name__ == "__main__":
         # task_prompt = "Read the README.md file and tell me what it is about."
         # task_prompt = "Create a new file named 'hello.txt' with the content 'Hello, agent world!', then read this file and show me its content."
         run_agent_task(task_prompt)
+        llm_cache = get_llm_cache()
+        if llm_cache:
+            logger.info(f"LLM cache stats: {llm_cache.stats()}")
+        logger.info(f"LLM rate limiter stats: {limiter_stats()}")
     else:
         logger.critical("Agent initialization failed. Cannot run tasks. Ensure LLM (e.g., Ollama) is running and configured.")
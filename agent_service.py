@@ -0,0 +1,347 @@
+# agent_service.py
+"""
+Long-running local service for the agents.
+
+Imports the agent modules once, so the compiled LangGraph `app`, the LLM clients and the
+worker executor stay warm, and runs submitted goals from a bounded job queue with a fixed
+number of concurrent runs. Graph events are streamed back as newline-delimited JSON.
+
+    python agent_service.py [--port 8765 | --unix-socket /tmp/agent.sock]
+    python agent_service.py --submit "Create a todo app"          # client: submit and stream
+
+HTTP API:
+    POST   /jobs               {"goal": "...", "thread_id": optional, "resume": optional thread id,
+                                "agent": "graph" (default) | "react", "stream": false}
+                               -> 202 {"job_id", "status", "queue_position"}; 429 if the queue is full
+    GET    /jobs               all known jobs
+    GET    /jobs/{id}          one job
+    GET    /jobs/{id}/events   NDJSON event stream (replays earlier events, follows until the job ends)
+    DELETE /jobs/{id}          cancels a queued or running job
+    GET    /health             queue depth, running jobs, limits and LLM rate limiter stats
+
+Configuration (environment variables):
+    AGENT_SERVICE_CONCURRENCY  goals run at the same time (default: 2)
+    AGENT_SERVICE_QUEUE_SIZE   goals waiting to run before submissions are rejected (default: 16)
+    AGENT_SERVICE_MAX_JOBS     finished jobs kept for inspection (default: 100)
+    AGENT_LLM_WARMUP           "1" sends a test prompt to each model at startup (default: off)
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientSession, ClientTimeout, UnixConnector, web
+
+from tools.changes import current_changes, run_changes
+
+logger = logging.getLogger("agent_service")
+
+DEFAULT_PORT = 8765
+CONCURRENCY = int(os.getenv("AGENT_SERVICE_CONCURRENCY", "2"))
+QUEUE_SIZE = int(os.getenv("AGENT_SERVICE_QUEUE_SIZE", "16"))
+MAX_JOBS = int(os.getenv("AGENT_SERVICE_MAX_JOBS", "100"))
+AGENTS = ("graph", "react")
+FINISHED = ("done", "failed", "cancelled")
+
+
+class Job:
+    def __init__(self, goal: str, agent: str = "graph", thread_id: Optional[str] = None,
+                 resume: Optional[str] = None):
+        self.id = resume or thread_id or uuid.uuid4().hex
+        self.goal = goal
+        self.agent = agent
+        self.resume = resume
+        self.status = "queued"
+        self.outcome: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    async def emit(self, event: Dict[str, Any]) -> None:
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def finish(self, status: str, outcome: Optional[str]) -> None:
+        self.status, self.outcome, self.finished_at = status, outcome, time.time()
+        await self.emit({"event": "end", "job_id": self.id, "status": status, "outcome": outcome})
+
+    async def follow(self):
+        """Yields every event of the job, including ones emitted before the call, until it ends."""
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.events) > position or self.status in FINISHED)
+                pending = self.events[position:]
+            for event in pending:
+                yield event
+            position += len(pending)
+            if self.status in FINISHED and position >= len(self.events):
+                return
+
+    def info(self) -> Dict[str, Any]:
+        return {"job_id": self.id, "goal": self.goal, "agent": self.agent, "status": self.status,
+                "outcome": self.outcome, "events": len(self.events), "created_at": self.created_at,
+                "queued_seconds": (self.started_at or time.time()) - self.created_at,
+                "run_seconds": ((self.finished_at or time.time()) - self.started_at) if self.started_at else None}
+
+
+class AgentService:
+    """Bounded job queue in front of the warm agents, served by `concurrency` runner tasks."""
+
+    def __init__(self, concurrency: int = CONCURRENCY, queue_size: int = QUEUE_SIZE, max_jobs: int = MAX_JOBS):
+        self.concurrency = max(1, concurrency)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._runners: List[asyncio.Task] = []
+        self._graph = None
+        self._react = None
+
+    def warm_up(self, agents: List[str], check_llm: bool = False) -> None:
+        """Loads the requested agents and builds their graph, LLM clients and executors up front."""
+        if "graph" in agents:
+            import langgraph_agent
+            langgraph_agent.warm_up(check_llm)
+            self._graph = langgraph_agent
+        if "react" in agents:
+            import agent
+            agent.get_agent()
+            if check_llm:
+                agent.warm_up_llm()
+            self._react = agent
+        logger.info(f"Agents ready: {agents}")
+
+    async def start(self) -> None:
+        self._runners = [asyncio.create_task(self._runner(i)) for i in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+
+    def submit(self, goal: str, agent: str = "graph", thread_id: Optional[str] = None,
+               resume: Optional[str] = None) -> Job:
+        """Queues a goal. Raises asyncio.QueueFull when the queue is at capacity."""
+        job = Job(goal, agent, thread_id, resume)
+        if job.id in self.jobs and self.jobs[job.id].status not in FINISHED:
+            raise ValueError(f"Job {job.id} is already queued or running.")
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self.jobs.move_to_end(job.id)
+        self._prune()
+        return job
+
+    async def cancel(self, job: Job) -> None:
+        if job.status == "queued":
+            await job.finish("cancelled", "Cancelled before it started.")
+        elif job.status == "running" and job.task:
+            job.task.cancel()
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+    def health(self) -> Dict[str, Any]:
+        running = sum(1 for job in self.jobs.values() if job.status == "running")
+        from rate_limit import limiter_stats
+        return {"queued": self.queue.qsize(), "queue_size": self.queue.maxsize, "running": running,
+                "concurrency": self.concurrency, "jobs": len(self.jobs), "llm_rate_limits": limiter_stats()}
+
+    async def _runner(self, number: int) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.status != "queued":  # cancelled while waiting
+                    continue
+                job.status, job.started_at = "running", time.time()
+                await job.emit({"event": "start", "job_id": job.id, "runner": number})
+                job.task = asyncio.create_task(self._run(job))
+                try:
+                    status, outcome = await job.task
+                except asyncio.CancelledError:
+                    if not job.task.cancelled():
+                        raise  # the service itself is shutting down
+                    status, outcome = "cancelled", "Cancelled while running."
+                except Exception as e:
+                    logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+                    status, outcome = "failed", f"Error: {e}"
+                await job.finish(status, outcome)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job: Job):
+        if job.agent == "react":
+            return await self._run_react(job)
+        return await self._run_graph(job)
+
+    async def _run_graph(self, job: Job):
+        la = self._graph
+        if la is None:
+            raise RuntimeError("The graph agent is not loaded by this service.")
+        if job.resume:
+            run_input, config = await asyncio.to_thread(la.prepare_resume, job.resume)
+        else:
+            run_input, config = la.make_initial_state(job.goal), la.run_config(job.id)
+        async for update in la.app.astream(run_input, config):
+            for node, data in update.items():
+                await job.emit({"event": "update", "job_id": job.id, "node": node,
+                                "data": json.loads(json.dumps(data, default=str))})
+        values = (await la.app.aget_state(config)).values if la.get_app_checkpointer() else {}
+        outcome = la.run_outcome(values) if values else "Run finished."
+        failed = "failed" in outcome.lower() or "incomplete" in outcome.lower()
+        return ("failed" if failed else "done"), outcome
+
+    async def _run_react(self, job: Job):
+        agent = self._react
+        if agent is None:
+            raise RuntimeError("The ReAct agent is not loaded by this service.")
+        # The ReAct agent's GitCommit only sees the files this job wrote.
+        current_changes.set(run_changes(job.id))
+        output = await asyncio.to_thread(agent.run_agent_task, job.goal)
+        if output is None:
+            return "failed", "Agent run failed; see agent.log."
+        await job.emit({"event": "update", "job_id": job.id, "node": "agent", "data": {"output": output}})
+        return "done", output
+
+
+# --- HTTP interface ---
+
+async def _stream(request: web.Request, job: Job) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    async for event in job.follow():
+        await response.write((json.dumps(event) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+def _job_or_404(request: web.Request) -> Job:
+    job = request.app["service"].jobs.get(request.match_info["job_id"])
+    if job is None:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Unknown job."}), content_type="application/json")
+    return job
+
+
+async def handle_submit(request: web.Request) -> web.StreamResponse:
+    service: AgentService = request.app["service"]
+    try:
+        body = await request.json()
+    except Exception:
+        return web.json_response({"error": "Body must be a JSON object."}, status=400)
+    goal, agent = body.get("goal"), body.get("agent", "graph")
+    if not (goal or body.get("resume")) or agent not in AGENTS:
+        return web.json_response({"error": f"'goal' (or 'resume') is required and 'agent' must be one of {AGENTS}."},
+                                 status=400)
+    try:
+        job = service.submit(goal or "", agent, body.get("thread_id"), body.get("resume"))
+    except asyncio.QueueFull:
+        # Backpressure: callers retry later instead of the service buffering without bound.
+        return web.json_response({"error": "Job queue is full.", **service.health()}, status=429,
+                                 headers={"Retry-After": "5"})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=409)
+    if body.get("stream"):
+        return await _stream(request, job)
+    return web.json_response({**job.info(), "queue_position": service.queue.qsize()}, status=202)
+
+
+async def handle_list(request: web.Request) -> web.Response:
+    return web.json_response([job.info() for job in request.app["service"].jobs.values()])
+
+
+async def handle_get(request: web.Request) -> web.Response:
+    return web.json_response(_job_or_404(request).info())
+
+
+async def handle_events(request: web.Request) -> web.StreamResponse:
+    return await _stream(request, _job_or_404(request))
+
+
+async def handle_cancel(request: web.Request) -> web.Response:
+    job = _job_or_404(request)
+    await request.app["service"].cancel(job)
+    return web.json_response(job.info())
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response(request.app["service"].health())
+
+
+def create_app(service: AgentService) -> web.Application:
+    app = web.Application()
+    app["service"] = service
+    app.router.add_post("/jobs", handle_submit)
+    app.router.add_get("/jobs", handle_list)
+    app.router.add_get("/jobs/{job_id}", handle_get)
+    app.router.add_get("/jobs/{job_id}/events", handle_events)
+    app.router.add_delete("/jobs/{job_id}", handle_cancel)
+    app.router.add_get("/health", handle_health)
+
+    async def on_startup(_):
+        await service.start()
+
+    async def on_cleanup(_):
+        await service.stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+# --- Client ---
+
+async def submit_and_stream(goal: str, url: str = f"http://127.0.0.1:{DEFAULT_PORT}",
+                            unix_socket: Optional[str] = None, **options: Any):
+    """Submits a goal to a running service and yields its events as they arrive."""
+    connector = UnixConnector(path=unix_socket) if unix_socket else None
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=None)) as session:
+        async with session.post(f"{url}/jobs", json={"goal": goal, "stream": True, **options}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"Submission rejected ({response.status}): {await response.text()}")
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve the agents from a warm, long-running process.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", help="Listen on (or, with --submit, connect to) this Unix socket.")
+    parser.add_argument("--agents", default="graph", help="Comma-separated agents to load: graph, react.")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--submit", metavar="GOAL", help="Client mode: submit a goal and print its events.")
+    return parser.parse_args(argv)
+
+
+async def _print_events(args: argparse.Namespace) -> None:
+    async for event in submit_and_stream(args.submit, f"http://{args.host}:{args.port}", args.unix_socket):
+        print(json.dumps(event), flush=True)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.submit:
+        asyncio.run(_print_events(args))
+        raise SystemExit(0)
+    agents = [name.strip() for name in args.agents.split(",") if name.strip()]
+    unknown = set(agents) - set(AGENTS)
+    if unknown:
+        raise SystemExit(f"Unknown agents: {sorted(unknown)}")
+    service = AgentService(args.concurrency, args.queue_size)
+    service.warm_up(agents, check_llm=os.getenv("AGENT_LLM_WARMUP", "off").lower() in ("1", "true", "on", "yes"))
+    if args.unix_socket:
+        web.run_app(create_app(service), path=args.unix_socket)
+    else:
+        web.run_app(create_app(service), host=args.host, port=args.port)
@@ -0,0 +1,241 @@
+# benchmarks/bench_agent.py
+"""
+Offline benchmark suite for the LangGraph agent and its tools.
+
+Runs entirely against scripted models (fake_llm.py), so no Gemini/Ollama endpoint is
+needed. Measures:
+    graph_overhead  graph time per subtask with an instant worker, for chain and wide plans
+    state_size      final state and checkpoint database size per plan size
+    tool_latency    latency percentiles of the worker tools
+    end_to_end      full runs (planner + worker agent + real tool calls) per plan size
+
+Results are written as JSON (default: .agent_cache/benchmarks/<timestamp>.json) so runs
+can be compared; --compare prints the ratio of every metric against an earlier result.
+
+    python benchmarks/bench_agent.py [--sizes 1,10,100,500] [--quick] [--compare old.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Keep benchmark runs out of the agent's log file and the user's caches: the agent modules
+# configure logging and read these variables on import.
+logging.basicConfig(level=logging.WARNING)
+_scratch = tempfile.mkdtemp(prefix="agent-bench-")
+os.environ.setdefault("AGENT_CHECKPOINT_PATH", os.path.join(_scratch, "checkpoints.sqlite"))
+os.environ.setdefault("AGENT_BLOB_DIR", os.path.join(_scratch, "blobs"))
+os.environ.setdefault("AGENT_TRACE_DIR", os.path.join(_scratch, "traces"))
+os.environ.setdefault("AGENT_TEST_CACHE_PATH", os.path.join(_scratch, "test_results.json"))
+os.environ["AGENT_LLM_CACHE"] = "off"
+os.environ["AGENT_PLAN_LIBRARY"] = "off"  # benchmark goals are near-identical on purpose
+
+import langgraph_agent as la  # noqa: E402
+from fake_llm import ScriptedChatModel, agent_responder  # noqa: E402
+
+DEFAULT_SIZES = [1, 10, 50, 100, 500]
+QUICK_SIZES = [1, 10, 50]
+
+
+class InstantExecutor:
+    """Stands in for the ReAct executor so only the graph itself is measured."""
+
+    def invoke(self, inputs: Dict[str, Any]) -> Dict[str, str]:
+        return {"output": f"done: {inputs['input']}"}
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> Dict[str, str]:
+        return self.invoke(inputs)
+
+
+def make_plan(size: int, shape: str) -> List[Dict[str, Any]]:
+    """'chain': every subtask depends on the previous one; 'wide': no dependencies."""
+    return [{"id": i + 1, "subtask": f"Step {i + 1}: create file_{i + 1}.txt",
+             "depends_on": [i] if shape == "chain" and i else []} for i in range(size)]
+
+
+def run_plan(plan: List[Dict[str, Any]], thread_id: str) -> Dict[str, Any]:
+    la.orchestrator_llm = ScriptedChatModel(responder=agent_responder(plan), cache=False)
+    # The synthetic plans go beyond the default plan size cap; the run's limit follows the cap.
+    la.MAX_PLAN_WAVES = max(la.MAX_PLAN_WAVES, la.plan_waves(la.build_plan(plan)))
+    config = la.run_config(thread_id)
+    started = time.perf_counter()
+    la.app.invoke(la.make_initial_state(f"benchmark {thread_id}"), config)
+    elapsed = time.perf_counter() - started
+    values = la.app.get_state(config).values
+    return {"seconds": elapsed, "values": values}
+
+
+def bench_graph(sizes: List[int]) -> Dict[str, List[Dict[str, Any]]]:
+    la.worker_llm = object()  # the instant executor never calls it
+    la._worker_agent_executor = InstantExecutor()
+    overhead, state_size = [], []
+    for shape in ("chain", "wide"):
+        for size in sizes:
+            result = run_plan(make_plan(size, shape), f"graph-{shape}-{size}")
+            outcome = la.run_outcome(result["values"])
+            overhead.append({"shape": shape, "subtasks": size, "seconds": result["seconds"],
+                             "ms_per_subtask": result["seconds"] * 1000 / size, "outcome": outcome})
+            state_size.append({"shape": shape, "subtasks": size,
+                               "state_bytes": len(json.dumps(result["values"], default=str)),
+                               "checkpoint_db_bytes": os.path.getsize(os.environ["AGENT_CHECKPOINT_PATH"])})
+    return {"graph_overhead": overhead, "state_size": state_size}
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {"calls": len(ordered), "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p90_ms": ordered[int(len(ordered) * 0.9)] * 1000, "mean_ms": statistics.mean(ordered) * 1000}
+
+
+def bench_tools(repeat: int) -> Dict[str, Dict[str, float]]:
+    tools = {tool.name: tool for tool in la.worker_tools}
+    workdir = tempfile.mkdtemp(prefix="agent-bench-tools-")
+    big_file = os.path.join(workdir, "big.log")
+    with open(big_file, "w") as f:
+        for i in range(200_000):
+            f.write(f"{i} INFO request handled in {i % 97} ms\n")
+    small_file = os.path.join(workdir, "small.txt")
+    with open(small_file, "w") as f:
+        f.write("hello\n" * 100)
+    source_file = os.path.join(workdir, "module.py")
+    with open(source_file, "w") as f:
+        f.writelines(f"def handler_{i}(request):\n    return {i}\n\n" for i in range(2000))
+
+    cases = {
+        "ReadFile": small_file,
+        "ReadFileLines": f"{big_file},1000,1050",
+        "ReadFileTail": f"{big_file},50",
+        "SearchFile": f"{big_file},request handled in 96 ms",
+        "WriteFile": f"{os.path.join(workdir, 'out.txt')},some content",
+        # Same text in and out, so every repetition applies.
+        "EditFile": f"{source_file}\n<<<<<<< SEARCH\n    return 1234\n=======\n    return 1234\n>>>>>>> REPLACE\n",
+        "RunShellCommand": "true",
+        "RunTests": "",
+    }
+    results = {}
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for name, tool_input in cases.items():
+            if name not in tools:
+                continue
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                tools[name].run(tool_input)
+                samples.append(time.perf_counter() - started)
+            results[name] = _percentiles(samples)
+    finally:
+        os.chdir(previous_cwd)
+    return results
+
+
+def bench_end_to_end(sizes: List[int]) -> List[Dict[str, Any]]:
+    workdir = tempfile.mkdtemp(prefix="agent-bench-e2e-")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # One `ls` per subtask in either worker mode (AGENT_WORKER_MODE).
+        la.worker_llm = ScriptedChatModel(responder=agent_responder([], "RunShellCommand", "ls"), cache=False,
+                                          tool_calls=[{"name": "RunShellCommand", "args": {"command": "ls"}}])
+        la._worker_agent_executor = None
+        executor = la._get_worker_agent_executor()
+        executor.verbose = False
+        results = []
+        for size in sizes:
+            result = run_plan(make_plan(size, "wide"), f"e2e-{size}")
+            results.append({"subtasks": size, "worker": la._executor_kind(executor), "seconds": result["seconds"],
+                            "ms_per_subtask": result["seconds"] * 1000 / size,
+                            "outcome": la.run_outcome(result["values"])})
+        return results
+    finally:
+        os.chdir(previous_cwd)
+
+
+def _flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves keyed by path; list entries are keyed by their shape/subtasks fields."""
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(data, list):
+        for entry in data:
+            label = "/".join(str(entry[k]) for k in ("shape", "subtasks") if isinstance(entry, dict) and k in entry)
+            flat.update(_flatten(entry, f"{prefix}[{label}]"))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix] = float(data)
+    return flat
+
+
+def compare(current: Dict[str, Any], baseline_path: str, threshold: float = 1.2) -> None:
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    old, new = _flatten({k: v for k, v in baseline.items() if k != "meta"}), \
+        _flatten({k: v for k, v in current.items() if k != "meta"})
+    print(f"\nComparison against {baseline_path} (ratio new/old, '!' above {threshold}x):")
+    for key in sorted(set(old) & set(new)):
+        if old[key] > 0:
+            ratio = new[key] / old[key]
+            print(f"  {'!' if ratio > threshold else ' '} {key}: {old[key]:.3f} -> {new[key]:.3f} ({ratio:.2f}x)")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main(argv: List[str] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the agent graph and tools.")
+    parser.add_argument("--sizes", help="Comma-separated plan sizes (default: 1,10,50,100,500).")
+    parser.add_argument("--quick", action="store_true", help="Small plan sizes and fewer tool repetitions.")
+    parser.add_argument("--repeat", type=int, help="Repetitions per tool (default: 50, quick: 10).")
+    parser.add_argument("--output", help="Result file (default: .agent_cache/benchmarks/<timestamp>.json).")
+    parser.add_argument("--compare", metavar="BASELINE", help="Earlier result file to compare against.")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    repeat = args.repeat or (10 if args.quick else 50)
+
+    results: Dict[str, Any] = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                                        "git_commit": _git_commit(), "python": platform.python_version(),
+                                        "platform": platform.platform(), "sizes": sizes, "repeat": repeat}}
+    results.update(bench_graph(sizes))
+    results["tool_latency"] = bench_tools(repeat)
+    results["end_to_end"] = bench_end_to_end(sizes)
+
+    output = args.output or os.path.join(REPO_ROOT, ".agent_cache", "benchmarks",
+                                         time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()) + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for entry in results["graph_overhead"]:
+        print(f"graph {entry['shape']:>5} {entry['subtasks']:>4} subtasks: {entry['seconds']:.3f}s "
+              f"({entry['ms_per_subtask']:.2f} ms/subtask)")
+    for entry in results["state_size"]:
+        print(f"state {entry['shape']:>5} {entry['subtasks']:>4} subtasks: {entry['state_bytes']} bytes")
+    for name, stats in results["tool_latency"].items():
+        print(f"tool {name}: p50 {stats['p50_ms']:.2f}ms p90 {stats['p90_ms']:.2f}ms")
+    for entry in results["end_to_end"]:
+        print(f"end-to-end {entry['subtasks']:>4} subtasks: {entry['seconds']:.3f}s ({entry['outcome']})")
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == "__main__":
+    main()
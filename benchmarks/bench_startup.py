@@ -0,0 +1,112 @@
+# benchmarks/bench_startup.py
+"""
+Startup benchmark: import time of the agent modules, checked against a budget.
+
+Each module is imported in a fresh interpreter (median of --repeat runs). A module fails
+its budget if it imports too slowly, loads one of the heavy modules that must only be
+imported on first use (LLM providers, langchain.agents), or prints on import. The exit
+status is 1 when any budget is exceeded, so this can gate CI:
+
+    python benchmarks/bench_startup.py [--repeat 5] [--scale 2.0] [--output result.json]
+
+--scale (or AGENT_IMPORT_BUDGET_SCALE) multiplies every time budget, for slower machines.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds allowed for `import <module>` in a fresh interpreter.
+IMPORT_BUDGETS = {
+    "tools": 0.1,
+    "tools.file_system": 0.3,
+    "tools.edit": 0.3,
+    "tools.shell": 0.3,
+    "tools.testing": 0.3,
+    "tools.git": 0.3,
+    "tools.output": 0.3,
+    "tools.code_index": 0.5,
+    "rate_limit": 1.0,
+    "blackboard": 0.3,
+    "agent": 1.5,
+    "langgraph_agent": 2.0,
+    "agent_service": 1.0,
+}
+# Created lazily on first use; importing any of these at module import time is a regression.
+LAZY_MODULES = ["langchain_google_genai", "langchain_community.llms", "langchain.agents"]
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+sys.stderr.write("\\n__RESULT__" + json.dumps({{"seconds": elapsed,
+    "lazy_loaded": [name for name in {lazy!r} if name in sys.modules]}}) + "\\n")
+"""
+
+
+def measure_import(module: str, workdir: str) -> Dict[str, Any]:
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    result = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, lazy=LAZY_MODULES)],
+                            cwd=workdir, env=env, capture_output=True, text=True, timeout=120)
+    marker = result.stderr.rfind("__RESULT__")
+    if result.returncode != 0 or marker < 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    measured = json.loads(result.stderr[marker + len("__RESULT__"):].strip())
+    measured["stdout"] = result.stdout
+    return measured
+
+
+def run(repeat: int, scale: float) -> List[Dict[str, Any]]:
+    # Logs the modules write on import land in the scratch directory, not the repository.
+    workdir = tempfile.mkdtemp(prefix="agent-startup-")
+    results = []
+    for module, budget in IMPORT_BUDGETS.items():
+        samples = [measure_import(module, workdir) for _ in range(repeat)]
+        seconds = statistics.median(sample["seconds"] for sample in samples)
+        lazy_loaded = sorted({name for sample in samples for name in sample["lazy_loaded"]})
+        printed = any(sample["stdout"].strip() for sample in samples)
+        problems = []
+        if seconds > budget * scale:
+            problems.append(f"{seconds:.3f}s exceeds budget {budget * scale:.3f}s")
+        if lazy_loaded:
+            problems.append(f"imports {', '.join(lazy_loaded)} eagerly")
+        if printed:
+            problems.append("prints on import")
+        results.append({"module": module, "seconds": seconds, "budget": budget * scale,
+                        "lazy_loaded": lazy_loaded, "ok": not problems, "problems": problems})
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check agent module import times against a budget.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh-interpreter imports per module (median is used).")
+    parser.add_argument("--scale", type=float, default=float(os.getenv("AGENT_IMPORT_BUDGET_SCALE", "1.0")),
+                        help="Multiplier for every time budget.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    results = run(max(1, args.repeat), args.scale)
+    for entry in results:
+        status = "ok  " if entry["ok"] else "FAIL"
+        details = f"  ({'; '.join(entry['problems'])})" if entry["problems"] else ""
+        print(f"{status} import {entry['module']:<18} {entry['seconds']:.3f}s / {entry['budget']:.3f}s{details}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = [entry["module"] for entry in results if not entry["ok"]]
+    if failed:
+        print(f"Import budget exceeded by: {', '.join(failed)}")
+        return 1
+    print("All modules within their import budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# blackboard.py
+"""
+Shared scratchpad for passing data between subtasks without files.
+
+A subtask stores a value with PutNote and a later subtask (one that depends on it) reads it
+with GetNote. The notes live in the orchestrator state (`OrchestratorState["notes"]`), so
+they are checkpointed with the run and need no disk I/O, temporary files or cleanup steps.
+Values longer than the blob store's inline limit are kept there and only referenced from
+the state, like large worker results.
+
+Each subtask sees the notes as they were when it was dispatched plus its own writes. Its
+writes are merged into the state when it succeeds and dropped when it fails, like its file
+writes. Subtasks running concurrently do not see each other's notes.
+
+Configuration (environment variables):
+    AGENT_NOTE_MAX_CHARS     largest value of a single note (default: 6000, so GetNote
+                             returns it whole within the tool output budget)
+    AGENT_NOTES_MAX_CHARS    total size of all notes of a run (default: 64000)
+"""
+import contextvars
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from blob_store import externalize, resolve
+
+MAX_NOTE_CHARS = int(os.getenv("AGENT_NOTE_MAX_CHARS", "6000"))
+MAX_TOTAL_CHARS = int(os.getenv("AGENT_NOTES_MAX_CHARS", "64000"))
+MAX_KEY_CHARS = 100
+
+
+def merge_notes(existing: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reducer for the notes channel: later writes win; a None entry deletes the note."""
+    merged = dict(existing or {})
+    for key, entry in (new or {}).items():
+        if entry is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = entry
+    return merged
+
+
+class SubtaskNotes:
+    """The notes one subtask sees: the run's notes when it was dispatched plus its own writes."""
+
+    def __init__(self, shared: Optional[Dict[str, Any]] = None):
+        self._shared = shared or {}
+        # Key -> entry ({"value", "ref", "chars"}), or None for a deleted note.
+        self.written: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _visible(self) -> Dict[str, Any]:
+        return merge_notes(self._shared, self.written)
+
+    def put(self, key: str, value: str) -> str:
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_CHARS:
+            return f"Error: A note key must be 1-{MAX_KEY_CHARS} characters."
+        if len(value) > MAX_NOTE_CHARS:
+            return (f"Error: The note is {len(value)} characters; notes are limited to {MAX_NOTE_CHARS}. "
+                    f"Store a summary, or write the data to a file and note its path.")
+        with self._lock:
+            visible = self._visible()
+            if not value:
+                self.written[key] = None
+                return f"Note '{key}' deleted."
+            total = sum(entry["chars"] for name, entry in visible.items() if name != key) + len(value)
+            if total > MAX_TOTAL_CHARS:
+                return (f"Error: Notes are limited to {MAX_TOTAL_CHARS} characters in total and would reach {total}; "
+                        f"delete notes that are no longer needed (PutNote with an empty value).")
+            ref, inline = externalize(value)
+            self.written[key] = {"value": inline, "ref": ref, "chars": len(value)}
+        return f"Note '{key}' saved ({len(value)} characters)."
+
+    def get(self, key: str) -> str:
+        key = key.strip()
+        with self._lock:
+            visible = self._visible()
+        if not key:
+            if not visible:
+                return "No notes have been saved yet."
+            return "Notes: " + ", ".join(f"{name} ({entry['chars']} chars)" for name, entry in sorted(visible.items()))
+        entry = visible.get(key)
+        if entry is None:
+            known = ", ".join(sorted(visible)) or "none"
+            return f"Error: No note named '{key}'. Saved notes: {known}."
+        return resolve(entry.get("ref"), entry.get("value"))
+
+
+# Set by the worker for the duration of a subtask.
+current_notes: contextvars.ContextVar[Optional[SubtaskNotes]] = contextvars.ContextVar(
+    "current_notes", default=None)
+
+
+def put_note(key: str, value: str) -> str:
+    """Stores `value` under `key` for later subtasks; an empty value deletes the note."""
+    notes = current_notes.get()
+    if notes is None:
+        return "Error: Notes are only available inside a subtask."
+    return notes.put(key, value)
+
+
+def get_note(key: str = "") -> str:
+    """The value stored under `key`; an empty key lists the saved notes."""
+    notes = current_notes.get()
+    if notes is None:
+        return "Error: Notes are only available inside a subtask."
+    return notes.get(key or "")
@@ -0,0 +1,100 @@
+# blob_store.py
+"""
+Content-addressed, zstd-compressed store for large worker and tool outputs.
+
+The orchestrator state only keeps a reference (`blob:sha256:<hex>`) and a short digest
+of each large output, so checkpoints, log lines and the state copies passed between
+nodes stay small however long the plan gets. Identical outputs are stored once.
+
+Configuration (environment variables):
+    AGENT_BLOB_DIR           blob directory (default: .agent_cache/blobs)
+    AGENT_BLOB_INLINE_LIMIT  outputs up to this many characters stay inline (default: 500)
+"""
+import hashlib
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import zstandard
+
+DEFAULT_BLOB_DIR = os.path.join(".agent_cache", "blobs")
+INLINE_LIMIT = int(os.getenv("AGENT_BLOB_INLINE_LIMIT", "500"))
+DIGEST_CHARS = 200
+REF_PREFIX = "blob:sha256:"
+
+
+class BlobStore:
+    def __init__(self, root: str = DEFAULT_BLOB_DIR):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest[2:]}.zst")
+
+    def put(self, data: bytes) -> str:
+        """Stores `data` (once per distinct content) and returns its reference."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial blob.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(zstandard.ZstdCompressor(level=3).compress(data))
+            os.replace(tmp_path, path)
+        return f"{REF_PREFIX}{digest}"
+
+    def get(self, ref: str) -> bytes:
+        """Returns the content for `ref`. Raises KeyError if it is unknown."""
+        if not ref.startswith(REF_PREFIX):
+            raise KeyError(f"Not a blob reference: {ref}")
+        path = self._path(ref[len(REF_PREFIX):])
+        try:
+            with open(path, "rb") as f:
+                return zstandard.ZstdDecompressor().decompress(f.read())
+        except FileNotFoundError:
+            raise KeyError(f"Unknown blob: {ref}")
+
+    def put_text(self, text: str) -> str:
+        return self.put(text.encode("utf-8"))
+
+    def get_text(self, ref: str) -> str:
+        return self.get(ref).decode("utf-8")
+
+
+_blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = BlobStore(os.getenv("AGENT_BLOB_DIR", DEFAULT_BLOB_DIR))
+    return _blob_store
+
+
+def digest_text(text: str, ref: Optional[str] = None, limit: int = DIGEST_CHARS) -> str:
+    """Short stand-in for a large output: its beginning, its size and where to find the rest."""
+    if len(text) <= limit:
+        return text
+    suffix = f", full output in {ref}" if ref else ""
+    return f"{text[:limit]}... [{len(text)} chars{suffix}]"
+
+
+def externalize(text: str, inline_limit: int = INLINE_LIMIT) -> Tuple[Optional[str], str]:
+    """
+    Returns (reference, digest) for `text`. Short outputs stay inline (no reference);
+    longer ones are written to the blob store.
+    """
+    if text is None or len(text) <= inline_limit:
+        return None, text
+    ref = get_blob_store().put_text(text)
+    return ref, digest_text(text, ref)
+
+
+def resolve(ref: Optional[str], inline: Optional[str]) -> Optional[str]:
+    """Full text for a (reference, digest) pair; falls back to the digest if the blob is gone."""
+    if not ref:
+        return inline
+    try:
+        return get_blob_store().get_text(ref)
+    except KeyError:
+        return inline
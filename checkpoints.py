@@ -0,0 +1,81 @@
+# checkpoints.py
+"""
+Local persistent checkpointer for the LangGraph orchestrator.
+
+Every step of a run is saved to a SQLite file under the run's thread id, so a run that
+dies part-way (worker error, quota, crash) can be resumed from its last completed step
+with its stored plan and results instead of replanning from scratch.
+
+Configuration (environment variables):
+    AGENT_CHECKPOINTS        "0"/"false"/"off" disables checkpointing (default: on)
+    AGENT_CHECKPOINT_PATH    SQLite file location (default: .agent_cache/checkpoints.sqlite)
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(".agent_cache", "checkpoints.sqlite")
+
+
+class ThreadedSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver that also serves the async checkpoint API (used by app.ainvoke/app.astream)
+    by running the synchronous SQLite calls in a worker thread, off the event loop.
+    """
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def get_checkpointer() -> Optional[ThreadedSqliteSaver]:
+    """Checkpointer configured from the environment, or None when checkpointing is disabled."""
+    if os.getenv("AGENT_CHECKPOINTS", "on").lower() in ("0", "false", "off", "no"):
+        return None
+    path = os.getenv("AGENT_CHECKPOINT_PATH", DEFAULT_CHECKPOINT_PATH)
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        saver = ThreadedSqliteSaver(sqlite3.connect(path, check_same_thread=False))
+        logger.info(f"Checkpointing runs to {path}.")
+        return saver
+    except Exception as e:
+        logger.error(f"Failed to open checkpoint database: {e}. Runs will not be resumable.")
+        return None
+
+
+def list_thread_ids(checkpointer: SqliteSaver) -> Sequence[str]:
+    """Thread ids of all saved runs, most recently updated first."""
+    latest: Dict[str, str] = {}
+    for item in checkpointer.list(None):
+        thread_id = item.config["configurable"]["thread_id"]
+        checkpoint_id = item.config["configurable"]["checkpoint_id"]
+        if checkpoint_id > latest.get(thread_id, ""):
+            latest[thread_id] = checkpoint_id
+    return sorted(latest, key=latest.get, reverse=True)
@@ -0,0 +1,225 @@
+# fake_llm.py
+"""
+Deterministic stand-in models for running the agents without Gemini or Ollama.
+
+`ScriptedChatModel` (for the LangGraph orchestrator/worker) and `ScriptedLLM` (for the
+Ollama path in agent.py) answer every prompt through a responder function. The helpers
+below build responders that replay a scripted plan for planning prompts and scripted
+ReAct turns (one tool call, then a final answer) for worker prompts. Bound with tools
+(the tool-calling worker), the chat model answers the first turn with the scripted
+`tool_calls` and gives the final answer once tool results are present. Streamed replies
+arrive in small chunks with the latency spread over them, like a real model's tokens.
+
+Setting AGENT_FAKE_LLM_SCRIPT to a JSON script file makes both agents use these models:
+
+    {
+      "plan": [{"id": 1, "subtask": "...", "depends_on": []}, ...],
+      "worker": {"tool": "RunShellCommand", "input": "ls", "final_answer": "Done.",
+                 "tool_calls": [{"name": "RunShellCommand", "args": {"command": "ls"}}]},
+      "rules": [{"match": "regex", "response": "text"}],
+      "latency_ms": 0
+    }
+
+`rules` are checked first (regex searched in the prompt); all keys are optional.
+"""
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.llms import LLM
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+Responder = Callable[[str], str]
+
+PLANNING_MARKER = "You are a planning assistant."
+
+
+def planner_responder(plan: List[Any]) -> Responder:
+    """Answers every prompt with the given plan as JSON."""
+    plan_json = json.dumps(plan)
+    return lambda prompt: plan_json
+
+
+def react_responder(tool: str, tool_input: str, final_answer: str = "Done.") -> Responder:
+    """
+    ReAct worker script: call `tool` once, then give the final answer once an
+    observation is present in the agent scratchpad (the text after the last 'Question:').
+    """
+    action = f"Thought: I should use {tool}.\nAction: {tool}\nAction Input: {tool_input}"
+    final = f"Thought: I now know the final answer.\nFinal Answer: {final_answer}"
+
+    def respond(prompt: str) -> str:
+        scratchpad = prompt.rsplit("Question:", 1)[-1]
+        return final if "Observation:" in scratchpad else action
+    return respond
+
+
+def routed_responder(rules: List[Tuple[str, Union[str, Responder]]], default: Responder) -> Responder:
+    """First rule whose regex matches the prompt answers it; otherwise `default` does."""
+    compiled = [(re.compile(pattern, re.DOTALL), response) for pattern, response in rules]
+
+    def respond(prompt: str) -> str:
+        for pattern, response in compiled:
+            if pattern.search(prompt):
+                return response(prompt) if callable(response) else response
+        return default(prompt)
+    return respond
+
+
+def agent_responder(plan: List[Any], tool: str = "RunShellCommand", tool_input: str = "ls",
+                    final_answer: str = "Done.") -> Responder:
+    """Planner for planning prompts, scripted ReAct turns for everything else."""
+    return routed_responder([(re.escape(PLANNING_MARKER), planner_responder(plan))],
+                            react_responder(tool, tool_input, final_answer))
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model that answers through `responder`, optionally after a simulated latency."""
+
+    responder: Callable[[str], str]
+    latency: float = 0.0
+    model_name: str = "scripted-chat"
+    # Answer of the first turn when tools are bound: [{"name": ..., "args": {...}}, ...].
+    tool_calls: List[Dict[str, Any]] = []
+    final_answer: str = "Done."
+    # stream()/astream() split text replies into chunks of this size and spread the latency over them.
+    stream_chunk_chars: int = 20
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _tool_reply(self, messages: List[BaseMessage]) -> Optional[ChatResult]:
+        """Scripted tool-calling turn, or None to answer through the responder."""
+        turn = messages
+        for position, message in enumerate(messages):
+            if isinstance(message, HumanMessage):
+                turn = messages[position + 1:]
+        if any(isinstance(message, ToolMessage) for message in turn):
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.final_answer))])
+        if not self.tool_calls:
+            return None
+        calls = [{"name": call["name"], "args": call.get("args", {}), "id": f"call_{position}"}
+                 for position, call in enumerate(self.tool_calls)]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="", tool_calls=calls))])
+
+    def _reply(self, messages: List[BaseMessage], tools_bound: bool = False) -> ChatResult:
+        if tools_bound:
+            result = self._tool_reply(messages)
+            if result is not None:
+                return result
+        prompt = "\n".join(m.content if isinstance(m.content, str) else str(m.content) for m in messages)
+        reply = self.responder(prompt)
+        usage = {"input_tokens": _estimate_tokens(prompt), "output_tokens": _estimate_tokens(reply),
+                 "total_tokens": _estimate_tokens(prompt) + _estimate_tokens(reply)}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply, usage_metadata=usage))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._reply(messages, bool(kwargs.get("tools")))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._reply(messages, bool(kwargs.get("tools")))
+
+    def _chunks(self, messages: List[BaseMessage], tools_bound: bool) -> List[ChatGenerationChunk]:
+        message = self._reply(messages, tools_bound).generations[0].message
+        if message.tool_calls:
+            calls = [{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": position}
+                     for position, call in enumerate(message.tool_calls)]
+            return [ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=calls))]
+        text, size = message.content, max(1, self.stream_chunk_chars)
+        pieces = [text[start:start + size] for start in range(0, len(text), size)] or [""]
+        chunks = [ChatGenerationChunk(message=AIMessageChunk(content=piece)) for piece in pieces]
+        chunks[-1].message.usage_metadata = message.usage_metadata
+        return chunks
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        chunks = self._chunks(messages, bool(kwargs.get("tools")))
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        chunks = self._chunks(messages, bool(kwargs.get("tools")))
+        for chunk in chunks:
+            if self.latency:
+                await asyncio.sleep(self.latency / len(chunks))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class ScriptedLLM(LLM):
+    """Completion-style counterpart of ScriptedChatModel, in place of Ollama in agent.py."""
+
+    responder: Callable[[str], str]
+    latency: float = 0.0
+    model_name: str = "scripted-llm"
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-llm"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responder(prompt)
+
+
+def responder_from_script(script: Dict[str, Any]) -> Responder:
+    worker = script.get("worker", {})
+    default = agent_responder(script.get("plan", ["Report that the scripted run finished."]),
+                              worker.get("tool", "RunShellCommand"), worker.get("input", "ls"),
+                              worker.get("final_answer", "Done."))
+    rules = [(rule["match"], rule["response"]) for rule in script.get("rules", [])]
+    return routed_responder(rules, default) if rules else default
+
+
+def load_script(path: str) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def chat_model_from_script_file(path: str, **kwargs: Any) -> ScriptedChatModel:
+    script = load_script(path)
+    worker = script.get("worker", {})
+    return ScriptedChatModel(responder=responder_from_script(script),
+                             latency=script.get("latency_ms", 0) / 1000,
+                             tool_calls=worker.get("tool_calls", []),
+                             final_answer=worker.get("final_answer", "Done."), **kwargs)
+
+
+def llm_from_script_file(path: str, **kwargs: Any) -> ScriptedLLM:
+    script = load_script(path)
+    return ScriptedLLM(responder=responder_from_script(script),
+                       latency=script.get("latency_ms", 0) / 1000, **kwargs)
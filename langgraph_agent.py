@@ -1,19 +1,45 @@
+import argparse
+import asyncio
+import contextlib
+import contextvars
 import logging
-from typing import TypedDict, List, Optional, Dict, Annotated
+import os
+import uuid
+from typing import TypedDict, List, Optional, Dict, Annotated, Any, Tuple
 import json  # For parsing LLM plan output
 import re  # For robust JSON extraction
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from langgraph.config import get_config
 from langgraph.graph import StateGraph, END, START
 from langgraph.graph.message import MessagesState
+from langgraph.types import Send
 
-from langchain.agents import initialize_agent, AgentType
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.tools import Tool as LangChainTool
-from langchain_google_genai import ChatGoogleGenerativeAI
-from tools.file_system import read_file, write_file
-from tools.shell import run_command
-from tools.testing import run_tests
-from tools.git import git_commit
+from langchain_core.tools import Tool as LangChainTool, StructuredTool
+from pydantic import BaseModel, Field
+from langchain_core.runnables import RunnableLambda
+from tools.file_system import (read_file, write_file, aread_file, awrite_file, read_file_lines,
+                               read_file_bytes, read_file_head, read_file_tail, search_file,
+                               overlay_transaction, aoverlay_transaction, flush_overlay)
+from tools.edit import edit_file, aedit_file, edit_file_command
+from tools.shell import (run_command, arun_command, current_session as current_shell_session, close_session,
+                         aclose_session)
+from tools.testing import run_tests, arun_tests
+from tools.git import git_commit, agit_commit
+from tools.changes import current_changes, run_changes
+from tools.output import compact_tools, output_stats
+from tools.code_index import search_code, find_symbol, invalidate_code_index
+from llm_cache import get_llm_cache
+from rate_limit import limiter_stats, rate_limited
+from checkpoints import get_checkpointer, list_thread_ids
+from blob_store import digest_text, externalize, resolve
+from blackboard import SubtaskNotes, current_notes, get_note, merge_notes, put_note, MAX_NOTE_CHARS
+from plan_library import get_plan_library
+from plan_stream import PlanStreamParser, cached_response, cache_response
+from tool_calling import ToolCallingExecutor, message_text, supports_tool_calling
+from tracing import (traced, annotate_span, instrument_tools, trace_compaction, tool_exit_code, llm_trace_handler,
+                     load_spans, summarize, format_summary)
 
 load_dotenv()
 # Configure basic logging
@@ -30,229 +56,1456 @@ logger = logging.getLogger(__name__)
 # --- LLMs ---
 # Ensure you have the GOOGLE_API_KEY environment variable set.
 # For LangChain agents, a lower temperature is usually preferred for deterministic behavior.
-try:
-    orchestrator_llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash", temperature=0)
-    # Optional: Add a test invocation if needed, but ChatGoogleGenerativeAI initializes directly
-    logger.info("Orchestrator LLM (Gemini 1.5 Flash) initialized successfully.")
-except Exception as e:
-    logger.error(
-        f"Failed to initialize Orchestrator LLM: {e}. Orchestrator planning will not function.")
-    orchestrator_llm = None
-
-try:
-    worker_llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash", temperature=0)
-    # Optional: Add a test invocation if needed
-    logger.info("Worker LLM (Gemini 1.5 Flash) initialized successfully.")
-except Exception as e:
-    logger.error(
-        f"Failed to initialize Worker LLM: {e}. Worker node will not function correctly.")
-    worker_llm = None
+# With temperature=0, responses are replayed from the on-disk cache (see llm_cache.py).
+# Set AGENT_FAKE_LLM_SCRIPT to a script file to run offline against scripted responses (see fake_llm.py).
+FAKE_LLM_SCRIPT = os.getenv("AGENT_FAKE_LLM_SCRIPT")
+# The clients, the worker executor and the compiled graph are created on first use, so importing
+# this module stays cheap and never touches the network. Assigning a model here injects it.
+orchestrator_llm = None
+worker_llm = None
+_llm_init_errors: Dict[str, str] = {}  # a failed client is not retried on every call
+_init_lock = threading.RLock()
+
+
+def _make_llm():
+    if FAKE_LLM_SCRIPT:
+        from fake_llm import chat_model_from_script_file
+        return rate_limited(chat_model_from_script_file(FAKE_LLM_SCRIPT, cache=False, callbacks=[llm_trace_handler]),
+                            "scripted")
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # Orchestrator and workers share one limiter: they draw on the same API quota.
+    return rate_limited(ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0, cache=get_llm_cache(),
+                                               callbacks=[llm_trace_handler]), "gemini")
+
+
+def get_orchestrator_llm():
+    """The orchestrator's model, created on first use; None if it cannot be initialized."""
+    global orchestrator_llm
+    with _init_lock:
+        if orchestrator_llm is None and "orchestrator" not in _llm_init_errors:
+            try:
+                orchestrator_llm = _make_llm()
+                logger.info("Orchestrator LLM (Gemini 2.0 Flash) initialized successfully.")
+            except Exception as e:
+                _llm_init_errors["orchestrator"] = str(e)
+                logger.error(
+                    f"Failed to initialize Orchestrator LLM: {e}. Orchestrator planning will not function.")
+    return orchestrator_llm
+
+
+def get_worker_llm():
+    """The workers' model, created on first use; None if it cannot be initialized."""
+    global worker_llm
+    with _init_lock:
+        if worker_llm is None and "worker" not in _llm_init_errors:
+            try:
+                worker_llm = _make_llm()
+                logger.info("Worker LLM (Gemini 2.0 Flash) initialized successfully.")
+            except Exception as e:
+                _llm_init_errors["worker"] = str(e)
+                logger.error(
+                    f"Failed to initialize Worker LLM: {e}. Worker node will not function correctly.")
+    return worker_llm
+
 
 # --- Tools for Generic Worker ---
+
+
+def _parse_write_file_params(params_str: str) -> Dict[str, str]:
+    return {"path": params_str.split(',')[0].strip(), "content": ",".join(params_str.split(',')[1:]).strip()}
+
+
+def _parse_git_commit_params(params_str: str) -> Dict[str, Any]:
+    """'message[,branch[,all]]'; an empty or missing branch commits to the current branch."""
+    parts = [part.strip() for part in params_str.split(',')]
+    return {"message": parts[0],
+            "branch_name": parts[1] if len(parts) > 1 and parts[1] else None,
+            "all_changes": len(parts) > 2 and parts[2].lower() == "all"}
+
+
+def _split_params(params_str: str, count: int) -> List[str]:
+    """Splits 'a,b,c' into at most `count` stripped fields; the last field keeps any commas."""
+    return [part.strip() for part in params_str.split(',', count - 1)]
+
+
+def _threaded(func):
+    """Async tool entry point running a blocking tool function in a worker thread."""
+    async def _run(*args, **kwargs) -> str:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return _run
+
+
+def _flushing(func):
+    """
+    Shell commands, tests and git read files from disk, not from the subtask's write overlay,
+    so its pending writes are flushed before these tools run.
+    """
+    if asyncio.iscoroutinefunction(func):
+        async def _arun(*args, **kwargs) -> str:
+            try:
+                await asyncio.to_thread(flush_overlay)
+            except Exception as e:
+                return f"Error: Could not write pending file changes to disk: {e}"
+            return await func(*args, **kwargs)
+        return _arun
+
+    def _run(*args, **kwargs) -> str:
+        try:
+            flush_overlay()
+        except Exception as e:
+            return f"Error: Could not write pending file changes to disk: {e}"
+        return func(*args, **kwargs)
+    return _run
+
+
+def _invalidating_index(func):
+    """Shell commands and branch switches change files behind the file tools' back."""
+    if asyncio.iscoroutinefunction(func):
+        async def _arun(*args, **kwargs) -> str:
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                invalidate_code_index()
+        return _arun
+
+    def _run(*args, **kwargs) -> str:
+        try:
+            return func(*args, **kwargs)
+        finally:
+            invalidate_code_index()
+    return _run
+
+
+def _read_file_lines_tool(params_str: str) -> str:
+    fields = _split_params(params_str, 3)
+    try:
+        start = int(fields[1]) if len(fields) > 1 and fields[1] else 1
+        end = int(fields[2]) if len(fields) > 2 and fields[2] else None
+    except ValueError:
+        return "Error: Input must be 'path,start_line,end_line' with integer line numbers."
+    return read_file_lines(fields[0], start, end)
+
+
+def _read_file_bytes_tool(params_str: str) -> str:
+    fields = _split_params(params_str, 3)
+    try:
+        offset = int(fields[1]) if len(fields) > 1 and fields[1] else 0
+        length = int(fields[2]) if len(fields) > 2 and fields[2] else 4096
+    except ValueError:
+        return "Error: Input must be 'path,offset,length' with integer byte values."
+    return read_file_bytes(fields[0], offset, length)
+
+
+def _read_file_end_tool(read_func):
+    def _run(params_str: str) -> str:
+        fields = _split_params(params_str, 2)
+        try:
+            lines = int(fields[1]) if len(fields) > 1 and fields[1] else 20
+        except ValueError:
+            return "Error: Input must be 'path,number_of_lines'."
+        return read_func(fields[0], lines)
+    return _run
+
+
+def _search_file_tool(params_str: str) -> str:
+    fields = _split_params(params_str, 2)
+    if len(fields) < 2 or not fields[1]:
+        return "Error: Input must be 'path,regex'."
+    return search_file(fields[0], fields[1])
+
+
+def _search_code_tool(params_str: str) -> str:
+    query = params_str.strip()
+    if query.startswith("re:"):
+        return search_code(query[3:], regex=True)
+    return search_code(query)
+
+
+def _find_symbol_tool(params_str: str) -> str:
+    fields = _split_params(params_str, 2)
+    return find_symbol(fields[0], fields[1] if len(fields) > 1 and fields[1] else None)
+
+
+def _put_note_tool(params_str: str) -> str:
+    fields = _split_params(params_str, 2)
+    return put_note(fields[0], fields[1] if len(fields) > 1 else "")
+
+
+async def _awrite_file_tool(params_str: str) -> str:
+    return await awrite_file(**_parse_write_file_params(params_str))
+
+
+async def _agit_commit_tool(params_str: str) -> str:
+    return await agit_commit(**_parse_git_commit_params(params_str))
+
+
+# Each tool has an async entry point (`coroutine`) that keeps blocking I/O off the event loop
+# when the worker runs under app.ainvoke/app.astream.
 worker_tools = [
     LangChainTool(
-        name="ReadFile", func=read_file,
+        name="ReadFile", func=read_file, coroutine=aread_file,
         description="Reads the content of a specified file. Input should be a valid file path."
     ),
+    LangChainTool(
+        name="ReadFileLines", func=_read_file_lines_tool, coroutine=_threaded(_read_file_lines_tool),
+        description="Reads a range of lines from a file (1-based, inclusive). Input: 'path,start_line,end_line'; omit end_line to read to the end."
+    ),
+    LangChainTool(
+        name="ReadFileBytes", func=_read_file_bytes_tool, coroutine=_threaded(_read_file_bytes_tool),
+        description="Reads a byte range from a file. Input: 'path,offset,length'; a negative offset counts from the end of the file."
+    ),
+    LangChainTool(
+        name="ReadFileHead", func=_read_file_end_tool(read_file_head),
+        coroutine=_threaded(_read_file_end_tool(read_file_head)),
+        description="Reads the first lines of a file. Input: 'path,number_of_lines' (default 20)."
+    ),
+    LangChainTool(
+        name="ReadFileTail", func=_read_file_end_tool(read_file_tail),
+        coroutine=_threaded(_read_file_end_tool(read_file_tail)),
+        description="Reads the last lines of a file, e.g. the end of a log. Input: 'path,number_of_lines' (default 20)."
+    ),
+    LangChainTool(
+        name="SearchFile", func=_search_file_tool, coroutine=_threaded(_search_file_tool),
+        description="Finds lines matching a regex in a file and shows them with 2 lines of context and line numbers. Input: 'path,regex'. Prefer this over ReadFile for large files."
+    ),
+    LangChainTool(
+        name="SearchCode", func=_search_code_tool, coroutine=_threaded(_search_code_tool),
+        description="Searches every file in the workspace through an index and returns 'path:line: text' for each match. Input: the text to find (case-insensitive unless it has uppercase letters), or 're:' followed by a regex. Prefer this over grep in RunShellCommand."
+    ),
+    LangChainTool(
+        name="FindSymbol", func=_find_symbol_tool, coroutine=_threaded(_find_symbol_tool),
+        description="Finds where a Python class, function, method or module-level variable is defined. Input: 'name' or 'Class.method', optionally followed by ',kind' (class, function, method or variable)."
+    ),
     LangChainTool(
         name="WriteFile",
-        func=lambda params_str: write_file(path=params_str.split(
-            ',')[0].strip(), content=",".join(params_str.split(',')[1:]).strip()),
-        description="Writes content to a specified file. Input: string 'path/to/file.txt,content to write'."
+        func=lambda params_str: write_file(**_parse_write_file_params(params_str)),
+        coroutine=_awrite_file_tool,
+        description="Writes content to a specified file, replacing it. Input: string 'path/to/file.txt,content to write'. To change part of an existing file use EditFile."
+    ),
+    LangChainTool(
+        name="EditFile", func=edit_file_command, coroutine=_threaded(edit_file_command),
+        description="Changes part of an existing file without rewriting it. Input: the file path on the first line, then either a unified diff of the file or SEARCH/REPLACE blocks ('<<<<<<< SEARCH', the exact current lines, '=======', the new lines, '>>>>>>> REPLACE'). The search text must match exactly once."
+    ),
+    LangChainTool(
+        name="PutNote", func=_put_note_tool, coroutine=_threaded(_put_note_tool),
+        description="Saves a value for later sub-tasks, which read it with GetNote; faster than a temporary file. Input: 'key,value' (the value may contain commas); an empty value deletes the note."
+    ),
+    LangChainTool(
+        name="GetNote", func=get_note, coroutine=_threaded(get_note),
+        description="Reads a value saved by an earlier sub-task with PutNote. Input: the key; empty to list the saved notes."
     ),
     LangChainTool(
-        name="RunShellCommand", func=run_command,
+        name="RunShellCommand", func=_flushing(_invalidating_index(run_command)),
+        coroutine=_flushing(_invalidating_index(arun_command)),
         description="Executes a shell command. Input: command string. Use with caution."
     ),
     LangChainTool(
-        name="RunTests", func=run_tests,
-        description="Runs project tests. Input is ignored."
+        name="RunTests", func=_flushing(run_tests), coroutine=_flushing(arun_tests),
+        description="Runs project tests affected by changes since the last run (others come from cache) and returns a summary of failures. Input: empty, or 'full' to rerun everything."
     ),
     LangChainTool(
         name="GitCommit",
-        func=lambda params_str: git_commit(message=params_str.split(',')[0].strip(
-        ), branch_name=params_str.split(',')[1].strip() if len(params_str.split(',')) > 1 else "main"),
-        description="Commits changes. Input: 'commit message' or 'commit message,branch'. Assumes files are staged."
+        func=_flushing(_invalidating_index(lambda params_str: git_commit(**_parse_git_commit_params(params_str)))),
+        coroutine=_flushing(_invalidating_index(_agit_commit_tool)),
+        description="Commits the files changed with WriteFile or EditFile. Input: 'commit message', 'commit message,branch' (switches to the branch, creating it if needed) or 'commit message,branch,all' to commit every change in the working tree (e.g. files created by shell commands); leave branch empty for the current branch."
     )
 ]
+# File readers are not spilled: the worker can page through the file they read directly.
+READ_TOOLS = {"ReadFile", "ReadFileLines", "ReadFileBytes", "ReadFileHead", "ReadFileTail", "SearchFile"}
+# Long outputs are compacted before they reach the worker's prompt (see tools/output.py).
+compact_tools(worker_tools, spill_exempt=READ_TOOLS, on_compacted=trace_compaction)
+# Record latency, exit status and output size of every tool call in the run trace.
+instrument_tools(worker_tools)
 logger.info(f"Worker tools defined: {[tool.name for tool in worker_tools]}")
 
+
+# --- Typed tools for the tool-calling worker ---
+# Same tools with argument schemas, so models with a function-calling API pass structured
+# arguments instead of comma-separated strings (content may contain commas and newlines).
+
+
+class PathArgs(BaseModel):
+    path: str = Field(description="Path of the file.")
+
+
+class ReadFileLinesArgs(PathArgs):
+    start: int = Field(1, description="First line to read (1-based).")
+    end: Optional[int] = Field(None, description="Last line to read (inclusive); omit to read to the end.")
+
+
+class ReadFileBytesArgs(PathArgs):
+    offset: int = Field(0, description="Byte offset; negative values count from the end of the file.")
+    length: int = Field(4096, description="Number of bytes to read.")
+
+
+class ReadFileEndArgs(PathArgs):
+    lines: int = Field(20, description="Number of lines to read.")
+
+
+class SearchFileArgs(PathArgs):
+    pattern: str = Field(description="Regular expression to search for.")
+
+
+class SearchCodeArgs(BaseModel):
+    query: str = Field(description="Text to find; case-insensitive unless it contains uppercase letters.")
+    regex: bool = Field(False, description="Treat the query as a regular expression.")
+    path_glob: Optional[str] = Field(None, description="Only search files matching this glob, e.g. 'src/*.py'.")
+
+
+class FindSymbolArgs(BaseModel):
+    name: str = Field(description="Name ('run_tests') or qualified name ('CodeIndex.search') of the symbol.")
+    kind: Optional[str] = Field(None, description="Only return symbols of this kind: class, function, method or variable.")
+
+
+class WriteFileArgs(PathArgs):
+    content: str = Field(description="Complete new content of the file.")
+
+
+class FileEdit(BaseModel):
+    search: Optional[str] = Field(None, description="Exact current text to replace; must occur once in the file.")
+    start_line: Optional[int] = Field(None, description="Instead of search: first line to replace (1-based, as in the file before this call).")
+    end_line: Optional[int] = Field(None, description="Last line to replace (inclusive); start_line - 1 inserts before start_line.")
+    replace: str = Field("", description="New text.")
+
+
+class EditFileArgs(PathArgs):
+    edits: Optional[List[FileEdit]] = Field(None, description="Search/replace or line-range edits.")
+    patch: Optional[str] = Field(None, description="A unified diff of the file or SEARCH/REPLACE blocks, instead of or besides edits.")
+    expected_hash: Optional[str] = Field(None, description="Content hash reported by the previous EditFile call on this file; the edit fails if the file changed since.")
+
+
+class PutNoteArgs(BaseModel):
+    key: str = Field(description="Name of the note, e.g. 'failing_tests'.")
+    value: str = Field(description="Text to save; an empty value deletes the note.")
+
+
+class GetNoteArgs(BaseModel):
+    key: str = Field("", description="Name of the note; omit to list the saved notes.")
+
+
+class RunShellCommandArgs(BaseModel):
+    command: str = Field(description="Shell command to execute.")
+
+
+class RunTestsArgs(BaseModel):
+    full: bool = Field(False, description="Rerun every test instead of only those affected by changes.")
+
+
+class GitCommitArgs(BaseModel):
+    message: str = Field(description="Commit message.")
+    branch_name: Optional[str] = Field(None, description="Branch to commit to, created if needed; omit for the current branch.")
+    all_changes: bool = Field(False, description="Commit every change in the working tree, e.g. files created by shell commands, instead of only the files written with WriteFile or EditFile.")
+
+
+def _run_tests_tool(full: bool = False) -> str:
+    return run_tests(force=full)
+
+
+def _edit_args(edits) -> Optional[List[Dict[str, Any]]]:
+    return [edit if isinstance(edit, dict) else edit.model_dump(exclude_none=True) for edit in edits or []]
+
+
+def _edit_file_tool(path: str, edits=None, patch: Optional[str] = None, expected_hash: Optional[str] = None) -> str:
+    return edit_file(path, _edit_args(edits), patch, expected_hash)
+
+
+async def _aedit_file_tool(path: str, edits=None, patch: Optional[str] = None, expected_hash: Optional[str] = None) -> str:
+    return await aedit_file(path, _edit_args(edits), patch, expected_hash)
+
+
+def _typed_tool(name: str, func, coroutine, args_schema, description: str) -> StructuredTool:
+    return StructuredTool.from_function(func=func, coroutine=coroutine, name=name, description=description,
+                                        args_schema=args_schema)
+
+
+structured_worker_tools = [
+    _typed_tool("ReadFile", read_file, aread_file, PathArgs, "Reads the content of a file."),
+    _typed_tool("ReadFileLines", read_file_lines, _threaded(read_file_lines), ReadFileLinesArgs,
+                "Reads a range of lines from a file (1-based, inclusive)."),
+    _typed_tool("ReadFileBytes", read_file_bytes, _threaded(read_file_bytes), ReadFileBytesArgs,
+                "Reads a byte range from a file."),
+    _typed_tool("ReadFileHead", read_file_head, _threaded(read_file_head), ReadFileEndArgs,
+                "Reads the first lines of a file."),
+    _typed_tool("ReadFileTail", read_file_tail, _threaded(read_file_tail), ReadFileEndArgs,
+                "Reads the last lines of a file, e.g. the end of a log."),
+    _typed_tool("SearchFile", search_file, _threaded(search_file), SearchFileArgs,
+                "Finds lines matching a regex in a file and shows them with 2 lines of context and line numbers. Prefer this over ReadFile for large files."),
+    _typed_tool("SearchCode", search_code, _threaded(search_code), SearchCodeArgs,
+                "Searches every file in the workspace through an index and returns 'path:line: text' for each match. Prefer this over grep in RunShellCommand."),
+    _typed_tool("FindSymbol", find_symbol, _threaded(find_symbol), FindSymbolArgs,
+                "Finds where a Python class, function, method or module-level variable is defined."),
+    _typed_tool("WriteFile", write_file, awrite_file, WriteFileArgs,
+                "Writes content to a file, replacing it. To change part of an existing file use EditFile."),
+    _typed_tool("EditFile", _edit_file_tool, _aedit_file_tool, EditFileArgs,
+                "Changes part of an existing file without rewriting it, with search/replace edits, line-range edits or a unified diff. Returns the new content hash."),
+    _typed_tool("PutNote", put_note, _threaded(put_note), PutNoteArgs,
+                "Saves a value for later sub-tasks, which read it with GetNote; faster than a temporary file."),
+    _typed_tool("GetNote", get_note, _threaded(get_note), GetNoteArgs,
+                "Reads a value saved by an earlier sub-task with PutNote."),
+    _typed_tool("RunShellCommand", _flushing(_invalidating_index(run_command)),
+                _flushing(_invalidating_index(arun_command)), RunShellCommandArgs,
+                "Executes a shell command. Use with caution."),
+    _typed_tool("RunTests", _flushing(_run_tests_tool), _flushing(_threaded(_run_tests_tool)), RunTestsArgs,
+                "Runs project tests affected by changes since the last run (others come from cache) and returns a summary of failures."),
+    _typed_tool("GitCommit", _flushing(_invalidating_index(git_commit)), _flushing(_invalidating_index(agit_commit)),
+                GitCommitArgs,
+                "Commits the files changed with WriteFile or EditFile, optionally on another branch."),
+]
+compact_tools(structured_worker_tools, spill_exempt=READ_TOOLS, on_compacted=trace_compaction)
+instrument_tools(structured_worker_tools)
+# Tools whose calls from one model turn may run concurrently; the others run one at a time,
+# in order. Writes only conflict with calls on the same path (see tool_calling.plan_batches).
+PARALLEL_SAFE_TOOLS = READ_TOOLS | {"SearchCode", "FindSymbol", "WriteFile", "EditFile", "PutNote", "GetNote"}
+WRITE_TOOLS = {"WriteFile", "EditFile"}
+
 # --- State Definition ---
 
 
+def merge_worker_results(existing: Optional[List[Dict[str, Any]]], new: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Reducer for results written by concurrent workers in the same step.
+    Workers append their result; the orchestrator writes None to clear the
+    channel once it has folded the results into the plan.
+    """
+    if new is None:
+        return []
+    return (existing or []) + new
+
+
 class OrchestratorState(TypedDict):
     user_goal: str
-    plan: List[Dict[str, str]]
+    # Each subtask: {"id", "subtask", "depends_on", "status", "worker_assigned", "result", "result_ref"}.
+    # Large results live in the blob store: "result" holds a short digest, "result_ref" the reference.
+    plan: List[Dict[str, Any]]
+    # Number of subtasks completed so far (equals the next index for sequential plans).
     current_subtask_index: int
     messages: MessagesState
-    worker_output: Optional[str]
+    worker_results: Annotated[List[Dict[str, Any]], merge_worker_results]
+    worker_output: Optional[str]  # digest of the latest worker output
     worker_error: Optional[str]
     final_result: Optional[str]
     error_message: Optional[str]
+    # Scratchpad written with PutNote and read with GetNote (see blackboard.py).
+    notes: Annotated[Dict[str, Any], merge_notes]
+    # Number of times the rest of the plan was replanned after a failed subtask.
+    replans: int
+    # Worker waves dispatched by this invocation of the graph, bounded by run_wave_budget().
+    waves: int
+
+
+class WorkerInput(TypedDict, total=False):
+    """Payload sent to a single generic_worker invocation."""
+    subtask_index: int
+    subtask: str
+    # Structured step: the tool to call directly and its arguments (see FAST_PATH).
+    tool: Optional[str]
+    args: Optional[Dict[str, Any]]
+    # The run's notes when the subtask was dispatched.
+    notes: Dict[str, Any]
+
+
+# Upper bound on subtasks dispatched to concurrent workers in one step.
+MAX_PARALLEL_WORKERS = int(os.getenv("AGENT_MAX_PARALLEL_WORKERS", "4"))
 
 
 # --- Node Definitions ---
 
 PLANNING_PROMPT_TEMPLATE = (
     "You are a planning assistant. Your task is to take a user's goal and break it down into a series of actionable sub-tasks that can be executed by a worker agent.\n"
-    "The worker agent has access to tools for file system operations (read, write), shell command execution, running tests, and git commits.\n"
+    "The worker agent has access to tools for file system operations (read, write, edit), notes shared between sub-tasks, code search, shell command execution, running tests, and git commits.\n"
     "Each sub-task should be a clear, concise instruction that the worker can understand and execute.\n"
-    "IMPORTANT: If a sub-task needs data produced by a previous sub-task, the previous sub-task should save that data to a file, and the current sub-task should read it from that file. Alternatively, make each sub-task self-contained if possible.\n"
-    "Do NOT assume the worker remembers information from previous sub-tasks unless it's read from a file.\n\n"
+    "IMPORTANT: The worker does not remember previous sub-tasks. If a sub-task needs data produced by an earlier one (a value, a list of paths, a short summary), the earlier sub-task should save it as a note with the PutNote tool under a named key and the later sub-task, which must depend on it, should read it with GetNote. "
+    "Notes need no temporary files or cleanup steps; each holds up to {note_max_chars} characters, so only use files for data that belongs on disk or is larger. Alternatively, make each sub-task self-contained if possible.\n"
+    "Sub-tasks that do not depend on each other are executed concurrently, so only list a dependency when a sub-task really needs the other one to be finished first.\n\n"
+    "{structured_steps}"
     "User Goal: {user_goal}\n\n"
-    "Output your plan as a JSON list of strings, where each string is a sub-task. For example:\n"
-    '["Read the content of \'input.txt\' and store it in a temporary file named \'temp_data.txt\'", "Read \'temp_data.txt\', process its content, and write the result to \'output.txt\'", "Delete the temporary file \'temp_data.txt\'"]\n\n'
+    "Output your plan as a JSON list of objects. Each object has an integer \"id\", a \"subtask\" string and a \"depends_on\" list with the ids of the sub-tasks that must be finished before it can start. For example:\n"
+    '[{{"id": 1, "subtask": "Find the names of the failing tests in \'test_report.txt\' and save them as the note \'failing_tests\'", "depends_on": []}}, '
+    '{{"id": 2, "subtask": "Write a default configuration to \'config.json\'", "depends_on": []}}, '
+    '{{"id": 3, "subtask": "Read the note \'failing_tests\' and \'config.json\', and write a report of the failures to \'output.txt\'", "depends_on": [1, 2]}}]\n\n'
     "If the goal is very simple and requires only one step, provide a plan with a single sub-task.\n"
     "Do not include any commentary or explanation outside of the JSON list itself.\n\n"
     "Plan:"
 )
 
 
-def orchestrator_node(state: OrchestratorState) -> OrchestratorState:
-    logger.info(f"--- Orchestrator Node ---")
+# Sub-tasks that are exactly one tool call with known arguments may name the tool and its
+# arguments; the worker then calls the tool directly, without an LLM in the loop.
+FAST_PATH = os.getenv("AGENT_FAST_PATH", "on").lower() not in ("0", "false", "off", "no")
+
+STRUCTURED_STEPS_PROMPT = (
+    "If a sub-task is exactly one call of a worker tool whose arguments you already know (e.g. writing a file whose complete content you can give, running a given command, committing), "
+    "also give the \"tool\" name and its \"args\" object, e.g. "
+    '{{"id": 5, "subtask": "Commit all changes", "depends_on": [4], "tool": "GitCommit", "args": {{"message": "Add the todo app", "all_changes": true}}}}. '
+    "Such sub-tasks are executed directly, without the worker reasoning about them, so leave \"tool\" out whenever the sub-task needs reading, deciding or fixing anything.\n"
+    "Worker tools: {tool_signatures}\n\n"
+)
+
+
+def tool_signatures(tools: List[Any]) -> str:
+    """Compact 'Name(arg, optional_arg?)' list of typed tools for the planning prompt."""
+    signatures = []
+    for tool in tools:
+        fields = tool.args_schema.model_fields
+        signatures.append(f"{tool.name}({', '.join(name if field.is_required() else name + '?' for name, field in fields.items())})")
+    return ", ".join(signatures)
+
+
+def build_plan(json_response: Any) -> List[Dict[str, Any]]:
+    """
+    Turns the parsed planner output into plan entries.
+    Accepts the DAG format (list of {"id", "subtask", "depends_on"} objects, optionally
+    with the "tool" and "args" of a structured step) as well as the legacy flat list of
+    strings, which is treated as a sequential chain.
+    Raises ValueError if the output has an unexpected shape.
+    """
+    if not isinstance(json_response, list):
+        raise ValueError(f"plan is not a list (got {type(json_response).__name__})")
+
+    plan = []
+    previous_id = None
+    for position, item in enumerate(json_response):
+        tool, args = None, None
+        if isinstance(item, str):
+            subtask_id = str(position + 1)
+            description = item
+            depends_on = [previous_id] if previous_id is not None else []
+        elif isinstance(item, dict) and isinstance(item.get("subtask"), str):
+            subtask_id = str(item.get("id", position + 1))
+            description = item["subtask"]
+            raw_deps = item.get("depends_on") or []
+            if not isinstance(raw_deps, list):
+                raise ValueError(f"depends_on of subtask {subtask_id} is not a list")
+            depends_on = [str(dep) for dep in raw_deps]
+            # A malformed structured step is not fatal: the subtask text is run by the LLM worker.
+            if isinstance(item.get("tool"), str) and isinstance(item.get("args", {}), dict):
+                tool, args = item["tool"], item.get("args", {})
+        else:
+            raise ValueError(f"subtask at position {position} has an unexpected format: {item!r}")
+        plan.append({"id": subtask_id, "subtask": description, "depends_on": depends_on,
+                     "status": "pending", "worker_assigned": "DirectTool" if tool else "GenericWorker",
+                     "result": None, "result_ref": None, "tool": tool, "args": args})
+        previous_id = subtask_id
+    return plan
+
+
+def validate_plan_dag(plan: List[Dict[str, Any]]) -> Optional[str]:
+    """Returns an error description if the plan is not a valid DAG, otherwise None."""
+    ids = [item["id"] for item in plan]
+    if len(ids) != len(set(ids)):
+        return "Plan contains duplicate subtask ids."
+    known_ids = set(ids)
+    for item in plan:
+        unknown = [dep for dep in item["depends_on"] if dep not in known_ids]
+        if unknown:
+            return f"Subtask {item['id']} depends on unknown subtask ids: {unknown}."
+        if item["id"] in item["depends_on"]:
+            return f"Subtask {item['id']} depends on itself."
+
+    # Kahn's algorithm: every subtask must eventually become ready.
+    remaining = {item["id"]: set(item["depends_on"]) for item in plan}
+    while remaining:
+        ready = [subtask_id for subtask_id, deps in remaining.items() if not deps]
+        if not ready:
+            return f"Plan contains a dependency cycle between subtasks {sorted(remaining)}."
+        for subtask_id in ready:
+            del remaining[subtask_id]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return None
+
+
+def plan_depth(plan: List[Dict[str, Any]]) -> int:
+    """Length of the longest dependency chain, i.e. the number of worker waves needed."""
+    depth: Dict[str, int] = {}
+    by_id = {item["id"]: item for item in plan}
+
+    def _depth(subtask_id: str) -> int:
+        if subtask_id not in depth:
+            deps = by_id[subtask_id]["depends_on"]
+            depth[subtask_id] = 1 + max((_depth(dep) for dep in deps), default=0)
+        return depth[subtask_id]
+
+    return max((_depth(item["id"]) for item in plan), default=0)
+
+
+def plan_waves(plan: List[Dict[str, Any]]) -> int:
+    """
+    Worker waves needed for the subtasks of `plan` that are not done yet, if they all succeed.
+    Each wave runs the ready subtasks, at most MAX_PARALLEL_WORKERS of them (as
+    _dispatch_ready_subtasks does), so this is at least the plan depth and at least
+    len(plan) / MAX_PARALLEL_WORKERS.
+    """
+    done = {item["id"] for item in plan if item.get("status") == "done"}
+    remaining = [item for item in plan if item.get("status") != "done"]
+    waves = 0
+    while remaining:
+        ready = [item for item in remaining if all(dep in done for dep in item["depends_on"])][:MAX_PARALLEL_WORKERS]
+        if not ready:
+            break  # unsatisfiable dependencies, reported by validate_plan_dag
+        done.update(item["id"] for item in ready)
+        remaining = [item for item in remaining if item["id"] not in done]
+        waves += 1
+    return waves
+
+
+def recursion_limit_for(waves: int) -> int:
+    """
+    Graph steps needed for `waves` worker waves: one orchestrator step and one (fanned out)
+    worker step each, plus the initial planning step and some slack.
+    """
+    return 2 * waves + 5
+
+
+# Largest plan accepted, in worker waves (see plan_waves). Larger plans are rejected when
+# they are built, so a run never hits the graph's recursion limit partway through.
+MAX_PLAN_WAVES = int(os.getenv("AGENT_MAX_PLAN_DEPTH", "25"))
+
+
+def plan_size_error(plan: List[Dict[str, Any]]) -> Optional[str]:
+    """Returns an error description if the plan needs more worker waves than allowed, otherwise None."""
+    waves = plan_waves(plan)
+    if waves <= MAX_PLAN_WAVES:
+        return None
+    return (f"Plan needs {waves} worker waves (depth {plan_depth(plan)}, {len(plan)} subtasks, at most "
+            f"{MAX_PARALLEL_WORKERS} at a time); at most {MAX_PLAN_WAVES} are allowed (AGENT_MAX_PLAN_DEPTH).")
+
+
+def run_wave_budget() -> int:
+    """
+    Worker waves one run may dispatch: the largest allowed plan, stretched by a retry of each
+    wave, for the first plan and for every allowed replan (see _recover_from_failure).
+    """
+    return MAX_PLAN_WAVES * (1 + SUBTASK_RETRIES) * (1 + MAX_REPLANS)
+
+
+def ready_subtask_indices(plan: List[Dict[str, Any]]) -> List[int]:
+    """Indices of pending subtasks whose dependencies are all done."""
+    done_ids = {item["id"] for item in plan if item.get("status") == "done"}
+    return [index for index, item in enumerate(plan)
+            if item.get("status") == "pending" and all(dep in done_ids for dep in item.get("depends_on", []))]
+
+
+def _planning_prompt(state: OrchestratorState) -> Optional[str]:
+    """Builds the planning prompt, or records an error and returns None if planning is impossible."""
     user_goal = state.get("user_goal", "")
+    logger.info(
+        f"Orchestrator: No plan. Attempting to generate plan for goal: {user_goal}")
+    if not get_orchestrator_llm():
+        logger.error(
+            "Orchestrator LLM not available. Cannot generate plan.")
+        state["error_message"] = "Orchestrator LLM not initialized. Cannot plan."
+        return None
+    structured_steps = (STRUCTURED_STEPS_PROMPT.format(tool_signatures=tool_signatures(structured_worker_tools))
+                        if FAST_PATH else "")
+    prompt = PLANNING_PROMPT_TEMPLATE.format(user_goal=user_goal, structured_steps=structured_steps,
+                                             note_max_chars=MAX_NOTE_CHARS)
+    logger.info(
+        f"Orchestrator: Sending planning prompt to LLM (first 100 chars): {prompt[:100]}...")
+    return prompt
+
+
+def _apply_planning_response(state: OrchestratorState, response_text: Any) -> None:
+    """Parses and validates the planner's response and stores the plan (or an error) in the state."""
+    # Correction : extraire le contenu réel si c'est un objet avec .content
+    if hasattr(response_text, "content"):
+        response_text = response_text.content
+    logger.info(
+        f"Orchestrator: LLM planning response (raw): {response_text}")
+
+    json_response = None
+    if isinstance(response_text, str):
+        try:
+            # Extraction robuste du JSON (greedy: the list contains nested lists/objects)
+            match = re.search(
+                r'\s*(\[.*\])\s*', response_text, re.DOTALL)
+            if match:
+                json_str = match.group(1)
+                json_response = json.loads(json_str)
+            else:
+                logger.error(
+                    "Orchestrator: No JSON list found in LLM response for plan using regex.")
+                state["error_message"] = "No JSON list in LLM plan response (regex)."
+        except json.JSONDecodeError as e:
+            logger.error(
+                f"Orchestrator: Failed to parse plan JSON from LLM response (regex): {e}. Response was: {response_text}")
+            state["error_message"] = f"Failed to parse plan from LLM (regex): {e}"
+            return
+
+    # If json_response is None, error_message should already be set by the parsing attempt
+    if json_response is None:
+        return
+    try:
+        new_plan = build_plan(json_response)
+    except ValueError as e:
+        logger.error(
+            f"Orchestrator: Parsed plan has incorrect format: {e}. Received: {json_response}")
+        state["error_message"] = f"LLM plan has incorrect format: {e}"
+        return
+    dag_error = validate_plan_dag(new_plan)
+    if not new_plan:
+        logger.warning(
+            "Orchestrator: LLM generated an empty plan.")
+        state["error_message"] = "LLM generated an empty plan."
+    elif dag_error:
+        logger.error(f"Orchestrator: Invalid plan DAG: {dag_error}")
+        state["error_message"] = f"Invalid plan: {dag_error}"
+    elif plan_size_error(new_plan):
+        size_error = plan_size_error(new_plan)
+        logger.error(f"Orchestrator: Plan too large: {size_error}")
+        state["error_message"] = f"Invalid plan: {size_error}"
+    else:
+        state["plan"] = new_plan
+        state["current_subtask_index"] = 0
+        logger.info(
+            f"Orchestrator: Successfully generated and parsed plan ({len(new_plan)} subtasks, depth {plan_depth(new_plan)}): {new_plan}")
+
+
+def plan_summary(plan: List[Dict[str, Any]]) -> str:
+    """One-line status overview of a plan, cheap to log at every step."""
+    return " ".join(f"{item['id']}:{item.get('status')}" for item in plan)
+
+
+def subtask_result(item: Dict[str, Any]) -> Optional[str]:
+    """Full result of a plan entry, loaded from the blob store if it was externalized."""
+    return resolve(item.get("result_ref"), item.get("result"))
+
+
+def _fold_worker_results(state: OrchestratorState, worker_results: List[Dict[str, Any]]) -> None:
+    """Marks the subtasks of the finished wave as done/failed and records their results."""
     plan = state.get("plan", [])
-    current_subtask_index = state.get("current_subtask_index", 0)
+    for worker_result in sorted(worker_results, key=lambda r: r["subtask_index"]):
+        index = worker_result["subtask_index"]
+        logger.info(
+            f"Orchestrator: Received output from worker for subtask {index}: {worker_result['output'][:200]}")
+        if not (plan and 0 <= index < len(plan)):
+            continue
+        if worker_result.get("error"):
+            plan[index]["status"] = "failed"
+            plan[index]["attempts"] = plan[index].get("attempts", 0) + 1
+            plan[index]["result"] = worker_result["output"]
+            plan[index]["result_ref"] = worker_result.get("output_ref")
+            state["worker_error"] = worker_result["error"]
+        else:
+            plan[index]["status"] = "done"
+            plan[index]["result"] = worker_result["output"]
+            plan[index]["result_ref"] = worker_result.get("output_ref")
+            state["worker_output"] = worker_result["output"]
+    if worker_results:
+        state["current_subtask_index"] = sum(
+            1 for item in plan if item.get("status") == "done")
+        logger.info(
+            f"Orchestrator: Updated plan: {plan_summary(plan)}, completed: {state['current_subtask_index']}/{len(plan)}")
+
+
+def worker_payload(plan: List[Dict[str, Any]], index: int) -> WorkerInput:
+    """generic_worker input for a plan entry."""
+    item = plan[index]
+    payload: WorkerInput = {"subtask_index": index, "subtask": item["subtask"]}
+    if item.get("tool"):
+        payload.update(tool=item["tool"], args=item.get("args") or {})
+    return payload
 
+
+def _dispatch_ready_subtasks(state: OrchestratorState) -> None:
+    """Marks every subtask whose dependencies are satisfied as running; should_continue fans them out."""
+    plan = state.get("plan", [])
+    if plan and not state.get("worker_error") and not state.get("error_message"):
+        ready = ready_subtask_indices(plan)[:MAX_PARALLEL_WORKERS]
+        if not ready:
+            return
+        # Checked here rather than left to the graph's recursion limit, so the run ends cleanly.
+        waves, budget = state.get("waves") or 0, run_wave_budget()
+        if waves >= budget:
+            logger.error(f"Orchestrator: Run used up its budget of {budget} worker waves.")
+            state["error_message"] = (f"Run used up its budget of {budget} worker waves "
+                                      f"(AGENT_MAX_PLAN_DEPTH, AGENT_SUBTASK_RETRIES, AGENT_MAX_REPLANS).")
+            return
+        for index in ready:
+            plan[index]["status"] = "running"
+        state["plan"] = plan
+        state["waves"] = waves + 1
+
+
+def _begin_orchestrator_step(state: OrchestratorState) -> List[Dict[str, Any]]:
+    """Resets per-step fields and returns the worker results to fold into the plan."""
+    logger.info(f"--- Orchestrator Node ---")
+    worker_results = state.get("worker_results") or []
     state["worker_error"] = None
     state["error_message"] = None
+    # Clear the reducer channel; its results are folded into the plan.
+    state["worker_results"] = None
+    return worker_results
+
+
+def _needs_plan(state: OrchestratorState) -> bool:
+    return not state.get("plan") and bool(state.get("user_goal"))
+
+
+def _plan_from_library(state: OrchestratorState) -> bool:
+    """Uses the stored plan of a similar earlier goal if the plan library has one (no planner call)."""
+    library = get_plan_library()
+    if not library:
+        return False
+    try:
+        match = library.lookup(state.get("user_goal", ""))
+        if not match:
+            return False
+        stored_plan, similarity, stored_goal = match
+        plan = build_plan(stored_plan)
+    except Exception as e:
+        logger.error(f"Orchestrator: Plan library lookup failed: {e}. Planning from scratch.")
+        return False
+    if not plan or validate_plan_dag(plan) or plan_size_error(plan):
+        return False
+    state["plan"] = plan
+    state["current_subtask_index"] = 0
+    logger.info(
+        f"Orchestrator: Reusing the plan of '{stored_goal}' (similarity {similarity:.2f}, {len(plan)} subtasks); planner skipped.")
+    return True
 
-    if not plan and user_goal:
-        logger.info(
-            f"Orchestrator: No plan. Attempting to generate plan for goal: {user_goal}")
-        if not orchestrator_llm:
-            logger.error(
-                "Orchestrator LLM not available. Cannot generate plan.")
-            state["error_message"] = "Orchestrator LLM not initialized. Cannot plan."
-            return state
 
+def _remember_plan(state: OrchestratorState) -> None:
+    """Adds the plan to the plan library once all of its subtasks are done."""
+    plan = state.get("plan") or []
+    library = get_plan_library()
+    if library and plan and all(item.get("status") == "done" for item in plan):
         try:
-            prompt = PLANNING_PROMPT_TEMPLATE.format(user_goal=user_goal)
-            logger.info(
-                f"Orchestrator: Sending planning prompt to LLM (first 100 chars): {prompt[:100]}...")
-            response_text = orchestrator_llm.invoke(prompt)
-            # Correction : extraire le contenu réel si c'est un objet avec .content
-            if hasattr(response_text, "content"):
-                response_text = response_text.content
-            logger.info(
-                f"Orchestrator: LLM planning response (raw): {response_text}")
-
-            json_response = None
-            if isinstance(response_text, str):
-                try:
-                    # Extraction robuste du JSON
-                    match = re.search(
-                        r'\s*(\[.*?\])\s*', response_text, re.DOTALL)
-                    if match:
-                        json_str = match.group(1)
-                        json_response = json.loads(json_str)
-                    else:
-                        logger.error(
-                            "Orchestrator: No JSON list found in LLM response for plan using regex.")
-                        state["error_message"] = "No JSON list in LLM plan response (regex)."
-                except json.JSONDecodeError as e:
-                    logger.error(
-                        f"Orchestrator: Failed to parse plan JSON from LLM response (regex): {e}. Response was: {response_text}")
-                    state["error_message"] = f"Failed to parse plan from LLM (regex): {e}"
-                    return state  # Exit early if parsing fails
-
-            if isinstance(json_response, list) and all(isinstance(item, str) for item in json_response):
-                new_plan = [{"subtask": desc, "status": "pending",
-                             "worker_assigned": "GenericWorker", "result": None} for desc in json_response]
-                if not new_plan:
-                    logger.warning(
-                        "Orchestrator: LLM generated an empty plan.")
-                    state["error_message"] = "LLM generated an empty plan."
+            library.store(state.get("user_goal", ""), plan)
+            logger.info("Orchestrator: Stored the completed plan in the plan library.")
+        except Exception as e:
+            logger.error(f"Orchestrator: Failed to store plan in the library: {e}")
+
+
+# --- Recovery from failed subtasks ---
+# A failed subtask is first rerun as is (up to SUBTASK_RETRIES times, e.g. for a flaky
+# command); after that the planner is asked for a new plan for the remaining work only,
+# given the completed subtasks and the failure, up to MAX_REPLANS times per run. Completed
+# subtasks, their file changes and their notes are kept, so a late failure costs one
+# planning call instead of rerunning the whole goal.
+SUBTASK_RETRIES = int(os.getenv("AGENT_SUBTASK_RETRIES", "1"))
+MAX_REPLANS = int(os.getenv("AGENT_MAX_REPLANS", "2"))
+
+REPLANNING_PROMPT_TEMPLATE = (
+    "You are a planning assistant. A worker agent was executing a plan for the user's goal and a sub-task failed. "
+    "Plan the remaining work only: the completed sub-tasks below stay done, and their file changes and notes are kept.\n"
+    "The worker agent has access to tools for file system operations (read, write, edit), notes shared between sub-tasks (PutNote/GetNote), code search, shell command execution, running tests, and git commits. "
+    "It does not remember previous sub-tasks except through files and notes.\n\n"
+    "{structured_steps}"
+    "User Goal: {user_goal}\n\n"
+    "Completed sub-tasks (id, sub-task, result):\n{completed}\n\n"
+    "Failed sub-task(s):\n{failed}\n\n"
+    "Sub-tasks that were still planned:\n{remaining}\n\n"
+    "Output a JSON list of new sub-task objects for what is left to do. Each object has an integer \"id\" (numbered from {next_id}), a \"subtask\" string and a \"depends_on\" list, "
+    "which may name completed sub-tasks as well as new ones. Avoid the cause of the failure, e.g. by inspecting the problem first or taking another approach; do not repeat completed sub-tasks. "
+    "If the goal cannot be reached, output [].\n"
+    "Do not include any commentary or explanation outside of the JSON list itself.\n\n"
+    "Plan:"
+)
+
+
+def _retry_failed_subtasks(state: OrchestratorState) -> bool:
+    """Puts failed subtasks back to pending if all of them have retries left; returns whether it did."""
+    plan = state.get("plan") or []
+    failed = [item for item in plan if item.get("status") == "failed"]
+    if not failed or any(item.get("attempts", 0) > SUBTASK_RETRIES for item in failed):
+        return False
+    for item in failed:
+        item["status"] = "pending"
+        logger.info(f"Orchestrator: Retrying failed subtask {item['id']} (attempt {item.get('attempts', 0) + 1}).")
+    state["worker_error"] = None
+    return True
+
+
+def _plan_lines(items: List[Dict[str, Any]], with_results: bool = False) -> str:
+    lines = []
+    for item in items:
+        line = f"- [{item['id']}] {item['subtask']}"
+        if item.get("depends_on"):
+            line += f" (depends on {', '.join(item['depends_on'])})"
+        if with_results:
+            line += f"\n  Result: {digest_text(item.get('result') or '')}"
+        lines.append(line)
+    return "\n".join(lines) or "(none)"
+
+
+def _replanning_prompt(state: OrchestratorState) -> Optional[str]:
+    """Prompt asking for a new plan for the rest of the goal, or None if the replan budget is used up."""
+    replans = state.get("replans") or 0
+    if replans >= MAX_REPLANS:
+        logger.error(f"Orchestrator: Replanning budget used up ({replans}/{MAX_REPLANS}); ending the run.")
+        return None
+    if not get_orchestrator_llm():
+        return None
+    plan = state.get("plan") or []
+    numeric_ids = [int(item["id"]) for item in plan if str(item["id"]).isdigit()]
+    structured_steps = (STRUCTURED_STEPS_PROMPT.format(tool_signatures=tool_signatures(structured_worker_tools))
+                        if FAST_PATH else "")
+    prompt = REPLANNING_PROMPT_TEMPLATE.format(
+        structured_steps=structured_steps, user_goal=state.get("user_goal", ""),
+        completed=_plan_lines([item for item in plan if item.get("status") == "done"], with_results=True),
+        failed=_plan_lines([item for item in plan if item.get("status") == "failed"], with_results=True),
+        remaining=_plan_lines([item for item in plan if item.get("status") == "pending"]),
+        next_id=max(numeric_ids, default=len(plan)) + 1)
+    logger.info(f"Orchestrator: Replanning after failure ({replans + 1}/{MAX_REPLANS}): {state.get('worker_error')}")
+    return prompt
+
+
+def _renumber_suffix(suffix: List[Dict[str, Any]], taken: set) -> None:
+    """Gives new subtasks whose ids clash with kept ones fresh ids (e.g. a flat list numbered from 1)."""
+    if not any(item["id"] in taken for item in suffix):
+        return
+    next_id = max((int(subtask_id) for subtask_id in taken if subtask_id.isdigit()), default=0) + 1
+    renamed = {item["id"]: str(next_id + position) for position, item in enumerate(suffix)}
+    for item in suffix:
+        item["id"] = renamed[item["id"]]
+        item["depends_on"] = [renamed.get(dep, dep) for dep in item["depends_on"]]
+
+
+def _apply_replanning_response(state: OrchestratorState, response_text: Any) -> None:
+    """Replaces the failed and pending subtasks with the planner's new suffix, keeping the completed ones."""
+    if hasattr(response_text, "content"):
+        response_text = response_text.content
+    logger.info(f"Orchestrator: LLM replanning response (raw): {response_text}")
+    try:
+        match = re.search(r'\s*(\[.*\])\s*', response_text or "", re.DOTALL)
+        if not match:
+            raise ValueError("no JSON list in the response")
+        suffix = build_plan(json.loads(match.group(1)))
+        if not suffix:
+            raise ValueError("the planner found no way to complete the goal")
+        kept = [item for item in state.get("plan") or [] if item.get("status") == "done"]
+        _renumber_suffix(suffix, {item["id"] for item in kept})
+        new_plan = kept + suffix
+        dag_error = validate_plan_dag(new_plan) or plan_size_error(new_plan)
+        if dag_error:
+            raise ValueError(dag_error)
+    except (ValueError, json.JSONDecodeError) as e:
+        logger.error(f"Orchestrator: Replanning failed: {e}")
+        state["worker_error"] = f"{state.get('worker_error')} (replanning failed: {e})"
+        return
+    state["plan"] = new_plan
+    state["replans"] = (state.get("replans") or 0) + 1
+    state["current_subtask_index"] = len(kept)
+    state["worker_error"] = None
+    logger.info(f"Orchestrator: Replanned the rest of the goal: kept {len(kept)} completed subtask(s), "
+                f"{len(suffix)} new: {plan_summary(new_plan)}")
+
+
+def _recover_from_failure(state: OrchestratorState) -> None:
+    """Retries or replans after a failed subtask; leaves worker_error set (ending the run) if neither is possible."""
+    if not state.get("worker_error") or _retry_failed_subtasks(state):
+        return
+    prompt = _replanning_prompt(state)
+    if prompt is None:
+        return
+    try:
+        _apply_replanning_response(state, get_orchestrator_llm().invoke(prompt))
+    except Exception as e:
+        logger.error(f"Orchestrator: Exception during replanning: {e}", exc_info=True)
+
+
+async def _arecover_from_failure(state: OrchestratorState) -> None:
+    """Async variant of _recover_from_failure."""
+    if not state.get("worker_error") or _retry_failed_subtasks(state):
+        return
+    prompt = _replanning_prompt(state)
+    if prompt is None:
+        return
+    try:
+        _apply_replanning_response(state, await get_orchestrator_llm().ainvoke(prompt))
+    except Exception as e:
+        logger.error(f"Orchestrator: Exception during replanning: {e}", exc_info=True)
+
+
+# Stream the planner's response and start subtasks without dependencies as soon as their
+# entry is complete, while the rest of the plan is still being generated (see plan_stream.py).
+PLAN_STREAMING = os.getenv("AGENT_PLAN_STREAMING", "on").lower() not in ("0", "false", "off", "no")
+
+
+class _EarlyRun:
+    """A worker started from the streamed plan before the planner finished answering."""
+
+    def __init__(self, payload: WorkerInput, asynchronous: bool):
+        self.payload = payload
+        self.handle = None  # asyncio.Task (async graph) or concurrent.futures.Future (sync graph)
+        # Set once the complete plan is parsed; the run only commits its file writes if `keep`.
+        self.decided = asyncio.Event() if asynchronous else threading.Event()
+        self.keep = False
+
+    def decide(self, keep: bool) -> None:
+        self.keep = keep
+        self.decided.set()
+
+
+class _DiscardedEarlyRun(Exception):
+    """Raised inside an early run's overlay when its subtask is not in the final plan."""
+
+
+# Early runs waiting for their generic_worker step, keyed by (thread id, subtask index, subtask).
+_early_runs: Dict[Tuple[str, int, str], _EarlyRun] = {}
+_early_runs_lock = threading.Lock()
+_early_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _run_key() -> str:
+    try:
+        return str(get_config().get("configurable", {}).get("thread_id", ""))
+    except RuntimeError:  # called outside a graph run
+        return ""
+
+
+def _shell_session_name(state: WorkerInput) -> str:
+    """The subtask's own shell session, scoped to the run so concurrent runs never share one."""
+    run_key = _run_key() or uuid.uuid4().hex
+    return f"{run_key}:subtask-{state.get('subtask_index')}"
+
+
+def _early_run_key(state: WorkerInput) -> Tuple[str, int, str]:
+    return _run_key(), state.get("subtask_index", -1), state.get("subtask", "")
+
+
+def _claim_early_run(state: WorkerInput) -> Optional[_EarlyRun]:
+    with _early_runs_lock:
+        early = _early_runs.pop(_early_run_key(state), None)
+    if early is not None:
+        annotate_span(started_early=True)
+        logger.info(f"Worker: Subtask {state.get('subtask_index')} was started while the plan was streaming; awaiting its result.")
+    return early
+
+
+def _discarded_result(state: WorkerInput) -> Dict[str, Any]:
+    logger.info(f"Worker: Early run of subtask {state.get('subtask_index')} is not part of the final plan; "
+                f"its file writes were rolled back.")
+    return _worker_result(state, "Discarded: not part of the final plan.", "Early run discarded.")
+
+
+@traced("node", "early_worker", attrs=lambda run: {"subtask_index": run.payload.get("subtask_index")})
+def _run_early(run: _EarlyRun) -> Dict[str, Any]:
+    return _run_worker(run.payload, run)
+
+
+@traced("node", "early_worker", attrs=lambda run: {"subtask_index": run.payload.get("subtask_index")})
+async def _arun_early(run: _EarlyRun) -> Dict[str, Any]:
+    return await _arun_worker(run.payload, run)
+
+
+def _get_early_pool() -> ThreadPoolExecutor:
+    global _early_pool
+    with _init_lock:
+        if _early_pool is None:
+            _early_pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_WORKERS, thread_name_prefix="early-worker")
+    return _early_pool
+
+
+def _chunk_text(chunk: Any) -> str:
+    return chunk if isinstance(chunk, str) else message_text(chunk)
+
+
+class _EarlyDispatcher:
+    """Feeds the streamed planner response to the parser and starts ready subtasks early."""
+
+    def __init__(self, asynchronous: bool):
+        self.asynchronous = asynchronous
+        self.parser = PlanStreamParser()
+        self.parts: List[str] = []
+        self.runs: List[_EarlyRun] = []
+        self.malformed = False
+        self.run_key = _run_key()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, text: str) -> None:
+        self.parts.append(text)
+        if self.malformed or self.parser.done:
+            return
+        try:
+            completed = self.parser.feed(text)
+        except ValueError as e:
+            # The complete response is still parsed the regular way once it has arrived.
+            logger.warning(f"Orchestrator: Streamed plan is malformed ({e}); waiting for the complete response.")
+            self.malformed = True
+            return
+        for _ in completed:
+            self._start_if_ready()
+
+    def _start_if_ready(self) -> None:
+        if len(self.runs) >= MAX_PARALLEL_WORKERS:
+            return
+        try:
+            partial_plan = build_plan(self.parser.elements)
+        except ValueError:
+            return  # the final parse reports the problem
+        entry, index = partial_plan[-1], len(partial_plan) - 1
+        if entry["depends_on"]:
+            return
+        run = _EarlyRun(worker_payload(partial_plan, index), self.asynchronous)
+        with _early_runs_lock:
+            _early_runs[(self.run_key, index, entry["subtask"])] = run
+        if self.asynchronous:
+            run.handle = asyncio.get_running_loop().create_task(_arun_early(run))
+        else:
+            # The copied context carries the orchestrator's trace span to the early run.
+            run.handle = _get_early_pool().submit(contextvars.copy_context().run, _run_early, run)
+        self.runs.append(run)
+        logger.info(f"Orchestrator: Started subtask {entry['id']} while the plan is still streaming.")
+
+    def settle(self, state: OrchestratorState, planned: bool) -> None:
+        """Keeps the early runs the final plan dispatches now and discards the others."""
+        plan = state.get("plan") or []
+        dispatched = set()
+        if planned and not state.get("error_message"):
+            dispatched = set(ready_subtask_indices(plan)[:MAX_PARALLEL_WORKERS])
+        for run in self.runs:
+            index = run.payload["subtask_index"]
+            keep = index in dispatched and worker_payload(plan, index) == run.payload
+            if not keep:
+                with _early_runs_lock:
+                    _early_runs.pop((self.run_key, index, run.payload["subtask"]), None)
+                run.handle.cancel()
+            run.decide(keep)
+        if self.runs:
+            kept = sum(run.keep for run in self.runs)
+            logger.info(f"Orchestrator: {kept} of {len(self.runs)} early subtask run(s) kept for the final plan.")
+
+
+def _stream_plan(state: OrchestratorState, prompt: str) -> None:
+    """Streams the planner's response, starting ready subtasks early, and applies the plan."""
+    llm = get_orchestrator_llm()
+    cached = cached_response(llm, prompt)
+    if cached is not None:
+        _apply_planning_response(state, cached)
+        return
+    dispatcher, planned = _EarlyDispatcher(asynchronous=False), False
+    try:
+        for chunk in llm.stream(prompt):
+            dispatcher.feed(_chunk_text(chunk))
+        cache_response(llm, prompt, dispatcher.text)
+        _apply_planning_response(state, dispatcher.text)
+        planned = True
+    finally:
+        dispatcher.settle(state, planned)
+
+
+async def _astream_plan(state: OrchestratorState, prompt: str) -> None:
+    """Async variant of _stream_plan."""
+    llm = get_orchestrator_llm()
+    cached = await asyncio.to_thread(cached_response, llm, prompt)
+    if cached is not None:
+        _apply_planning_response(state, cached)
+        return
+    dispatcher, planned = _EarlyDispatcher(asynchronous=True), False
+    try:
+        async for chunk in llm.astream(prompt):
+            dispatcher.feed(_chunk_text(chunk))
+        await asyncio.to_thread(cache_response, llm, prompt, dispatcher.text)
+        _apply_planning_response(state, dispatcher.text)
+        planned = True
+    finally:
+        dispatcher.settle(state, planned)
+
+
+@traced("node", "orchestrator")
+def orchestrator_node(state: OrchestratorState) -> OrchestratorState:
+    worker_results = _begin_orchestrator_step(state)
+    if _needs_plan(state):
+        if not _plan_from_library(state):
+            prompt = _planning_prompt(state)
+            if prompt is None:
+                return state
+            try:
+                if PLAN_STREAMING:
+                    _stream_plan(state, prompt)
                 else:
-                    state["plan"] = new_plan
-                    state["current_subtask_index"] = 0
-                    logger.info(
-                        f"Orchestrator: Successfully generated and parsed plan: {new_plan}")
-            elif json_response is not None:
+                    _apply_planning_response(state, get_orchestrator_llm().invoke(prompt))
+            except Exception as e:
                 logger.error(
-                    f"Orchestrator: Parsed plan is not a list of strings. Received: {type(json_response)} {json_response}")
-                state["error_message"] = "LLM plan has incorrect format (not a list of strings)."
-            # If json_response is None, error_message should already be set by the parsing attempt
-
-        except Exception as e:
-            logger.error(
-                f"Orchestrator: Exception during plan generation: {e}", exc_info=True)
-            state["error_message"] = f"Exception during plan generation: {str(e)}"
-            return state
+                    f"Orchestrator: Exception during plan generation: {e}", exc_info=True)
+                state["error_message"] = f"Exception during plan generation: {str(e)}"
+                return state
     else:
-        worker_output = state.pop("worker_output", None)
-        if worker_output:
-            logger.info(
-                f"Orchestrator: Received output from worker: {worker_output}")
-            if plan and 0 <= current_subtask_index < len(plan):
-                plan[current_subtask_index]["status"] = "done"
-                plan[current_subtask_index]["result"] = worker_output
-            state["current_subtask_index"] = current_subtask_index + 1
-            logger.info(
-                f"Orchestrator: Updated plan: {plan}, next index: {state['current_subtask_index']}")
+        _fold_worker_results(state, worker_results)
+        _recover_from_failure(state)
+        if worker_results:
+            _remember_plan(state)
+    _dispatch_ready_subtasks(state)
+    return state
+
 
+@traced("node", "orchestrator")
+async def aorchestrator_node(state: OrchestratorState) -> OrchestratorState:
+    """Async variant of orchestrator_node, used by app.ainvoke/app.astream."""
+    worker_results = _begin_orchestrator_step(state)
+    if _needs_plan(state):
+        if not await asyncio.to_thread(_plan_from_library, state):
+            prompt = _planning_prompt(state)
+            if prompt is None:
+                return state
+            try:
+                if PLAN_STREAMING:
+                    await _astream_plan(state, prompt)
+                else:
+                    _apply_planning_response(state, await get_orchestrator_llm().ainvoke(prompt))
+            except Exception as e:
+                logger.error(
+                    f"Orchestrator: Exception during plan generation: {e}", exc_info=True)
+                state["error_message"] = f"Exception during plan generation: {str(e)}"
+                return state
+    else:
+        _fold_worker_results(state, worker_results)
+        await _arecover_from_failure(state)
+        if worker_results:
+            await asyncio.to_thread(_remember_plan, state)
+    _dispatch_ready_subtasks(state)
     return state
 
 
 _worker_agent_executor = None
+# "tool_calling": typed tool calls through the model's function-calling API, with the calls of
+# one turn run concurrently (see tool_calling.py); "react": text-based ReAct agent; "auto"
+# (default): tool calling if the worker LLM supports it, otherwise ReAct.
+WORKER_MODE = os.getenv("AGENT_WORKER_MODE", "auto").lower()
+WORKER_MAX_ITERATIONS = int(os.getenv("AGENT_WORKER_MAX_ITERATIONS", "5"))
+MAX_PARALLEL_TOOL_CALLS = int(os.getenv("AGENT_MAX_PARALLEL_TOOL_CALLS", "8"))
+# Buffer each subtask's file writes in memory and write them in one batch when it succeeds;
+# a failing subtask leaves the files as they were (see tools.file_system.overlay_transaction).
+FILE_OVERLAY = os.getenv("AGENT_FILE_OVERLAY", "on").lower() not in ("0", "false", "off", "no")
+
+
+def _subtask_overlay():
+    return overlay_transaction() if FILE_OVERLAY else contextlib.nullcontext()
+
+
+def _asubtask_overlay():
+    return aoverlay_transaction() if FILE_OVERLAY else contextlib.nullcontext()
+
+
+def _use_tool_calling(llm) -> bool:
+    if WORKER_MODE == "react":
+        return False
+    if supports_tool_calling(llm):
+        return True
+    if WORKER_MODE == "tool_calling":
+        logger.warning("Worker: The worker LLM has no tool-calling API; falling back to the ReAct agent.")
+    return False
 
 
-def generic_worker_node(state: OrchestratorState) -> OrchestratorState:
+def _get_worker_agent_executor():
     global _worker_agent_executor
-    logger.info(f"--- Generic Worker Node ---")
-    if not worker_llm:
-        state["worker_output"] = "Error: Worker LLM not initialized."
-        state["worker_error"] = "Worker LLM not initialized."
-        return state
-
-    current_plan = state.get("plan", [])
-    current_subtask_idx = state.get("current_subtask_index", 0)
-
-    if not current_plan or not (0 <= current_subtask_idx < len(current_plan)):
-        state["worker_output"] = "Error: No valid subtask for worker."
-        state["worker_error"] = "No valid subtask for worker."
-        return state
-
-    subtask_details = current_plan[current_subtask_idx]
-    subtask_description = subtask_details.get("subtask")
-    if not subtask_description:
-        state["worker_output"] = "Error: Subtask description missing."
-        state["worker_error"] = "Subtask description missing."
-        return state
-
-    logger.info(f"Worker: Received subtask: {subtask_description}")
-    try:
+    with _init_lock:
         if _worker_agent_executor is None:
+            llm = get_worker_llm()
+            if _use_tool_calling(llm):
+                logger.info("Worker: Initializing tool-calling agent...")
+                _worker_agent_executor = ToolCallingExecutor(
+                    llm, structured_worker_tools, parallel_safe=PARALLEL_SAFE_TOOLS, writers=WRITE_TOOLS,
+                    max_iterations=WORKER_MAX_ITERATIONS, max_parallel_calls=MAX_PARALLEL_TOOL_CALLS)
+                logger.info("Worker: Tool-calling agent initialized.")
+                return _worker_agent_executor
+            # langchain.agents is slow to import, so it is only loaded once a worker needs it.
+            from langchain.agents import initialize_agent, AgentType
             logger.info("Worker: Initializing ReAct agent...")
             _worker_agent_executor = initialize_agent(
-                worker_tools, worker_llm, agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-                verbose=True, handle_parsing_errors=True, max_iterations=5
+                worker_tools, llm, agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+                verbose=True, handle_parsing_errors=True, max_iterations=WORKER_MAX_ITERATIONS
             )
             logger.info("Worker: ReAct agent initialized.")
+    return _worker_agent_executor
 
-        logger.info(
-            f"Worker: Executing subtask '{subtask_description}' with ReAct agent...")
-        response_dict = _worker_agent_executor.invoke(
-            {"input": subtask_description})
-        worker_result = response_dict.get(
-            "output", "No output from worker agent.")
 
+def _executor_kind(executor) -> str:
+    return "tool-calling agent" if isinstance(executor, ToolCallingExecutor) else "ReAct agent"
+
+
+def _worker_result(state: WorkerInput, output: str, error: Optional[str],
+                   notes: Optional[SubtaskNotes] = None) -> Dict[str, Any]:
+    # Large outputs go to the blob store; only a reference and a digest travel in the state.
+    output_ref, output_digest = externalize(output)
+    result = {"worker_results": [{"subtask_index": state.get("subtask_index", -1), "output": output_digest,
+                                  "output_ref": output_ref, "error": error}]}
+    if notes is not None and notes.written:
+        # Merged into the run's notes by the reducer; failed subtasks pass none.
+        result["notes"] = notes.written
+    return result
+
+
+def _check_worker_input(state: WorkerInput) -> Optional[Dict[str, Any]]:
+    """Returns an error result if the worker cannot run the subtask, otherwise None."""
+    logger.info(f"--- Generic Worker Node ---")
+    if not state.get("tool") and not get_worker_llm():
+        return _worker_result(state, "Error: Worker LLM not initialized.", "Worker LLM not initialized.")
+    if not state.get("subtask"):
+        return _worker_result(state, "Error: Subtask description missing.", "Subtask description missing.")
+    logger.info(f"Worker: Received subtask {state.get('subtask_index')}: {state['subtask']}")
+    return None
+
+
+def _direct_tool(state: WorkerInput):
+    """The typed tool of a structured step, or None if the subtask needs the LLM worker."""
+    name = state.get("tool")
+    if not (FAST_PATH and name):
+        return None
+    tool = next((tool for tool in structured_worker_tools if tool.name == name), None)
+    if tool is None:
+        logger.warning(f"Worker: Structured step names unknown tool '{name}'; using the LLM worker.")
+    return tool
+
+
+def _direct_outcome(tool, state: WorkerInput, output: str) -> Tuple[Optional[str], str]:
+    """
+    (output, subtask text) if the direct call succeeded, else (None, the subtask text extended
+    with what failed, for the LLM worker). The second item is the worker's subtask description.
+    """
+    if tool_exit_code(output) == 0:
+        logger.info(f"Worker: Structured step {state.get('subtask_index')} done by {tool.name} without an LLM call.")
+        return output, state["subtask"]
+    logger.warning(f"Worker: Direct {tool.name} call failed ({output[:200]}); handing the subtask to the LLM worker.")
+    return None, (f"{state['subtask']}\n\nNote: calling {tool.name} directly with arguments "
+                  f"{json.dumps(state.get('args') or {})} failed with:\n{output}")
+
+
+def _call_direct_tool(tool, state: WorkerInput) -> Tuple[Optional[str], str]:
+    annotate_span(direct_tool=tool.name)
+    try:
+        output = str(tool.invoke(state.get("args") or {}))
+    except Exception as e:  # arguments that do not match the tool's schema
+        output = f"Error: invalid arguments for {tool.name}: {e}"
+    return _direct_outcome(tool, state, output)
+
+
+async def _acall_direct_tool(tool, state: WorkerInput) -> Tuple[Optional[str], str]:
+    annotate_span(direct_tool=tool.name)
+    try:
+        output = str(await tool.ainvoke(state.get("args") or {}))
+    except Exception as e:
+        output = f"Error: invalid arguments for {tool.name}: {e}"
+    return _direct_outcome(tool, state, output)
+
+
+def _run_worker(state: WorkerInput, early: Optional["_EarlyRun"] = None) -> Dict[str, Any]:
+    """Body of generic_worker_node; `early` is set when the subtask was started from the streamed plan."""
+    error_result = _check_worker_input(state)
+    if error_result:
+        return error_result
+
+    subtask_description = state["subtask"]
+    # Concurrent subtasks each get their own persistent shell (own cwd/env, no lock contention),
+    # closed when the subtask finishes.
+    shell_session = _shell_session_name(state)
+    current_shell_session.set(shell_session)
+    if _run_key():
+        current_changes.set(run_changes(_run_key()))
+    notes = SubtaskNotes(state.get("notes"))
+    current_notes.set(notes)
+    try:
+        with _subtask_overlay() as overlay:
+            worker_result, tool = None, _direct_tool(state)
+            if tool is not None:
+                worker_result, subtask_description = _call_direct_tool(tool, state)
+            if worker_result is None:
+                executor = _get_worker_agent_executor()
+                logger.info(
+                    f"Worker: Executing subtask '{subtask_description}' with {_executor_kind(executor)}...")
+                response_dict = executor.invoke({"input": subtask_description})
+                worker_result = response_dict.get(
+                    "output", "No output from worker agent.")
+            if early is not None:
+                # Nothing is written before the final plan confirms the subtask.
+                early.decided.wait()
+                if not early.keep:
+                    raise _DiscardedEarlyRun()
+        if overlay is not None and overlay.buffered_writes:
+            logger.info(f"Worker: Wrote {overlay.flushed_paths} file(s) for {overlay.buffered_writes} WriteFile/EditFile call(s).")
         logger.info(f"Worker: Raw execution result: {worker_result}")
-        state["worker_output"] = str(worker_result)
-        state["worker_error"] = None
+        return _worker_result(state, str(worker_result), None, notes)
+    except _DiscardedEarlyRun:
+        return _discarded_result(state)
     except Exception as e:
         logger.error(
             f"Worker: Error during subtask execution: {e}", exc_info=True)
-        state["worker_output"] = f"Error executing subtask: {str(e)}"
-        state["worker_error"] = str(e)
-    return state
+        return _worker_result(state, f"Error executing subtask: {str(e)}", str(e))
+    finally:
+        close_session(shell_session)
+
+
+async def _arun_worker(state: WorkerInput, early: Optional["_EarlyRun"] = None) -> Dict[str, Any]:
+    """Body of ageneric_worker_node; `early` is set when the subtask was started from the streamed plan."""
+    error_result = _check_worker_input(state)
+    if error_result:
+        return error_result
+
+    subtask_description = state["subtask"]
+    # Concurrent subtasks each get their own persistent shell (own cwd/env, no lock contention),
+    # closed when the subtask finishes.
+    shell_session = _shell_session_name(state)
+    current_shell_session.set(shell_session)
+    if _run_key():
+        current_changes.set(run_changes(_run_key()))
+    notes = SubtaskNotes(state.get("notes"))
+    current_notes.set(notes)
+    try:
+        async with _asubtask_overlay() as overlay:
+            worker_result, tool = None, _direct_tool(state)
+            if tool is not None:
+                worker_result, subtask_description = await _acall_direct_tool(tool, state)
+            if worker_result is None:
+                executor = _get_worker_agent_executor()
+                logger.info(
+                    f"Worker: Executing subtask '{subtask_description}' with {_executor_kind(executor)} (async)...")
+                response_dict = await executor.ainvoke({"input": subtask_description})
+                worker_result = response_dict.get(
+                    "output", "No output from worker agent.")
+            if early is not None:
+                await early.decided.wait()
+                if not early.keep:
+                    raise _DiscardedEarlyRun()
+        if overlay is not None and overlay.buffered_writes:
+            logger.info(f"Worker: Wrote {overlay.flushed_paths} file(s) for {overlay.buffered_writes} WriteFile/EditFile call(s).")
+        logger.info(f"Worker: Raw execution result: {worker_result}")
+        return _worker_result(state, str(worker_result), None, notes)
+    except _DiscardedEarlyRun:
+        return _discarded_result(state)
+    except Exception as e:
+        logger.error(
+            f"Worker: Error during subtask execution: {e}", exc_info=True)
+        return _worker_result(state, f"Error executing subtask: {str(e)}", str(e))
+    finally:
+        await aclose_session(shell_session)
+
+
+@traced("node", "generic_worker", attrs=lambda state: {"subtask_index": state.get("subtask_index")})
+def generic_worker_node(state: WorkerInput) -> Dict[str, Any]:
+    """
+    Executes a single subtask. Several instances may run concurrently (one per ready
+    subtask), so the result is returned through the `worker_results` reducer instead
+    of overwriting shared state keys. If the subtask was already started while the plan
+    was streaming, its result is awaited instead.
+    """
+    early = _claim_early_run(state)
+    if early is not None:
+        return early.handle.result()
+    return _run_worker(state)
+
+
+@traced("node", "generic_worker", attrs=lambda state: {"subtask_index": state.get("subtask_index")})
+async def ageneric_worker_node(state: WorkerInput) -> Dict[str, Any]:
+    """
+    Async variant of generic_worker_node. The ReAct loop awaits the LLM directly and the
+    tools' async entry points run blocking work off the event loop.
+    """
+    early = _claim_early_run(state)
+    if early is not None:
+        if isinstance(early.handle, asyncio.Future):
+            return await early.handle
+        return await asyncio.wrap_future(early.handle)
+    return await _arun_worker(state)
 
 # --- Conditional Edge Logic ---
 
 
-def should_continue(state: OrchestratorState) -> str:
+def should_continue(state: OrchestratorState):
     logger.info(f"--- Conditional Edge: should_continue ---")
     orchestrator_error = state.get("error_message")
     if orchestrator_error:
@@ -270,18 +1523,26 @@ def should_continue(state: OrchestratorState) -> str:
         return END
 
     plan = state.get("plan", [])
-    current_subtask_index = state.get("current_subtask_index", 0)
+    running = [index for index, item in enumerate(plan) if item.get("status") == "running"]
 
-    # Check if a plan exists and there are pending subtasks
-    if plan and 0 <= current_subtask_index < len(plan):
+    # Fan out every subtask the orchestrator marked as ready; the edge back to the
+    # orchestrator joins them before any dependent subtask is dispatched.
+    if running:
         logger.info(
-            f"Decision: Plan exists and has pending tasks ({current_subtask_index + 1}/{len(plan)}). Routing to worker.")
-        return "generic_worker"
-    elif plan and current_subtask_index >= len(plan):
+            f"Decision: Dispatching {len(running)} subtask(s) {[plan[i]['id'] for i in running]} "
+            f"({state.get('current_subtask_index', 0)}/{len(plan)} done). Routing to worker.")
+        notes = state.get("notes") or {}
+        return [Send("generic_worker", {**worker_payload(plan, index), "notes": notes}) for index in running]
+    elif plan and all(item.get("status") == "done" for item in plan):
         logger.info("Decision: All subtasks processed. Ending.")
         if not state.get("final_result") and not orchestrator_error and not worker_error:
             state["final_result"] = "All subtasks completed successfully."
         return END
+    elif plan:
+        logger.error("Decision: Pending subtasks remain but none can be scheduled. Ending.")
+        if not state.get("final_result"):
+            state["final_result"] = "Run failed: Plan has pending subtasks with unsatisfiable dependencies."
+        return END
     else:  # No plan exists or plan is empty
         logger.info("Decision: No plan exists or plan is empty. Ending.")
         if not state.get("final_result") and not orchestrator_error and not worker_error:
@@ -301,40 +1562,255 @@ def route_after_start(state: OrchestratorState) -> str:
 
 
 # --- Graph Definition ---
-workflow = StateGraph(OrchestratorState)
-workflow.add_node("orchestrator", orchestrator_node)
-workflow.add_node("generic_worker", generic_worker_node)
-workflow.add_conditional_edges(START, route_after_start, {
-                               "orchestrator": "orchestrator", END: END})
-workflow.add_edge("generic_worker", "orchestrator")
-workflow.add_conditional_edges("orchestrator", should_continue, {
-                               "generic_worker": "generic_worker", END: END})
-app = workflow.compile()
-logger.info(
-    "LangGraph application compiled with LLM-driven orchestrator planning.")
+def build_workflow() -> StateGraph:
+    workflow = StateGraph(OrchestratorState)
+    # Nodes carry both a sync and an async implementation, so app.invoke/app.stream and
+    # app.ainvoke/app.astream are all supported entry points.
+    workflow.add_node("orchestrator", RunnableLambda(
+        orchestrator_node, afunc=aorchestrator_node, name="orchestrator"))
+    workflow.add_node("generic_worker", RunnableLambda(
+        generic_worker_node, afunc=ageneric_worker_node, name="generic_worker"), input=WorkerInput)
+    workflow.add_conditional_edges(START, route_after_start, {
+                                   "orchestrator": "orchestrator", END: END})
+    workflow.add_edge("generic_worker", "orchestrator")
+    workflow.add_conditional_edges("orchestrator", should_continue, [
+                                   "generic_worker", END])
+    return workflow
+
+
+_app = None
+_checkpointer = None
+
+
+def get_app():
+    """The compiled graph, built on first use."""
+    global _app, _checkpointer
+    with _init_lock:
+        if _app is None:
+            # Every step is checkpointed under the run's thread id, so interrupted runs can be resumed.
+            _checkpointer = get_checkpointer()
+            _app = build_workflow().compile(checkpointer=_checkpointer)
+            logger.info(
+                "LangGraph application compiled with LLM-driven orchestrator planning.")
+    return _app
+
+
+def get_app_checkpointer():
+    """Checkpointer of the compiled graph (None when checkpointing is disabled)."""
+    get_app()
+    return _checkpointer
+
+
+def __getattr__(name: str) -> Any:
+    # `langgraph_agent.app` / `.checkpointer` keep working, but only compile the graph when used.
+    if name == "app":
+        return get_app()
+    if name == "checkpointer":
+        return get_app_checkpointer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def warm_up(check_llm: bool = False) -> None:
+    """
+    Creates the LLM clients, the worker executor and the graph ahead of the first run.
+    With `check_llm`, also sends a one-word prompt to verify the model endpoint responds.
+    """
+    get_app()
+    llm = get_orchestrator_llm()
+    _get_worker_agent_executor()
+    if check_llm and llm is not None:
+        try:
+            llm.invoke("Hello")
+            logger.info("LLM warm-up call succeeded.")
+        except Exception as e:
+            logger.error(f"LLM warm-up call failed: {e}")
+
+
+def start_warm_up(check_llm: bool = False) -> threading.Thread:
+    """Runs warm_up in a background thread so the caller is not blocked."""
+    thread = threading.Thread(target=warm_up, args=(check_llm,), name="agent-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def make_initial_state(user_goal: str) -> OrchestratorState:
+    return {
+        "user_goal": user_goal,
+        "plan": [], "current_subtask_index": 0, "messages": [],
+        "worker_results": [], "worker_output": None,
+        "worker_error": None, "final_result": None, "error_message": None, "notes": {}, "replans": 0, "waves": 0,
+    }
+
+
+def run_config(thread_id: Optional[str] = None, checkpoint_id: Optional[str] = None) -> Dict[str, Any]:
+    """Graph config for a run; a new random thread id is used if none is given."""
+    configurable = {"thread_id": thread_id or uuid.uuid4().hex}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"recursion_limit": recursion_limit_for(run_wave_budget()), "configurable": configurable}
+
+
+def run_outcome(values: Dict[str, Any]) -> str:
+    """Final result of a run, derived from its state (conditional edges cannot write state)."""
+    if values.get("final_result"):
+        return values["final_result"]
+    if values.get("error_message"):
+        return f"Run failed due to orchestrator error: {values['error_message']}"
+    if values.get("worker_error"):
+        return f"Run failed due to worker error: {values['worker_error']}"
+    plan = values.get("plan") or []
+    if plan and all(item.get("status") == "done" for item in plan):
+        return "All subtasks completed successfully."
+    if plan:
+        return f"Run incomplete: {values.get('current_subtask_index', 0)}/{len(plan)} subtasks done."
+    return "Run failed: No plan was generated or available or LLM failed to produce a valid plan."
+
+
+def list_runs() -> List[Dict[str, Any]]:
+    """Summaries of the saved runs, most recent first."""
+    checkpointer = get_app_checkpointer()
+    if not checkpointer:
+        return []
+    runs = []
+    for thread_id in list_thread_ids(checkpointer):
+        snapshot = get_app().get_state(run_config(thread_id))
+        values = snapshot.values or {}
+        plan = values.get("plan") or []
+        runs.append({"thread_id": thread_id, "user_goal": values.get("user_goal"),
+                     "done": sum(1 for item in plan if item.get("status") == "done"), "total": len(plan),
+                     "pending_nodes": list(snapshot.next), "outcome": run_outcome(values),
+                     "updated_at": snapshot.created_at})
+    return runs
+
+
+def prepare_resume(thread_id: str) -> Tuple[Optional[OrchestratorState], Dict[str, Any]]:
+    """
+    Returns (input, config) to continue a saved run from its last completed step.
+    The stored plan and results are kept, so the planner is not called again; failed or
+    interrupted subtasks are reset to pending and rerun.
+    Raises ValueError if there is no saved run with this id.
+    """
+    if not get_app_checkpointer():
+        raise ValueError("Checkpointing is disabled (AGENT_CHECKPOINTS=off).")
+    config = run_config(thread_id)
+    snapshot = get_app().get_state(config)
+    values = snapshot.values or {}
+    if not values:
+        raise ValueError(f"No saved run with thread id '{thread_id}'.")
+    if snapshot.next:
+        # The process died mid-step: pending tasks are re-executed from the checkpoint.
+        logger.info(f"Resuming run {thread_id} at pending node(s) {list(snapshot.next)}.")
+        return None, config
+    plan = values.get("plan") or []
+    if not plan:
+        logger.info(f"Run {thread_id} has no plan yet; restarting it from planning.")
+        return make_initial_state(values.get("user_goal", "")), config
+
+    for item in plan:
+        if item.get("status") in ("failed", "running"):
+            item["status"] = "pending"
+            item["result"] = None
+            item["result_ref"] = None
+    # Written as if the worker wave had just finished, so the orchestrator runs next and
+    # dispatches the remaining subtasks.
+    # A resumed run is a new graph invocation with a fresh recursion limit, so its wave budget restarts too.
+    get_app().update_state(config, {"plan": plan, "worker_results": None, "worker_error": None,
+                              "error_message": None, "final_result": None, "waves": 0}, as_node="generic_worker")
+    logger.info(f"Resuming run {thread_id}: {values.get('current_subtask_index', 0)}/{len(plan)} subtasks done.")
+    return None, config
+
+
+def prepare_fork(thread_id: str, checkpoint_id: Optional[str] = None) -> Tuple[Optional[OrchestratorState], Dict[str, Any]]:
+    """
+    Copies a saved run (at its latest or at the given checkpoint) into a new thread and
+    returns (input, config) to continue the copy; the original run is left untouched.
+    """
+    if not get_app_checkpointer():
+        raise ValueError("Checkpointing is disabled (AGENT_CHECKPOINTS=off).")
+    source = get_app().get_state(run_config(thread_id, checkpoint_id))
+    if not source.values:
+        raise ValueError(f"No saved run with thread id '{thread_id}'.")
+    config = run_config()
+    get_app().update_state(config, {**source.values, "waves": 0}, as_node="generic_worker")
+    logger.info(f"Forked run {thread_id} into {config['configurable']['thread_id']}.")
+    return prepare_resume(config["configurable"]["thread_id"])
+
+
+async def astream_goal(user_goal: str, config: Optional[Dict[str, Any]] = None):
+    """
+    Async entry point: streams graph events for one goal via app.astream.
+    Many goals can run concurrently in one process, e.g.
+    `await asyncio.gather(*(collect(astream_goal(goal)) for goal in goals))`.
+    """
+    base_config = run_config()
+    config = {**base_config, **(config or {})}
+    async for event in get_app().astream(make_initial_state(user_goal), config):
+        yield event
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the LangGraph orchestrator-worker agent.")
+    parser.add_argument("--goal", default="Create web base x/o game using html and css",
+                        help="Goal for a new run.")
+    parser.add_argument("--thread-id", help="Id to save a new run under (default: random).")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--list-runs", action="store_true", help="List saved runs and exit.")
+    mode.add_argument("--resume", metavar="THREAD_ID", help="Resume a saved run from its last completed step.")
+    mode.add_argument("--fork", metavar="THREAD_ID", help="Continue a copy of a saved run under a new thread id.")
+    parser.add_argument("--checkpoint-id", help="With --fork: checkpoint to fork from (default: latest).")
+    return parser.parse_args(argv)
+
 
 # --- Main Execution Block ---
 if __name__ == "__main__":
+    args = parse_args()
+    if args.list_runs:
+        for run in list_runs():
+            print(f"{run['thread_id']}  {run['updated_at']}  {run['done']}/{run['total']}  "
+                  f"{run['outcome']}  goal: {run['user_goal']}")
+        raise SystemExit(0)
+
+    try:
+        if args.resume:
+            run_input, config = prepare_resume(args.resume)
+        elif args.fork:
+            run_input, config = prepare_fork(args.fork, args.checkpoint_id)
+        else:
+            run_input, config = make_initial_state(args.goal), run_config(args.thread_id)
+    except ValueError as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+
+    thread_id = config["configurable"]["thread_id"]
     logger.info(
-        "Starting LangGraph agent execution with LLM-driven orchestrator...")
-    initial_state: OrchestratorState = {
-        "user_goal": "Create web base x/o game using html and css",
-        "plan": [], "current_subtask_index": 0, "messages": [],
-        "worker_output": None, "worker_error": None,
-        "final_result": None, "error_message": None,
-    }
+        f"Starting LangGraph agent execution with LLM-driven orchestrator (thread id: {thread_id})...")
 
     final_state_value = None
     try:
         # The recursion_limit is on the config object passed to stream, not stream itself.
-        for event in app.stream(initial_state, {"recursion_limit": 20}):
+        # It covers the run's wave budget, which the orchestrator enforces (see run_wave_budget).
+        for event in get_app().stream(run_input, config):
             logger.info(f"Graph Event: Node: {list(event.keys())[0]}")
             if END in event:
                 final_state_value = event[END]
     except Exception as e:
         logger.error(f"Error during graph execution: {e}", exc_info=True)
+    if final_state_value is None and get_app_checkpointer():
+        final_state_value = get_app().get_state(config).values
+        if final_state_value:
+            final_state_value = {**final_state_value, "final_result": run_outcome(final_state_value)}
 
     logger.info("--- LangGraph agent execution finished ---")
+    llm_cache = get_llm_cache()
+    if llm_cache:
+        logger.info(f"LLM cache stats: {llm_cache.stats()}")
+    plan_library = get_plan_library()
+    if plan_library:
+        logger.info(f"Plan library stats: {plan_library.stats()}")
+    logger.info(f"Tool output stats: {output_stats.snapshot()}")
+    logger.info(f"LLM rate limiter stats: {limiter_stats()}")
+    logger.info(f"Resume this run with: python langgraph_agent.py --resume {thread_id}")
+    logger.info(format_summary(summarize(load_spans(thread_id), (final_state_value or {}).get("plan"))))
     if final_state_value:
         logger.info(f"Final application state: {final_state_value}")
         # Check error_message first as it might indicate a setup or orchestrator issue
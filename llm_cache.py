@@ -0,0 +1,162 @@
+# llm_cache.py
+"""
+Persistent, content-addressed cache for LLM responses.
+
+Both agents run their models with temperature=0, so replaying the same prompt against the
+same model configuration gives the same answer. `PersistentLLMCache` plugs into LangChain's
+`cache=` hook on chat models and LLMs, stores responses in a local SQLite file (zstd
+compressed) and evicts the least recently used entries once the size budget is exceeded.
+
+Configuration (environment variables):
+    AGENT_LLM_CACHE          "0"/"false"/"off" bypasses the cache entirely (default: on)
+    AGENT_LLM_CACHE_PATH     SQLite file location (default: .agent_cache/llm_cache.sqlite)
+    AGENT_LLM_CACHE_MAX_MB   size budget for stored responses (default: 256)
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import zstandard
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(".agent_cache", "llm_cache.sqlite")
+DEFAULT_MAX_MB = 256
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """Content address of a call: model name + invocation parameters + prompt/messages."""
+    payload = json.dumps({"llm": llm_string, "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PersistentLLMCache(BaseCache):
+    """
+    SQLite-backed LangChain cache with size-bounded LRU eviction and hit/miss counters.
+    Set `enabled = False` (or AGENT_LLM_CACHE=off) to bypass lookups and writes.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024,
+                 enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache(last_access)")
+        self._conn.commit()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if not self.enabled:
+            return None
+        key = cache_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        try:
+            serialized = json.loads(self._decompressor.decompress(row[0]))
+            return [loads(generation) for generation in serialized]
+        except Exception as e:
+            logger.warning(f"LLM cache: dropping unreadable entry {key[:12]}: {e}")
+            with self._lock:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if not self.enabled:
+            return
+        key = cache_key(prompt, llm_string)
+        try:
+            value = self._compressor.compress(
+                json.dumps([dumps(generation) for generation in return_val]).encode("utf-8"))
+        except Exception as e:
+            logger.warning(f"LLM cache: response not serializable, not caching: {e}")
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Removes least recently used entries until the stored size fits the budget. Lock held."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC"):
+            if total - freed <= self.max_bytes:
+                break
+            evicted.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", evicted)
+        logger.info(f"LLM cache: evicted {len(evicted)} entries ({freed} bytes).")
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+
+_llm_cache: Optional[PersistentLLMCache] = None
+
+
+def get_llm_cache() -> Optional[PersistentLLMCache]:
+    """
+    Shared cache instance configured from the environment, or None when bypassed.
+    Returns None (and logs) rather than failing the agent if the cache cannot be opened.
+    """
+    global _llm_cache
+    if os.getenv("AGENT_LLM_CACHE", "on").lower() in ("0", "false", "off", "no"):
+        return None
+    if _llm_cache is None:
+        try:
+            _llm_cache = PersistentLLMCache(
+                path=os.getenv("AGENT_LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_bytes=int(float(os.getenv("AGENT_LLM_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024))
+            logger.info(f"LLM cache enabled at {_llm_cache.path}.")
+        except Exception as e:
+            logger.error(f"Failed to open LLM cache: {e}. Continuing without cache.")
+            return None
+    return _llm_cache
@@ -0,0 +1,209 @@
+# plan_library.py
+"""
+Library of successful plans, looked up by goal similarity.
+
+Many goals are near-duplicates (the same scaffolding task with small wording changes).
+Plans of runs that completed every subtask are stored with their goal text, and before
+calling the planner the orchestrator asks the library for a plan whose goal is similar
+enough; on a hit the planner LLM is skipped entirely.
+
+Similarity is the cosine between TF-IDF vectors of the goals' words and character trigrams,
+hashed into a fixed number of dimensions and held in a NumPy matrix, so a lookup is one
+matrix-vector product over the whole library.
+
+A stored plan is replayed word for word, so similarity alone is not enough: a goal that
+only changes a port, a file name or a function name scores as high as a rewording. The
+goals' anchors (numbers, paths and file names, identifiers, quoted strings and names
+such as "React", see `goal_anchors`) must therefore match the stored goal's exactly for a hit.
+
+Configuration (environment variables):
+    AGENT_PLAN_LIBRARY             "0"/"false"/"off" disables reuse and storing (default: on)
+    AGENT_PLAN_LIBRARY_PATH        SQLite file location (default: .agent_cache/plans.sqlite)
+    AGENT_PLAN_REUSE_THRESHOLD     minimum cosine similarity for a hit (default: 0.85)
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIBRARY_PATH = os.path.join(".agent_cache", "plans.sqlite")
+# Rephrasings of a stored goal score about 0.85-1.0, but so can goals that differ in one
+# word out of many ("port 5000" vs "port 8080" scores 0.86); `goal_anchors` tells them apart.
+DEFAULT_THRESHOLD = 0.85
+DIMENSIONS = 1 << 11
+_WORD = re.compile(r"[a-z0-9_]+")
+# Parameters a replayed plan would get wrong: quoted strings, paths and file names
+# ("app.py", "/health", "src/main.js"), numbers and versions ("8080", "3.11"), and
+# identifiers ("get_user", "UserService", "userId"). Capitalized words inside a sentence
+# ("React", "Flask", "PostgreSQL") name frameworks and tools and count too.
+_ANCHOR = re.compile(
+    r"""`[^`]+`|"[^"]+"|'[^']+'"""
+    r"|[\w.-]*/[\w./-]*\w|\b[\w-]+(?:\.[A-Za-z0-9]+)+\b"
+    r"|\b\d+(?:\.\d+)*\b"
+    r"|\b\w*_\w*\b|\b[A-Za-z]+[a-z][A-Z]\w*\b")
+_SENTENCE = re.compile(r"[.!?:;]\s+|\n")
+_NAME = re.compile(r"\b[A-Z][\w+#]*")
+_STOP_WORDS = frozenset(
+    "a an the and or of for to in on with using use into by at as from this that it be is are please".split())
+
+
+def normalize_goal(goal: str) -> str:
+    """Lowercased words without punctuation and stop words; goals with the same form share a library entry."""
+    return " ".join(word for word in _WORD.findall(goal.lower()) if word not in _STOP_WORDS)
+
+
+def goal_anchors(goal: str) -> frozenset:
+    """The goal's parameter tokens (see _ANCHOR); a stored plan is only reused for the same set."""
+    anchors = {match.strip("`'\"").rstrip(".") for match in _ANCHOR.findall(goal)}
+    for sentence in _SENTENCE.split(goal):
+        sentence = sentence.strip()
+        anchors.update(name.group() for name in _NAME.finditer(sentence)
+                       if name.start() > 0 and len(name.group()) > 1)
+    return frozenset(anchor for anchor in anchors if anchor.lower() not in ("e.g", "i.e"))
+
+
+def goal_features(goal: str) -> List[str]:
+    """Words (which carry most of the meaning) plus character trigrams (robust to inflections and typos)."""
+    text = normalize_goal(goal)
+    words = text.split()
+    padded = f" {text} "
+    return [f"w:{word}" for word in words] + [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+
+
+def term_frequencies(goal: str, dimensions: int = DIMENSIONS) -> np.ndarray:
+    """Hashed term counts (crc32, so buckets are stable across processes)."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature in goal_features(goal):
+        vector[zlib.crc32(feature.encode("utf-8")) % dimensions] += 1.0
+    return vector
+
+
+class PlanLibrary:
+    """SQLite-backed plan store with an in-memory TF-IDF similarity index over the goals."""
+
+    def __init__(self, path: str = DEFAULT_LIBRARY_PATH, threshold: float = DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS plans (goal_key TEXT PRIMARY KEY, goal TEXT NOT NULL, "
+            "plan TEXT NOT NULL, created_at REAL NOT NULL, uses INTEGER NOT NULL DEFAULT 0)")
+        self._conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._conn.execute("SELECT goal_key, goal FROM plans").fetchall()
+        self._keys = [key for key, _ in rows]
+        self._tf = np.stack([term_frequencies(goal) for _, goal in rows]) if rows \
+            else np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self._reindex()
+
+    def _reindex(self) -> None:
+        """Recomputes IDF weights and the normalized document vectors after the library changed."""
+        count = len(self._keys)
+        document_frequency = np.count_nonzero(self._tf, axis=0)
+        self._idf = (np.log((1.0 + count) / (1.0 + document_frequency)) + 1.0).astype(np.float32)
+        self._vectors = self._normalize(self._tf * self._idf)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def lookup(self, goal: str) -> Optional[Tuple[List[Dict[str, Any]], float, str]]:
+        """(plan, similarity, stored goal) of the most similar stored goal above the threshold whose
+        anchors equal the goal's, else None."""
+        with self._lock:
+            if not self._keys:
+                self.misses += 1
+                return None
+            query = self._normalize(term_frequencies(goal) * self._idf)
+            scores = self._vectors @ query
+            anchors = goal_anchors(goal)
+            # Most similar first; candidates whose parameters differ are skipped.
+            for best in np.argsort(-scores):
+                similarity = float(scores[best])
+                if similarity < self.threshold:
+                    break
+                key = self._keys[int(best)]
+                row = self._conn.execute("SELECT goal, plan FROM plans WHERE goal_key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                if goal_anchors(row[0]) != anchors:
+                    logger.info(f"Plan library: '{row[0]}' is similar ({similarity:.2f}) but its parameters differ; not reused.")
+                    continue
+                self._conn.execute("UPDATE plans SET uses = uses + 1 WHERE goal_key = ?", (key,))
+                self._conn.commit()
+                self.hits += 1
+                return json.loads(row[1]), similarity, row[0]
+            self.misses += 1
+            return None
+
+    def store(self, goal: str, plan: List[Dict[str, Any]]) -> None:
+        """
+        Stores (or replaces) the plan for `goal`. Only the plan structure is kept, not run
+        results; structured steps keep their `tool` and `args` so a reused plan still runs
+        them without the worker LLM.
+        """
+        key = normalize_goal(goal)
+        if not key or not plan:
+            return
+        structure = []
+        for item in plan:
+            step = {"id": item["id"], "subtask": item["subtask"], "depends_on": list(item.get("depends_on", []))}
+            if item.get("tool"):
+                step.update(tool=item["tool"], args=dict(item.get("args") or {}))
+            structure.append(step)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO plans (goal_key, goal, plan, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(goal_key) DO UPDATE SET goal = excluded.goal, plan = excluded.plan",
+                (key, goal, json.dumps(structure), time.time()))
+            self._conn.commit()
+            if key in self._keys:
+                self._tf[self._keys.index(key)] = term_frequencies(goal)
+            else:
+                self._keys.append(key)
+                self._tf = np.vstack([self._tf, term_frequencies(goal)[None, :]])
+            self._reindex()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "plans": len(self._keys), "threshold": self.threshold}
+
+
+_plan_library: Optional[PlanLibrary] = None
+
+
+def get_plan_library() -> Optional[PlanLibrary]:
+    """
+    Shared library configured from the environment, or None when disabled.
+    Returns None (and logs) rather than failing the agent if the library cannot be opened.
+    """
+    global _plan_library
+    if os.getenv("AGENT_PLAN_LIBRARY", "on").lower() in ("0", "false", "off", "no"):
+        return None
+    if _plan_library is None:
+        try:
+            _plan_library = PlanLibrary(
+                path=os.getenv("AGENT_PLAN_LIBRARY_PATH", DEFAULT_LIBRARY_PATH),
+                threshold=float(os.getenv("AGENT_PLAN_REUSE_THRESHOLD", DEFAULT_THRESHOLD)))
+            logger.info(f"Plan library enabled at {_plan_library.path} ({_plan_library.stats()['plans']} plans).")
+        except Exception as e:
+            logger.error(f"Failed to open plan library: {e}. Plans will not be reused.")
+            return None
+    return _plan_library
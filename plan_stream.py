@@ -0,0 +1,144 @@
+# plan_stream.py
+"""
+Incremental parsing of the planner's streamed response.
+
+The planner answers with a JSON list of subtasks. `PlanStreamParser` is fed the response
+chunk by chunk and returns each list element as soon as its closing bracket or quote has
+arrived, so the orchestrator can start the first subtasks while the rest of the plan is
+still being generated. Text before the list (e.g. a ```json fence or a sentence) is
+skipped, and so is text after it. Anything
+it cannot parse raises ValueError; the orchestrator then falls back to parsing the full
+response once it is complete.
+
+LangChain's `stream()` bypasses the model's response cache, so `cached_response` and
+`cache_response` look up and store the planner's answer under the same key `invoke()`
+would use; cached plans are replayed without streaming.
+"""
+import json
+import logging
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PlanStreamParser:
+    """Incremental parser for the elements of a top-level JSON array."""
+
+    def __init__(self):
+        self._buffer = ""
+        self._position = 0
+        self._depth = 0  # 0: before the list, 1: directly inside it
+        self._in_string = False
+        self._escaped = False
+        self._element_start: Optional[int] = None
+        self.elements: List[Any] = []
+        self.done = False
+
+    def _finish_element(self, end: int, closing: bool) -> List[Any]:
+        if self._element_start is None:
+            if closing and not self.elements:
+                return []  # empty list
+            raise ValueError(f"empty element at position {len(self.elements)}")
+        raw = self._buffer[self._element_start:end]
+        self._element_start = None
+        try:
+            element = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"malformed element at position {len(self.elements)}: {e}") from None
+        self.elements.append(element)
+        return [element]
+
+    def feed(self, text: str) -> List[Any]:
+        """Adds the next chunk of the response and returns the elements completed by it."""
+        if self.done:
+            return []
+        self._buffer += text
+        completed = []
+        buffer = self._buffer
+        i = self._position
+        while i < len(buffer):
+            char = buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if char == "[":
+                    # Only a list of objects or strings is the plan; "[" in prose (e.g.
+                    # "step [1]") is skipped. Wait for the next character if it has not arrived.
+                    following = buffer[i + 1:].lstrip()
+                    if not following:
+                        break
+                    if following[0] in '{"]':
+                        self._depth = 1
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._element_start is None:
+                    self._element_start = i
+            elif char in "[{":
+                if self._depth == 1 and self._element_start is None:
+                    self._element_start = i
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed += self._finish_element(i, closing=True)
+                    self.done = True
+                    break
+            elif char == "," and self._depth == 1:
+                completed += self._finish_element(i, closing=False)
+            elif not char.isspace() and self._depth == 1 and self._element_start is None:
+                self._element_start = i  # number or literal
+            i += 1
+        self._position = i
+        return completed
+
+    def finish(self) -> List[Any]:
+        """All elements; raises ValueError if the list was never closed."""
+        if not self.done:
+            raise ValueError("response ended before the plan list was closed")
+        return self.elements
+
+
+def _cache_address(llm: Any, prompt: str):
+    from langchain_core.caches import BaseCache
+    from langchain_core.load import dumps
+    cache = getattr(llm, "cache", None)
+    if not isinstance(cache, BaseCache):
+        return None
+    # Same key as BaseChatModel.invoke(prompt) uses for its cache lookup.
+    return cache, dumps(llm._convert_input(prompt).to_messages()), llm._get_llm_string()
+
+
+def cached_response(llm: Any, prompt: str) -> Optional[str]:
+    """The cached response text for `prompt`, or None (also if the model has no cache)."""
+    try:
+        address = _cache_address(llm, prompt)
+        if address is None:
+            return None
+        cache, key, llm_string = address
+        generations = cache.lookup(key, llm_string)
+    except Exception as e:
+        logger.warning(f"Plan stream: cache lookup failed: {e}")
+        return None
+    if not generations:
+        return None
+    message = getattr(generations[0], "message", None)
+    return message.content if message is not None else generations[0].text
+
+
+def cache_response(llm: Any, prompt: str, text: str) -> None:
+    """Stores a streamed response so later runs replay it like a cached invoke()."""
+    try:
+        address = _cache_address(llm, prompt)
+        if address is None:
+            return
+        from langchain_core.messages import AIMessage
+        from langchain_core.outputs import ChatGeneration
+        cache, key, llm_string = address
+        cache.update(key, llm_string, [ChatGeneration(message=AIMessage(content=text))])
+    except Exception as e:
+        logger.warning(f"Plan stream: could not cache the planner response: {e}")
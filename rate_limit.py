@@ -0,0 +1,500 @@
+# rate_limit.py
+"""
+Client-side rate limiting and retries for the LLM clients.
+
+Every model call goes through the `RateLimiter` of its API quota, shared by all models,
+threads and concurrent runs in the process:
+
+- token buckets for requests and tokens per minute; a call waits until both have room
+  for it. The token charge is estimated from the prompt up front and corrected with the
+  usage the provider reports, so the buckets follow the real consumption;
+- adaptive concurrency (additive increase, multiplicative decrease): a throttled call
+  halves the number of calls allowed in flight, every successful call raises it again
+  by a fraction of a slot, up to AGENT_LLM_MAX_CONCURRENCY;
+- throttled (429, quota) and transient (5xx, timeouts, connection) errors are retried
+  with exponential backoff and full jitter (tenacity); other errors are raised at once.
+
+`rate_limited(model, quota)` wraps a LangChain chat model or LLM in a proxy that applies
+its quota's limiter. The proxy takes over the model's cache and callbacks, so cache hits
+do not count against the quota. `limiter_stats()` reports, per quota, the time calls
+spent queued for the limiter versus in service, throttling and retries; the queued time
+of each call is also recorded on its LLM span (see tracing.py).
+
+Configuration (environment variables):
+    AGENT_RATE_LIMIT              "0"/"false"/"off" disables limiting and retries (default: on)
+    AGENT_LLM_RPM                 requests per minute per quota (default: 0, unlimited)
+    AGENT_LLM_TPM                 prompt + completion tokens per minute per quota (default: 0, unlimited)
+    AGENT_LLM_MAX_CONCURRENCY     calls in flight per quota before any throttling (default: 8)
+    AGENT_LLM_MAX_RETRIES         retries of a throttled or failed call (default: 5)
+    AGENT_LLM_RETRY_MAX_SECONDS   longest wait between two attempts (default: 60)
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult, LLMResult
+from tenacity import (AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt,
+                      wait_random_exponential)
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("AGENT_RATE_LIMIT", "on").lower() not in ("0", "false", "off", "no")
+RPM = int(os.getenv("AGENT_LLM_RPM", "0"))
+TPM = int(os.getenv("AGENT_LLM_TPM", "0"))
+MAX_CONCURRENCY = int(os.getenv("AGENT_LLM_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("AGENT_LLM_MAX_RETRIES", "5"))
+RETRY_MAX_SECONDS = float(os.getenv("AGENT_LLM_RETRY_MAX_SECONDS", "60"))
+CHARS_PER_TOKEN = 4
+# Waiting callers re-check for a free slot this often; bucket waits sleep until the refill.
+POLL_SECONDS = 0.02
+
+_THROTTLE_MARKERS = ("429", "rate limit", "ratelimit", "quota", "resource exhausted", "resourceexhausted",
+                     "too many requests")
+_TRANSIENT_MARKERS = ("timeout", "timed out", "connection", "unavailable", "deadline", "internal server error",
+                      "bad gateway", "502", "503", "504")
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(error, attribute, None)
+        value = getattr(value, "value", value)  # HTTPStatus / grpc codes
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _describe(error: BaseException) -> str:
+    return f"{type(error).__name__} {error}".lower()
+
+
+def is_throttle(error: BaseException) -> bool:
+    """True for quota and rate-limit errors (HTTP 429, gRPC RESOURCE_EXHAUSTED)."""
+    if _status_code(error) == 429:
+        return True
+    description = _describe(error)
+    return any(marker in description for marker in _THROTTLE_MARKERS)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Throttling and transient failures (5xx, timeouts, dropped connections) are worth retrying."""
+    if is_throttle(error) or isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    code = _status_code(error)
+    if code is not None and 500 <= code < 600:
+        return True
+    description = _describe(error)
+    return any(marker in description for marker in _TRANSIENT_MARKERS)
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if now). Larger amounts than the capacity
+        only wait for a full bucket and leave it in debt, so they are slowed, not starved."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        """Takes `amount` (a negative amount gives units back)."""
+        self.level = min(self.capacity, self.level - amount)
+
+
+class Permit:
+    """One admitted call: when it was admitted and what it was charged."""
+
+    def __init__(self, estimated_tokens: int, queued: float):
+        self.estimated_tokens = estimated_tokens
+        self.queued = queued
+        self.admitted = time.monotonic()
+
+
+class RateLimiter:
+    """Admission control for the calls of one API quota; thread-safe and usable from any event loop."""
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0, max_concurrency: int = MAX_CONCURRENCY,
+                 min_concurrency: int = 1):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency = float(self.max_concurrency)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._counts = {"calls": 0, "throttled": 0, "retries": 0, "failures": 0, "tokens": 0,
+                        "queued_s": 0.0, "service_s": 0.0, "max_queued_s": 0.0}
+
+    def _try_admit(self, estimated_tokens: int) -> float:
+        """Admits the call and returns 0, or returns how long to wait before trying again."""
+        with self._lock:
+            if self.in_flight >= int(self.concurrency):
+                return POLL_SECONDS
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now) if self.requests else 0.0,
+                       self.tokens.wait_time(estimated_tokens, now) if self.tokens else 0.0)
+            if wait:
+                return wait
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(estimated_tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, estimated_tokens: int = 0) -> Permit:
+        started = time.monotonic()
+        while True:
+            wait = self._try_admit(estimated_tokens)
+            if not wait:
+                return Permit(estimated_tokens, time.monotonic() - started)
+            time.sleep(wait)
+
+    async def aacquire(self, estimated_tokens: int = 0) -> Permit:
+        started = time.monotonic()
+        while True:
+            wait = self._try_admit(estimated_tokens)
+            if not wait:
+                return Permit(estimated_tokens, time.monotonic() - started)
+            await asyncio.sleep(wait)
+
+    def release(self, permit: Permit, used_tokens: Optional[int] = None,
+                error: Optional[BaseException] = None) -> None:
+        """
+        Ends the call: corrects the token charge and adapts the concurrency to the outcome.
+        A call released without usage or error (cancelled) leaves the concurrency as it is.
+        """
+        now = time.monotonic()
+        throttled = error is not None and is_throttle(error)
+        with self._lock:
+            self.in_flight -= 1
+            if self.tokens and used_tokens is not None:
+                self.tokens.take(used_tokens - permit.estimated_tokens)
+            if throttled:
+                # Calls admitted before the last decrease saw the old limit; one halving per round.
+                if permit.admitted >= self._last_decrease:
+                    self.concurrency = max(float(self.min_concurrency), self.concurrency / 2)
+                    self._last_decrease = now
+            elif error is None and used_tokens is not None:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            counts = self._counts
+            counts["calls"] += 1
+            counts["throttled"] += throttled
+            counts["failures"] += error is not None
+            counts["tokens"] += used_tokens or 0
+            counts["queued_s"] += permit.queued
+            counts["max_queued_s"] = max(counts["max_queued_s"], permit.queued)
+            counts["service_s"] += now - permit.admitted
+        if throttled:
+            logger.warning(f"Rate limit: {self.name} call throttled ({error}); "
+                           f"concurrency limit now {int(self.concurrency)}.")
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._counts["retries"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            counts.update(in_flight=self.in_flight, concurrency_limit=int(self.concurrency))
+        for key in ("queued_s", "service_s", "max_queued_s"):
+            counts[key] = round(counts[key], 3)
+        return counts
+
+    def _retry_options(self, retryable: Callable[[BaseException], bool]) -> Dict[str, Any]:
+        def _before_sleep(retry_state) -> None:
+            self.record_retry()
+            logger.warning(f"Rate limit: {self.name} attempt {retry_state.attempt_number} failed "
+                           f"({retry_state.outcome.exception()}); retrying in {retry_state.next_action.sleep:.1f}s.")
+
+        return {"stop": stop_after_attempt(MAX_RETRIES + 1),
+                "wait": wait_random_exponential(multiplier=1, max=RETRY_MAX_SECONDS),
+                "retry": retry_if_exception(retryable), "reraise": True, "before_sleep": _before_sleep}
+
+    def retrying(self, retryable: Callable[[BaseException], bool] = is_retryable) -> Retrying:
+        return Retrying(**self._retry_options(retryable))
+
+    def aretrying(self, retryable: Callable[[BaseException], bool] = is_retryable) -> AsyncRetrying:
+        return AsyncRetrying(**self._retry_options(retryable))
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(quota: str) -> RateLimiter:
+    """The process-wide limiter of an API quota, created on first use from the environment."""
+    with _limiters_lock:
+        if quota not in _limiters:
+            _limiters[quota] = RateLimiter(quota, rpm=RPM, tpm=TPM, max_concurrency=MAX_CONCURRENCY)
+        return _limiters[quota]
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+def _text_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _message_tokens(messages: List[BaseMessage]) -> int:
+    return sum(_text_tokens(m.content if isinstance(m.content, str) else str(m.content)) for m in messages)
+
+
+def _chat_usage(result: ChatResult, prompt_tokens: int) -> int:
+    """Tokens of a chat call as reported by the provider, else estimated from the texts."""
+    reported = sum((getattr(g.message, "usage_metadata", None) or {}).get("total_tokens", 0)
+                   for g in result.generations)
+    return reported or prompt_tokens + sum(_text_tokens(g.text) for g in result.generations)
+
+
+def _llm_usage(result: LLMResult, prompt_tokens: int) -> int:
+    reported = sum((g.generation_info or {}).get("prompt_eval_count", 0) + (g.generation_info or {}).get("eval_count", 0)
+                   for generations in result.generations for g in generations)
+    return reported or prompt_tokens + sum(_text_tokens(g.text) for gs in result.generations for g in gs)
+
+
+def _call_info(queued: float, attempts: int) -> Dict[str, Any]:
+    return {"rate_limit": {"queued_ms": round(queued * 1000, 1), "retries": attempts - 1}}
+
+
+def _limited_call(limiter: RateLimiter, estimated_tokens: int, call: Callable[[], Any],
+                  usage: Callable[[Any], int]):
+    queued, attempts = 0.0, 0
+    for attempt in limiter.retrying():
+        with attempt:
+            attempts += 1
+            permit = limiter.acquire(estimated_tokens)
+            queued += permit.queued
+            try:
+                result = call()
+            except Exception as e:
+                limiter.release(permit, error=e)
+                raise
+            except BaseException:  # cancelled
+                limiter.release(permit)
+                raise
+            limiter.release(permit, usage(result))
+    return result, _call_info(queued, attempts)
+
+
+async def _alimited_call(limiter: RateLimiter, estimated_tokens: int, call: Callable[[], Any],
+                         usage: Callable[[Any], int]):
+    queued, attempts = 0.0, 0
+    async for attempt in limiter.aretrying():
+        with attempt:
+            attempts += 1
+            permit = await limiter.aacquire(estimated_tokens)
+            queued += permit.queued
+            try:
+                result = await call()
+            except Exception as e:
+                limiter.release(permit, error=e)
+                raise
+            except BaseException:  # cancelled
+                limiter.release(permit)
+                raise
+            limiter.release(permit, usage(result))
+    return result, _call_info(queued, attempts)
+
+
+def _with_call_info(llm_output: Optional[Dict[str, Any]], info: Dict[str, Any]) -> Dict[str, Any]:
+    return {**(llm_output or {}), **info}
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """Chat model proxy that sends every call of `wrapped` through `limiter`."""
+
+    wrapped: BaseChatModel
+    limiter: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.wrapped._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.wrapped._identifying_params
+
+    def _get_llm_string(self, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        # Same cache key as the wrapped model, so responses cached without the proxy stay valid.
+        return self.wrapped._get_llm_string(stop=stop, **kwargs)
+
+    def _get_ls_params(self, stop: Optional[List[str]] = None, **kwargs: Any):
+        return self.wrapped._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs: Any):
+        # The wrapped model formats the tools; its binding kwargs reach it through _generate.
+        return self.bind(**self.wrapped.bind_tools(tools, **kwargs).kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt_tokens = _message_tokens(messages)
+        result, info = _limited_call(
+            self.limiter, prompt_tokens,
+            lambda: self.wrapped._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            lambda result: _chat_usage(result, prompt_tokens))
+        result.llm_output = _with_call_info(result.llm_output, info)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt_tokens = _message_tokens(messages)
+        result, info = await _alimited_call(
+            self.limiter, prompt_tokens,
+            lambda: self.wrapped._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            lambda result: _chat_usage(result, prompt_tokens))
+        result.llm_output = _with_call_info(result.llm_output, info)
+        return result
+
+    def _streams(self) -> bool:
+        return type(self.wrapped)._stream is not BaseChatModel._stream
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if not self._streams():
+            yield _result_chunk(self._generate(messages, stop=stop, run_manager=run_manager, **kwargs))
+            return
+        prompt_tokens = _message_tokens(messages)
+        queued, attempts, state = 0.0, 0, {"emitted": False}
+        # Only a stream that failed before its first chunk is retried; the last chunk is held
+        # back to carry the call's rate-limit info.
+        for attempt in self.limiter.retrying(lambda e: not state["emitted"] and is_retryable(e)):
+            with attempt:
+                attempts += 1
+                permit = self.limiter.acquire(prompt_tokens)
+                queued += permit.queued
+                last, error = None, None
+                try:
+                    for chunk in self.wrapped._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        if last is not None:
+                            state["emitted"] = True
+                            yield last
+                        last = chunk
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    self.limiter.release(permit, _chunk_usage(last, prompt_tokens) if error is None else None, error)
+        if last is not None:
+            last.generation_info = _with_call_info(last.generation_info, _call_info(queued, attempts))
+            yield last
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if not self._streams():
+            yield _result_chunk(await self._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs))
+            return
+        prompt_tokens = _message_tokens(messages)
+        queued, attempts, state = 0.0, 0, {"emitted": False}
+        async for attempt in self.limiter.aretrying(lambda e: not state["emitted"] and is_retryable(e)):
+            with attempt:
+                attempts += 1
+                permit = await self.limiter.aacquire(prompt_tokens)
+                queued += permit.queued
+                last, error = None, None
+                try:
+                    async for chunk in self.wrapped._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        if last is not None:
+                            state["emitted"] = True
+                            yield last
+                        last = chunk
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    self.limiter.release(permit, _chunk_usage(last, prompt_tokens) if error is None else None, error)
+        if last is not None:
+            last.generation_info = _with_call_info(last.generation_info, _call_info(queued, attempts))
+            yield last
+
+
+def _result_chunk(result: ChatResult) -> ChatGenerationChunk:
+    """The reply of a model without streaming support as a single chunk."""
+    generation = result.generations[0]
+    message = generation.message
+    tool_call_chunks = [{"name": call["name"], "args": json.dumps(call["args"]), "id": call.get("id"), "index": position}
+                        for position, call in enumerate(getattr(message, "tool_calls", []))]
+    chunk = AIMessageChunk(content=message.content, additional_kwargs=message.additional_kwargs,
+                           tool_call_chunks=tool_call_chunks, usage_metadata=getattr(message, "usage_metadata", None))
+    info = {"rate_limit": (result.llm_output or {}).get("rate_limit")}
+    return ChatGenerationChunk(message=chunk, generation_info=_with_call_info(generation.generation_info, info))
+
+
+def _chunk_usage(chunk: Optional[ChatGenerationChunk], prompt_tokens: int) -> Optional[int]:
+    if chunk is None:
+        return None
+    usage = getattr(chunk.message, "usage_metadata", None)
+    return (usage or {}).get("total_tokens") or prompt_tokens
+
+
+class RateLimitedLLM(BaseLLM):
+    """Completion-model counterpart of RateLimitedChatModel (Ollama in agent.py)."""
+
+    wrapped: BaseLLM
+    limiter: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.wrapped._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.wrapped._identifying_params
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> LLMResult:
+        prompt_tokens = sum(_text_tokens(prompt) for prompt in prompts)
+        result, info = _limited_call(
+            self.limiter, prompt_tokens,
+            lambda: self.wrapped._generate(prompts, stop=stop, run_manager=run_manager, **kwargs),
+            lambda result: _llm_usage(result, prompt_tokens))
+        result.llm_output = _with_call_info(result.llm_output, info)
+        return result
+
+    async def _agenerate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> LLMResult:
+        prompt_tokens = sum(_text_tokens(prompt) for prompt in prompts)
+        result, info = await _alimited_call(
+            self.limiter, prompt_tokens,
+            lambda: self.wrapped._agenerate(prompts, stop=stop, run_manager=run_manager, **kwargs),
+            lambda result: _llm_usage(result, prompt_tokens))
+        result.llm_output = _with_call_info(result.llm_output, info)
+        return result
+
+
+def rate_limited(model: Any, quota: str) -> Any:
+    """
+    Wraps `model` so its calls go through the limiter of `quota` (one per API key or
+    endpoint). The proxy takes over the model's cache, callbacks, tags and metadata.
+    Returns `model` unchanged when rate limiting is disabled.
+    """
+    if not ENABLED:
+        return model
+    proxy_class = RateLimitedChatModel if isinstance(model, BaseChatModel) else RateLimitedLLM
+    return proxy_class(wrapped=model, limiter=get_rate_limiter(quota), cache=model.cache,
+                       callbacks=model.callbacks, tags=model.tags, metadata=model.metadata, verbose=model.verbose)
@@ -0,0 +1,127 @@
+# tests/test_edit.py
+"""EditFile formats, error reporting and re-applying edits to files changed on disk."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.edit import EditConflict, apply_edits, edit_file, parse_patch  # noqa: E402
+from tools.file_system import WriteConflict, content_hash, overlay_transaction, replace_file  # noqa: E402
+
+SOURCE = "def add(a, b):\n    return a + b\n\n\ndef sub(a, b):\n    return a - b\n"
+
+
+def test_search_replace():
+    text, added, removed = apply_edits(SOURCE, [{"search": "return a + b", "replace": "return b + a"}])
+    assert text == SOURCE.replace("a + b", "b + a")
+    assert (added, removed) == (1, 1)
+
+
+def test_search_replace_blocks():
+    patch = ("<<<<<<< SEARCH\n"
+             "def sub(a, b):\n    return a - b\n"
+             "=======\n"
+             "def sub(a, b):\n    \"\"\"a minus b\"\"\"\n    return a - b\n"
+             ">>>>>>> REPLACE\n")
+    text, added, removed = apply_edits(SOURCE, parse_patch(patch))
+    assert text == SOURCE.replace("def sub(a, b):\n", "def sub(a, b):\n    \"\"\"a minus b\"\"\"\n")
+    assert (added, removed) == (3, 2)
+
+
+def test_unified_diff_with_wrong_line_numbers():
+    patch = ("--- a/calc.py\n+++ b/calc.py\n"
+             "@@ -3,2 +3,2 @@\n"
+             " def sub(a, b):\n"
+             "-    return a - b\n"
+             "+    return a - b  # difference\n")
+    text, added, removed = apply_edits(SOURCE, parse_patch(patch))
+    assert text == SOURCE.replace("return a - b", "return a - b  # difference")
+    assert (added, removed) == (1, 1)
+
+
+def test_line_ranges():
+    edits = [{"start_line": 2, "end_line": 2, "replace": "    return sum((a, b))"},
+             {"start_line": 5, "end_line": 4, "replace": "# subtraction\n"}]
+    text, added, removed = apply_edits(SOURCE, edits)
+    assert text.splitlines() == ["def add(a, b):", "    return sum((a, b))", "", "", "# subtraction",
+                                 "def sub(a, b):", "    return a - b"]
+    assert (added, removed) == (2, 1)
+
+
+def test_crlf_files_keep_their_line_endings():
+    text, _, _ = apply_edits(SOURCE.replace("\n", "\r\n"), [{"search": "a + b\n", "replace": "b + a\n"}])
+    assert text == SOURCE.replace("\n", "\r\n").replace("a + b", "b + a")
+
+
+@pytest.mark.parametrize("edit, message", [
+    ({"search": "return a * b", "replace": ""}, "not found"),
+    ({"search": "(a, b):", "replace": "(x, y):"}, "matches 2 places"),
+    ({"search": "", "replace": "x"}, "empty search"),
+    ({"start_line": 6, "end_line": 9, "replace": "x"}, "outside the file"),
+    ({"start_line": 0, "end_line": 1, "replace": "x"}, "outside the file"),
+])
+def test_edits_that_do_not_match(edit, message):
+    with pytest.raises(EditConflict, match=message):
+        apply_edits(SOURCE, [edit])
+
+
+def test_overlapping_line_ranges():
+    with pytest.raises(EditConflict, match="overlaps"):
+        apply_edits(SOURCE, [{"start_line": 1, "end_line": 3, "replace": ""},
+                             {"start_line": 3, "end_line": 4, "replace": ""}])
+
+
+@pytest.mark.parametrize("patch, message", [
+    ("just some text", "neither"),
+    ("<<<<<<< SEARCH\nx\n=======\ny\n", "unterminated"),
+    ("@@ -1 +1 @@\n-def mul(a, b):\n+def times(a, b):\n", "does not match"),
+])
+def test_bad_patches(patch, message):
+    with pytest.raises(EditConflict, match=message):
+        apply_edits(SOURCE, parse_patch(patch))
+
+
+def test_edit_file_reports_hash_and_checks_expected_hash(tmp_path):
+    path = tmp_path / "calc.py"
+    path.write_text(SOURCE)
+    result = edit_file(str(path), edits=[{"search": "a + b", "replace": "b + a"}])
+    new_hash = content_hash(path.read_bytes())
+    assert result.startswith("Edited") and result.endswith(new_hash)
+    stale = edit_file(str(path), edits=[{"search": "a - b", "replace": "b - a"}], expected_hash=content_hash(SOURCE))
+    assert stale.startswith("Error: Conflict") and "a - b" in path.read_text()
+    assert edit_file(str(path), edits=[{"search": "a - b", "replace": "b - a"}],
+                     expected_hash=new_hash).startswith("Edited")
+    assert edit_file(str(tmp_path / "missing.py"), patch="<<<<<<< SEARCH\na\n=======\nb\n>>>>>>> REPLACE\n") \
+        .startswith("Error: File not found")
+
+
+def test_edit_is_rebased_onto_an_unrelated_change(tmp_path):
+    path = tmp_path / "calc.py"
+    path.write_text(SOURCE)
+    with overlay_transaction():
+        assert edit_file(str(path), edits=[{"search": "a + b", "replace": "b + a"}]).startswith("Edited")
+        # Another subtask commits a change elsewhere in the file first.
+        replace_file(str(path), SOURCE.replace("a - b", "b - a"))
+    assert path.read_text() == SOURCE.replace("a + b", "b + a").replace("a - b", "b - a")
+
+
+def test_overlapping_change_raises_write_conflict(tmp_path):
+    path = tmp_path / "calc.py"
+    path.write_text(SOURCE)
+    with pytest.raises(WriteConflict):
+        with overlay_transaction():
+            assert edit_file(str(path), edits=[{"search": "a + b", "replace": "b + a"}]).startswith("Edited")
+            replace_file(str(path), SOURCE.replace("a + b", "sum((a, b))"))
+    assert path.read_text() == SOURCE.replace("a + b", "sum((a, b))")
+
+
+def test_line_range_edits_are_not_rebased(tmp_path):
+    path = tmp_path / "calc.py"
+    path.write_text(SOURCE)
+    with pytest.raises(WriteConflict):
+        with overlay_transaction():
+            edit_file(str(path), edits=[{"start_line": 2, "end_line": 2, "replace": "    return b + a"}])
+            replace_file(str(path), "# header\n" + SOURCE)
+    assert path.read_text() == "# header\n" + SOURCE
@@ -0,0 +1,120 @@
+# tests/test_plan_dag.py
+"""Plan validation, wave counting and the recursion limit sized from them."""
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module")
+def la(tmp_path_factory):
+    # The module logs to langgraph_agent.log in the working directory when it is imported.
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("agent"))
+    try:
+        return importlib.import_module("langgraph_agent")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def limits(la, monkeypatch):
+    monkeypatch.setattr(la, "MAX_PARALLEL_WORKERS", 4)
+    monkeypatch.setattr(la, "MAX_PLAN_WAVES", 25)
+    monkeypatch.setattr(la, "SUBTASK_RETRIES", 1)
+    monkeypatch.setattr(la, "MAX_REPLANS", 2)
+    return la
+
+
+def chain(la, length):
+    return la.build_plan([{"id": i, "subtask": f"step {i}", "depends_on": [i - 1] if i > 1 else []}
+                          for i in range(1, length + 1)])
+
+
+def wide(la, width):
+    return la.build_plan([{"id": i, "subtask": f"step {i}", "depends_on": []} for i in range(1, width + 1)])
+
+
+def test_valid_dag(la):
+    plan = la.build_plan([
+        {"id": 1, "subtask": "a", "depends_on": []},
+        {"id": 2, "subtask": "b", "depends_on": [1]},
+        {"id": 3, "subtask": "c", "depends_on": [1]},
+        {"id": 4, "subtask": "d", "depends_on": [2, 3]},
+    ])
+    assert la.validate_plan_dag(plan) is None
+    assert la.plan_depth(plan) == 3
+
+
+def test_flat_list_is_a_chain(la):
+    plan = la.build_plan(["a", "b", "c"])
+    assert [item["depends_on"] for item in plan] == [[], ["1"], ["2"]]
+    assert la.validate_plan_dag(plan) is None
+
+
+@pytest.mark.parametrize("items, message", [
+    ([{"id": 1, "subtask": "a", "depends_on": [2]}, {"id": 2, "subtask": "b", "depends_on": [1]}], "cycle"),
+    ([{"id": 1, "subtask": "a", "depends_on": [1]}], "depends on itself"),
+    ([{"id": 1, "subtask": "a", "depends_on": []}, {"id": 2, "subtask": "b", "depends_on": [7]}], "unknown"),
+    ([{"id": 1, "subtask": "a", "depends_on": []}, {"id": 1, "subtask": "b", "depends_on": []}], "duplicate"),
+])
+def test_invalid_dags_are_rejected(la, items, message):
+    assert message in la.validate_plan_dag(la.build_plan(items))
+
+
+def test_malformed_plans_raise(la):
+    with pytest.raises(ValueError):
+        la.build_plan({"id": 1})
+    with pytest.raises(ValueError):
+        la.build_plan([{"id": 1, "subtask": "a", "depends_on": "1"}])
+
+
+@pytest.mark.parametrize("plan_of, size, waves", [
+    (chain, 1, 1), (chain, 10, 10), (wide, 4, 1), (wide, 5, 2), (wide, 100, 25),
+])
+def test_plan_waves(limits, plan_of, size, waves):
+    assert limits.plan_waves(plan_of(limits, size)) == waves
+
+
+def test_plan_waves_skip_done_subtasks(limits):
+    plan = chain(limits, 6)
+    for item in plan[:4]:
+        item["status"] = "done"
+    assert limits.plan_waves(plan) == 2
+
+
+def test_plan_waves_cap_each_wave_at_the_worker_limit(limits):
+    # 1 -> (2..9): the fan-out after the root needs two waves of four.
+    plan = limits.build_plan([{"id": 1, "subtask": "root", "depends_on": []}] +
+                             [{"id": i, "subtask": f"leaf {i}", "depends_on": [1]} for i in range(2, 10)])
+    assert limits.plan_depth(plan) == 2
+    assert limits.plan_waves(plan) == 3
+
+
+@pytest.mark.parametrize("plan_of, size, allowed", [
+    (chain, 25, True), (chain, 26, False), (wide, 100, True), (wide, 101, False),
+])
+def test_plan_size_cap(limits, plan_of, size, allowed):
+    assert (limits.plan_size_error(plan_of(limits, size)) is None) == allowed
+
+
+def test_recursion_limit_covers_the_wave_budget(limits):
+    # 25 waves, each retried once, for the first plan and two replans.
+    assert limits.run_wave_budget() == 25 * 2 * 3
+    assert limits.recursion_limit_for(10) == 25
+    config = limits.run_config("thread")
+    assert config["configurable"]["thread_id"] == "thread"
+    assert config["recursion_limit"] == limits.recursion_limit_for(limits.run_wave_budget())
+    # Every plan that passes the size cap fits into one attempt of the budget.
+    assert limits.recursion_limit_for(limits.plan_waves(chain(limits, 25))) <= config["recursion_limit"]
+
+
+def test_recursion_limit_follows_the_configured_cap(limits, monkeypatch):
+    monkeypatch.setattr(limits, "MAX_PLAN_WAVES", 3)
+    monkeypatch.setattr(limits, "SUBTASK_RETRIES", 0)
+    monkeypatch.setattr(limits, "MAX_REPLANS", 0)
+    assert limits.run_config()["recursion_limit"] == 2 * 3 + 5
+    assert limits.plan_size_error(chain(limits, 4)) is not None
@@ -0,0 +1,76 @@
+# tests/test_plan_library.py
+"""Near-miss goals must not reuse a stored plan: it is replayed word for word."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plan_library import PlanLibrary, goal_anchors  # noqa: E402
+
+PLAN = [{"id": 1, "subtask": "Create app.py", "depends_on": []}]
+STORED = [
+    "Create a Flask app with a /health endpoint on port 5000 in app.py",
+    "Rename the function get_user to fetch_user in users/service.py",
+    "Build a todo list web app in React with a dark theme and local storage",
+    "Write 'hello world' to greeting.txt",
+]
+
+
+@pytest.fixture
+def library(tmp_path):
+    library = PlanLibrary(str(tmp_path / "plans.sqlite"))
+    for goal in STORED:
+        library.store(goal, PLAN)
+    return library
+
+
+@pytest.mark.parametrize("goal", [
+    "Create a Flask app with a /health endpoint on port 8080 in app.py",
+    "Create a Flask app with a /health endpoint on port 5000 in server.py",
+    "Create a Flask app with a /status endpoint on port 5000 in app.py",
+    "Rename the function get_user to load_user in users/service.py",
+    "Rename the function get_user to fetch_user in accounts/service.py",
+    "Build a todo list web app in Vue with a dark theme and local storage",
+    "Write 'goodbye world' to greeting.txt",
+])
+def test_near_miss_goals_are_not_reused(library, goal):
+    assert library.lookup(goal) is None
+
+
+@pytest.mark.parametrize("goal, stored", [
+    ("Create a Flask app in app.py with a /health endpoint on port 5000", STORED[0]),
+    ("Please rename the function get_user to fetch_user in users/service.py.", STORED[1]),
+    ("Build a todo-list web app in React with dark theme and local storage", STORED[2]),
+])
+def test_rewordings_with_the_same_anchors_are_reused(library, goal, stored):
+    hit = library.lookup(goal)
+    assert hit is not None
+    plan, similarity, stored_goal = hit
+    assert plan == PLAN and stored_goal == stored
+
+
+def test_goal_anchors():
+    assert goal_anchors(STORED[0]) == {"Flask", "/health", "5000", "app.py"}
+    assert goal_anchors("Build it in React. Then add PostgreSQL") == {"React", "PostgreSQL"}
+    assert goal_anchors("Rename getUser in `src/api.js` to v2.1, e.g. quickly") == {"getUser", "src/api.js", "v2.1"}
+
+
+def test_structured_steps_survive_a_round_trip(tmp_path):
+    library = PlanLibrary(str(tmp_path / "plans.sqlite"))
+    goal = "Scaffold a Flask app in app.py and run its tests"
+    plan = [
+        {"id": "1", "subtask": "Write app.py", "depends_on": [], "status": "done", "result": "ok",
+         "tool": "WriteFile", "args": {"path": "app.py", "content": "app = None\n"}},
+        {"id": "2", "subtask": "Run the tests", "depends_on": ["1"], "status": "done", "result": "ok",
+         "tool": None, "args": None},
+    ]
+    library.store(goal, plan)
+    stored_plan, similarity, stored_goal = library.lookup(goal)
+    assert stored_goal == goal and similarity > 0.99
+    assert stored_plan == [
+        {"id": "1", "subtask": "Write app.py", "depends_on": [],
+         "tool": "WriteFile", "args": {"path": "app.py", "content": "app = None\n"}},
+        {"id": "2", "subtask": "Run the tests", "depends_on": ["1"]},
+    ]
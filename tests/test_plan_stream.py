@@ -0,0 +1,109 @@
+# tests/test_plan_stream.py
+"""Incremental parsing of a streamed plan: what is emitted, when, and exactly once."""
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plan_stream import PlanStreamParser  # noqa: E402
+
+PLAN = [
+    {"id": 1, "subtask": "Create index.html with a [placeholder] list", "depends_on": []},
+    {"id": 2, "subtask": "Write \"style.css\" {dark theme}, then commit", "depends_on": [1],
+     "tool": "WriteFile", "args": {"path": "style.css", "content": "body { color: #fff; }\n"}},
+    {"id": 3, "subtask": "Escape \\ and unicode é in script.js", "depends_on": [1, 2]},
+]
+RESPONSE = "Here is the plan:\n```json\n" + json.dumps(PLAN, indent=2) + "\n```\nLet me know if it needs changes."
+
+
+def feed_chunks(text, cuts):
+    """Feeds `text` split at `cuts`; returns the parser and what each chunk completed."""
+    parser, emitted, start = PlanStreamParser(), [], 0
+    for cut in list(cuts) + [len(text)]:
+        emitted.append(parser.feed(text[start:cut]))
+        start = cut
+    return parser, emitted
+
+
+@pytest.mark.parametrize("cut", range(1, len(RESPONSE)))
+def test_split_at_every_position(cut):
+    parser, emitted = feed_chunks(RESPONSE, [cut])
+    assert [element for chunk in emitted for element in chunk] == PLAN
+    assert parser.finish() == PLAN
+
+
+def test_random_chunking_emits_each_element_once():
+    rng = random.Random(7)
+    for _ in range(200):
+        cuts = sorted(rng.sample(range(1, len(RESPONSE)), rng.randint(1, 40)))
+        parser, emitted = feed_chunks(RESPONSE, cuts)
+        assert [element for chunk in emitted for element in chunk] == PLAN
+
+
+def test_one_character_at_a_time_emits_elements_as_they_close():
+    text = json.dumps(PLAN)
+    parser = PlanStreamParser()
+    emitted_at = {}
+    for position, char in enumerate(text):
+        for element in parser.feed(char):
+            emitted_at[element["id"]] = position
+    # Each element is emitted by the separator right after it, not at the end of the list.
+    assert emitted_at[1] == text.index(', {"id": 2')
+    assert emitted_at[2] == text.index(', {"id": 3')
+    assert emitted_at[3] == len(text) - 1
+
+
+def test_flat_list_of_strings():
+    parser, emitted = feed_chunks('["Create app.py", "Run the tests"]', [10, 20])
+    assert parser.finish() == ["Create app.py", "Run the tests"]
+
+
+@pytest.mark.parametrize("prefix", ["", "Plan for step [1] of the goal:\n", "```json\n", "Sure! [\n  "])
+def test_prose_before_the_list_is_skipped(prefix):
+    if prefix.endswith("[\n  "):
+        text = prefix + json.dumps(PLAN)[1:]
+    else:
+        text = prefix + json.dumps(PLAN) + "\n```"
+    parser = PlanStreamParser()
+    assert [element for char in text for element in parser.feed(char)] == PLAN
+
+
+def test_truncated_final_element_is_not_emitted():
+    text = json.dumps(PLAN)
+    truncated = text[:text.index('{"id": 3') + 20]
+    parser, emitted = feed_chunks(truncated, [5, 50])
+    assert [element for chunk in emitted for element in chunk] == PLAN[:2]
+    with pytest.raises(ValueError):
+        parser.finish()
+
+
+def test_truncated_string_is_not_emitted():
+    parser = PlanStreamParser()
+    assert parser.feed('["Create app.py", "Run the te') == ["Create app.py"]
+    assert parser.feed('sts"') == []
+    assert parser.feed("]") == ["Run the tests"]
+
+
+def test_bracket_in_prose_does_not_start_the_plan():
+    parser = PlanStreamParser()
+    assert parser.feed("Step [") == []
+    assert parser.feed("1] first, then the plan: ") == []
+    assert parser.feed('["a"]') == ["a"]
+
+
+def test_malformed_element_raises():
+    parser = PlanStreamParser()
+    parser.feed('[{"id": 1, "subtask": "a"}, ')
+    with pytest.raises(ValueError):
+        parser.feed('{"id": 2, subtask: b}]')
+
+
+def test_text_after_the_list_is_ignored():
+    parser = PlanStreamParser()
+    assert parser.feed('["a"] and ["b"]') == ["a"]
+    assert parser.feed(' ["c"]') == []
+    assert parser.finish() == ["a"]
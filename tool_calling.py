@@ -0,0 +1,210 @@
+# tool_calling.py
+"""
+Worker loop built on the model's native tool-calling API.
+
+The ReAct worker needs one LLM round trip per tool call and parses its actions from free
+text, so arguments containing commas or newlines need escaping and malformed actions cost
+a retry. Here the tools are bound with typed argument schemas, the model answers with
+structured tool calls, and all calls the model makes in one turn are executed before the
+next LLM call:
+
+- consecutive calls to tools listed in `parallel_safe` (reads, writes to distinct files)
+  run concurrently;
+- any other tool (shell commands, tests, git) runs on its own, in the order the model
+  requested it, after the calls before it have finished;
+- a write to a path already read or written by the running batch starts a new batch, so
+  calls on the same file keep their order; calls without a path (workspace-wide searches)
+  do not share a batch with writes.
+
+Calls whose arguments the model's output parser could not read (`invalid_tool_calls`) are
+answered with an error naming the parse problem, so the model can resend them; a turn made
+only of such calls does not end the task.
+
+`ToolCallingExecutor` has the `invoke`/`ainvoke({"input": ...}) -> {"output": ...}` interface
+of LangChain's AgentExecutor, so the worker node can use either.
+"""
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+logger = logging.getLogger(__name__)
+
+ITERATION_LIMIT_OUTPUT = "Agent stopped due to iteration limit or time limit."
+
+WORKER_SYSTEM_PROMPT = (
+    "You are a worker agent completing one sub-task of a larger plan using the provided tools.\n"
+    "Call several tools in the same turn when the calls do not depend on each other's results "
+    "(e.g. reading or writing different files); they are executed concurrently.\n"
+    "When the sub-task is complete, answer with a short summary of what you did and no tool calls."
+)
+
+
+def supports_tool_calling(llm: Any) -> bool:
+    """True if `llm` implements bind_tools (chat models with a function-calling API)."""
+    llm = getattr(llm, "wrapped", llm)  # rate_limit.RateLimitedChatModel proxies another model
+    if llm is None or not hasattr(llm, "bind_tools"):
+        return False
+    try:
+        from langchain_core.language_models.chat_models import BaseChatModel
+    except ImportError:
+        return True
+    # BaseChatModel.bind_tools only raises NotImplementedError; providers override it.
+    return type(llm).bind_tools is not BaseChatModel.bind_tools
+
+
+def message_text(message: BaseMessage) -> str:
+    """Text of a model message; some providers return a list of content parts."""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else str(part.get("text", ""))
+                   for part in content if isinstance(part, (str, dict)))
+
+
+def plan_batches(tool_calls: Sequence[Dict[str, Any]], parallel_safe: Iterable[str],
+                 writers: Iterable[str] = ()) -> List[List[Dict[str, Any]]]:
+    """
+    Splits the tool calls of one model turn into batches that are run one after another;
+    the calls within a batch run concurrently. See the module docstring for the rules.
+    """
+    parallel_safe, writers = set(parallel_safe), set(writers)
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    touched, written, workspace_read = set(), set(), False
+    for call in tool_calls:
+        path = (call.get("args") or {}).get("path")
+        if call["name"] not in parallel_safe:
+            if current:
+                batches.append(current)
+            batches.append([call])
+            current, touched, written, workspace_read = [], set(), set(), False
+            continue
+        is_write = call["name"] in writers
+        if path is None:
+            conflict = bool(written)
+        else:
+            conflict = path in written or (is_write and (path in touched or workspace_read))
+        if conflict:
+            batches.append(current)
+            current, touched, written, workspace_read = [], set(), set(), False
+        current.append(call)
+        if path is None:
+            workspace_read = True
+        else:
+            touched.add(path)
+            if is_write:
+                written.add(path)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class ToolCallingExecutor:
+    """Runs a task with a tool-calling chat model until it answers without tool calls."""
+
+    def __init__(self, llm: Any, tools: Sequence[Any], parallel_safe: Iterable[str] = (),
+                 writers: Iterable[str] = (), max_iterations: int = 5, max_parallel_calls: int = 8,
+                 system_prompt: str = WORKER_SYSTEM_PROMPT):
+        self.tools = {tool.name: tool for tool in tools}
+        self.llm = llm.bind_tools(list(tools))
+        self.parallel_safe = set(parallel_safe)
+        self.writers = set(writers)
+        self.max_iterations = max_iterations
+        self.max_parallel_calls = max(1, max_parallel_calls)
+        self.system_prompt = system_prompt
+
+    def _initial_messages(self, task: str) -> List[BaseMessage]:
+        return [SystemMessage(content=self.system_prompt), HumanMessage(content=task)]
+
+    def _tool_message(self, call: Dict[str, Any], output: Any) -> ToolMessage:
+        return ToolMessage(content=str(output), tool_call_id=call.get("id") or call["name"], name=call["name"])
+
+    def _invalid_call_messages(self, reply: AIMessage) -> List[ToolMessage]:
+        """Error replies for calls whose arguments could not be parsed, so the model can resend them."""
+        messages = []
+        for call in getattr(reply, "invalid_tool_calls", None) or []:
+            name = call.get("name") or "unknown"
+            args = str(call.get("args") or "")[:500]
+            error = call.get("error") or "the arguments are not valid JSON"
+            messages.append(ToolMessage(
+                content=f"Error: The call to {name} could not be parsed ({error}); arguments received: {args!r}. "
+                        f"No tool was run; send the call again with valid JSON arguments.",
+                tool_call_id=call.get("id") or name, name=name))
+        return messages
+
+    def _unknown_tool(self, call: Dict[str, Any]) -> Optional[str]:
+        if call["name"] in self.tools:
+            return None
+        return f"Error: Unknown tool '{call['name']}'. Available tools: {', '.join(self.tools)}."
+
+    def _run_call(self, call: Dict[str, Any]) -> str:
+        error = self._unknown_tool(call)
+        if error:
+            return error
+        try:
+            return str(self.tools[call["name"]].invoke(call.get("args") or {}))
+        except Exception as e:
+            # Invalid arguments are reported back to the model like any other tool error.
+            return f"Error: {call['name']} failed: {e}"
+
+    async def _arun_call(self, call: Dict[str, Any]) -> str:
+        error = self._unknown_tool(call)
+        if error:
+            return error
+        try:
+            return str(await self.tools[call["name"]].ainvoke(call.get("args") or {}))
+        except Exception as e:
+            return f"Error: {call['name']} failed: {e}"
+
+    def _log_turn(self, iteration: int, tool_calls: List[Dict[str, Any]], batches: List[List[Dict[str, Any]]]) -> None:
+        logger.info(f"Worker: Turn {iteration + 1}: {len(tool_calls)} tool call(s) "
+                    f"{[call['name'] for call in tool_calls]} in {len(batches)} batch(es).")
+
+    def invoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        messages = self._initial_messages(inputs["input"])
+        with ThreadPoolExecutor(max_workers=self.max_parallel_calls, thread_name_prefix="tool-call") as pool:
+            for iteration in range(self.max_iterations):
+                reply: AIMessage = self.llm.invoke(messages, config=config)
+                messages.append(reply)
+                invalid = self._invalid_call_messages(reply)
+                if not reply.tool_calls and not invalid:
+                    return {"output": message_text(reply), "messages": messages}
+                messages.extend(invalid)
+                batches = plan_batches(reply.tool_calls, self.parallel_safe, self.writers)
+                self._log_turn(iteration, reply.tool_calls, batches)
+                for batch in batches:
+                    if len(batch) == 1:
+                        outputs = [self._run_call(batch[0])]
+                    else:
+                        # Each call runs in a copy of this thread's context (subtask shell session, file overlay).
+                        contexts = [contextvars.copy_context() for _ in batch]
+                        outputs = list(pool.map(
+                            lambda context, call: context.run(self._run_call, call), contexts, batch))
+                    messages.extend(self._tool_message(call, output) for call, output in zip(batch, outputs))
+        return {"output": ITERATION_LIMIT_OUTPUT, "messages": messages}
+
+    async def ainvoke(self, inputs: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        messages = self._initial_messages(inputs["input"])
+        semaphore = asyncio.Semaphore(self.max_parallel_calls)
+
+        async def _bounded(call: Dict[str, Any]) -> str:
+            async with semaphore:
+                return await self._arun_call(call)
+
+        for iteration in range(self.max_iterations):
+            reply: AIMessage = await self.llm.ainvoke(messages, config=config)
+            messages.append(reply)
+            invalid = self._invalid_call_messages(reply)
+            if not reply.tool_calls and not invalid:
+                return {"output": message_text(reply), "messages": messages}
+            messages.extend(invalid)
+            batches = plan_batches(reply.tool_calls, self.parallel_safe, self.writers)
+            self._log_turn(iteration, reply.tool_calls, batches)
+            for batch in batches:
+                outputs = await asyncio.gather(*(_bounded(call) for call in batch))
+                messages.extend(self._tool_message(call, output) for call, output in zip(batch, outputs))
+        return {"output": ITERATION_LIMIT_OUTPUT, "messages": messages}
@@ -19,5 +19,5 @@
 # For now, we'll keep it simple and require users to import from the specific modules,
 # e.g., `from tools.file_system import read_file`.
 # This can be revisited if a flatter namespace is preferred for the agent's direct use.
-
-print("tools package initialized")
+#
+# Keep this module free of imports and side effects: every tool import goes through it.
@@ -0,0 +1,89 @@
+# tools/changes.py
+"""
+Record of the paths the agent's file tools have written, so commits can stage exactly
+those paths instead of scanning the whole working tree.
+
+Each run has its own record (`run_changes`), selected through the `current_changes`
+context variable like the write overlay, so a GitCommit in one run never commits the
+files of another run in the same process. Code outside a run uses a process-wide record.
+"""
+import contextvars
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional
+
+# Records of the most recent runs; older ones are dropped.
+MAX_RUNS = 64
+
+
+class ChangeRecord:
+    """Absolute paths changed by one run and not committed yet."""
+
+    def __init__(self):
+        self._paths = set()
+        self._lock = threading.Lock()
+
+    def add(self, path: str) -> None:
+        with self._lock:
+            self._paths.add(path)
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return sorted(self._paths)
+
+    def forget(self, paths: Iterable[str]) -> None:
+        with self._lock:
+            self._paths.difference_update(paths)
+
+
+_lock = threading.Lock()
+_process_changes = ChangeRecord()
+_runs: "OrderedDict[str, ChangeRecord]" = OrderedDict()
+# Called with the absolute path of every recorded change, e.g. to update the code index.
+_listeners: List[Callable[[str], None]] = []
+
+# Set by the worker (or service job) to the record of the run it belongs to.
+current_changes: contextvars.ContextVar[Optional[ChangeRecord]] = contextvars.ContextVar(
+    "current_changes", default=None)
+
+
+def run_changes(run_key: str) -> ChangeRecord:
+    """The record of the run `run_key` (e.g. its thread id), created on first use."""
+    with _lock:
+        record = _runs.get(run_key)
+        if record is None:
+            record = _runs[run_key] = ChangeRecord()
+            while len(_runs) > MAX_RUNS:
+                _runs.popitem(last=False)
+        _runs.move_to_end(run_key)
+        return record
+
+
+def _current_record() -> ChangeRecord:
+    return current_changes.get() or _process_changes
+
+
+def record_change(path: str) -> None:
+    """Marks `path` (created, modified or deleted) as changed by the current run."""
+    path = os.path.abspath(path)
+    _current_record().add(path)
+    with _lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        listener(path)
+
+
+def add_change_listener(listener: Callable[[str], None]) -> None:
+    with _lock:
+        _listeners.append(listener)
+
+
+def changed_paths() -> List[str]:
+    """Absolute paths the current run changed since they were last committed, sorted."""
+    return _current_record().paths()
+
+
+def forget_changes(paths: Iterable[str]) -> None:
+    """Drops `paths` from the current run's record, e.g. once they are committed."""
+    _current_record().forget(os.path.abspath(p) for p in paths)
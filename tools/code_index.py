@@ -0,0 +1,457 @@
+# tools/code_index.py
+"""
+In-process search index of the workspace, behind the SearchCode and FindSymbol tools.
+
+For every text file the index keeps its (mtime, size), a content hash, a trigram
+signature and, for Python files, the classes, functions and module-level names it defines.
+A signature is a fixed-size bitset of the file's hashed (lowercased) trigrams; all of them
+form one NumPy matrix, so finding the files that may contain a string is a few vectorized
+bit tests over all files. Only those candidates are read and searched, and the bitset
+keeps memory bounded (512 bytes per file) however large the workspace is.
+
+The index is built on first use and then updated incrementally: files written through the
+file tools are re-indexed on the next lookup, and a stat walk (re-reading only files whose
+mtime or size changed, re-indexing only those whose hash changed) runs after shell commands
+and at most every AGENT_CODE_INDEX_RESCAN_SECONDS otherwise.
+
+Configuration (environment variables):
+    AGENT_CODE_INDEX_RESCAN_SECONDS   maximum age of the file list (default: 30)
+    AGENT_CODE_INDEX_MAX_FILE_BYTES   larger files are not indexed (default: 1 MiB)
+"""
+import ast
+import fnmatch
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from tools.changes import add_change_listener
+from tools.file_system import pending_writes
+from tools.testing import EXCLUDED_DIRS
+
+RESCAN_SECONDS = float(os.getenv("AGENT_CODE_INDEX_RESCAN_SECONDS", "30"))
+MAX_FILE_BYTES = int(os.getenv("AGENT_CODE_INDEX_MAX_FILE_BYTES", str(1 << 20)))
+SIGNATURE_BITS = 1 << 12
+_WORDS = SIGNATURE_BITS // 64
+_HASH_SHIFT = np.uint32(32 - 12)
+_HASH_MULTIPLIER = np.uint32(2654435761)
+MAX_LINE_CHARS = 200
+
+
+class Symbol(NamedTuple):
+    name: str
+    kind: str  # "class", "function", "method" or "variable"
+    qualname: str
+    path: str
+    line: int
+    text: str
+
+
+class _FileEntry(NamedTuple):
+    path: str
+    stat_key: Tuple[int, int]
+    digest: bytes
+    symbols: List[Symbol]
+
+
+def trigram_signature(data: bytes) -> np.ndarray:
+    """Bitset (as uint64 words) of the hashed, lowercased trigrams of `data`."""
+    signature = np.zeros(_WORDS, dtype=np.uint64)
+    if len(data) < 3:
+        return signature
+    chars = np.frombuffer(data.lower(), dtype=np.uint8).astype(np.uint32)
+    trigrams = (chars[:-2] << np.uint32(16)) | (chars[1:-1] << np.uint32(8)) | chars[2:]
+    bits = np.unique((trigrams * _HASH_MULTIPLIER) >> _HASH_SHIFT).astype(np.uint64)
+    np.bitwise_or.at(signature, (bits >> np.uint64(6)).astype(np.intp), np.uint64(1) << (bits & np.uint64(63)))
+    return signature
+
+
+def required_literals(pattern: str) -> List[str]:
+    """
+    Substrings (3+ characters) every match of the regex `pattern` must contain; used to pick
+    candidate files. Conservative: alternations, groups, classes and optional characters
+    only ever drop literals, so a pattern without usable literals searches every file.
+    """
+    if "|" in pattern:
+        return []
+    literals, current, depth, i = [], [], 0, 0
+
+    def _flush():
+        if depth == 0 and len(current) >= 3:
+            literals.append("".join(current))
+        current.clear()
+
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            escaped = pattern[i + 1:i + 2]
+            i += 2
+            if escaped and not escaped.isalnum() and depth == 0:
+                current.append(escaped)
+            else:
+                _flush()
+            continue
+        if char in "?*{":
+            if current:
+                current.pop()  # the previous character is optional or repeated zero times
+            _flush()
+            if char == "{":
+                close = pattern.find("}", i)
+                i = close if close >= 0 else len(pattern)
+        elif char == "[":
+            _flush()
+            close = pattern.find("]", i + 2)
+            i = close if close >= 0 else len(pattern)
+        elif char == "(":
+            _flush()
+            depth += 1
+        elif char == ")":
+            _flush()
+            depth = max(0, depth - 1)
+        elif char in ".^$+":
+            _flush()  # after '+' the character is required, but what follows need not be adjacent
+        elif depth == 0:
+            current.append(char)
+        i += 1
+    _flush()
+    return literals
+
+
+def python_symbols(source: str, path: str) -> List[Symbol]:
+    """Classes, functions, methods and module-level assignments defined in a Python source."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    lines = source.splitlines()
+    symbols = []
+
+    def _text(line: int) -> str:
+        return lines[line - 1].strip()[:MAX_LINE_CHARS] if 0 < line <= len(lines) else ""
+
+    def _visit(body, prefix: str, in_class: bool) -> None:
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                qualname = f"{prefix}{node.name}"
+                kind = "class" if isinstance(node, ast.ClassDef) else ("method" if in_class else "function")
+                symbols.append(Symbol(node.name, kind, qualname, path, node.lineno, _text(node.lineno)))
+                _visit(node.body, f"{qualname}.", isinstance(node, ast.ClassDef))
+            elif not prefix and isinstance(node, (ast.Assign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name):
+                        symbols.append(Symbol(target.id, "variable", target.id, path, node.lineno, _text(node.lineno)))
+    _visit(tree.body, "", False)
+    return symbols
+
+
+class CodeIndex:
+    """Trigram-signature and symbol index of the text files under `root`."""
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        self._lock = threading.RLock()
+        self._ids: Dict[str, int] = {}
+        self._entries: List[Optional[_FileEntry]] = []
+        self._free: List[int] = []
+        self._signatures = np.zeros((1024, _WORDS), dtype=np.uint64)
+        self._live = np.zeros(1024, dtype=bool)
+        self._symbols: Dict[str, List[Symbol]] = {}
+        self._names: Optional[Tuple[str, List[str]]] = None  # lowercased names joined by newlines, names
+        self._dirty: Set[str] = set()
+        self._stale = True
+        self._scanned_at = 0.0
+        self.files_indexed = 0  # files (re-)read and indexed, for stats
+
+    # --- maintenance ---
+
+    def invalidate(self) -> None:
+        """Forces a stat walk before the next lookup, e.g. after a shell command."""
+        self._stale = True
+
+    def mark_dirty(self, path: str) -> None:
+        """Re-indexes `path` (absolute) before the next lookup."""
+        relative = os.path.relpath(os.path.realpath(path), self.root)
+        if relative.split(os.sep)[0] != os.pardir:
+            with self._lock:
+                self._dirty.add(relative)
+
+    def _walk(self):
+        for directory, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in EXCLUDED_DIRS and not d.startswith(".")]
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                yield os.path.relpath(path, self.root)
+
+    def _sync(self) -> None:
+        if self._stale or time.monotonic() - self._scanned_at > RESCAN_SECONDS:
+            self._stale = False
+            seen = set()
+            for relative in self._walk():
+                seen.add(relative)
+                self._update(relative)
+            for relative in [path for path in self._ids if path not in seen]:
+                self._remove(relative)
+            self._dirty.clear()
+            self._scanned_at = time.monotonic()
+        elif self._dirty:
+            dirty, self._dirty = self._dirty, set()
+            for relative in dirty:
+                self._update(relative)
+
+    def _update(self, relative: str) -> None:
+        path = os.path.join(self.root, relative)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._remove(relative)
+            return
+        file_id = self._ids.get(relative)
+        entry = self._entries[file_id] if file_id is not None else None
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if entry and entry.stat_key == stat_key:
+            return
+        if not os.path.isfile(path) or stat.st_size > MAX_FILE_BYTES:
+            self._remove(relative)
+            return
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self._remove(relative)
+            return
+        if b"\0" in data[:8192]:  # binary
+            self._remove(relative)
+            return
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if entry and entry.digest == digest:
+            self._entries[file_id] = entry._replace(stat_key=stat_key)  # touched, not changed
+            return
+        self._index(relative, stat_key, digest, data)
+
+    def _index(self, relative: str, stat_key: Tuple[int, int], digest: bytes, data: bytes) -> None:
+        self._remove(relative)
+        symbols = python_symbols(data.decode("utf-8", errors="replace"), relative) if relative.endswith(".py") else []
+        file_id = self._free.pop() if self._free else len(self._entries)
+        if file_id == len(self._entries):
+            self._entries.append(None)
+            if file_id >= len(self._live):
+                self._signatures = np.concatenate([self._signatures, np.zeros_like(self._signatures)])
+                self._live = np.concatenate([self._live, np.zeros_like(self._live)])
+        self._entries[file_id] = _FileEntry(relative, stat_key, digest, symbols)
+        self._ids[relative] = file_id
+        self._signatures[file_id] = trigram_signature(data)
+        self._live[file_id] = True
+        for symbol in symbols:
+            self._symbols.setdefault(symbol.name, []).append(symbol)
+        if symbols:
+            self._names = None
+        self.files_indexed += 1
+
+    def _remove(self, relative: str) -> None:
+        file_id = self._ids.pop(relative, None)
+        if file_id is None:
+            return
+        for symbol in self._entries[file_id].symbols:
+            remaining = [s for s in self._symbols.get(symbol.name, []) if s.path != relative]
+            if remaining:
+                self._symbols[symbol.name] = remaining
+            else:
+                self._symbols.pop(symbol.name, None)
+            self._names = None
+        self._entries[file_id] = None
+        self._live[file_id] = False
+        self._free.append(file_id)
+
+    def _pending(self) -> Dict[str, str]:
+        """Pending overlay writes under the root, by relative path."""
+        pending = {}
+        for path, content in pending_writes().items():
+            relative = os.path.relpath(os.path.realpath(path), self.root)
+            if relative.split(os.sep)[0] != os.pardir:
+                pending[relative] = content
+        return pending
+
+    # --- lookups ---
+
+    def candidates(self, literals: List[str]) -> List[str]:
+        """Indexed files whose signature contains every trigram of every literal, sorted."""
+        with self._lock:
+            self._sync()
+            count = len(self._entries)
+            mask = self._live[:count].copy()
+            for literal in literals:
+                query = trigram_signature(literal.encode("utf-8"))
+                columns = np.nonzero(query)[0]
+                if len(columns):
+                    mask &= np.all((self._signatures[:count, columns] & query[columns]) == query[columns], axis=1)
+            return sorted(self._entries[file_id].path for file_id in np.nonzero(mask)[0])
+
+    def search(self, query: str, regex: bool = False, path_glob: Optional[str] = None,
+               max_results: int = 50) -> Tuple[List[Tuple[str, int, str]], Dict[str, int]]:
+        """
+        Matching lines as (path, line number, text) plus search stats. Literal queries are
+        case-insensitive unless they contain an uppercase letter; regexes match as written.
+        Raises re.error for an invalid regex.
+        """
+        if regex:
+            pattern = re.compile(query, re.MULTILINE)
+            literals = required_literals(query)
+        else:
+            pattern = re.compile(re.escape(query), 0 if any(c.isupper() for c in query) else re.IGNORECASE)
+            literals = [query]
+        pending = self._pending()
+        candidates = self.candidates(literals)
+        paths = sorted(set(candidates) | set(pending))
+        if path_glob:
+            paths = [path for path in paths if fnmatch.fnmatch(path, path_glob)]
+        results, searched = [], 0
+        for path in paths:
+            text = pending.get(path)
+            if text is None:
+                try:
+                    with open(os.path.join(self.root, path), "r", encoding="utf-8", errors="replace") as f:
+                        text = f.read()
+                except OSError:
+                    continue
+            searched += 1
+            line, position, last_line = 1, 0, 0
+            for match in pattern.finditer(text):
+                line += text.count("\n", position, match.start())
+                position = match.start()
+                if line == last_line:
+                    continue
+                last_line = line
+                start = text.rfind("\n", 0, match.start()) + 1
+                end = text.find("\n", match.start())
+                results.append((path, line, text[start:end if end >= 0 else len(text)].strip()[:MAX_LINE_CHARS]))
+                if len(results) >= max_results:
+                    break
+            if len(results) >= max_results:
+                break
+        return results, {"files": len(self._ids), "candidates": len(candidates), "searched": searched}
+
+    def find_symbol(self, name: str, kind: Optional[str] = None, max_results: int = 20) -> List[Symbol]:
+        """
+        Definitions of `name`: an exact name ('run_tests') or qualified name ('CodeIndex.search');
+        if there is none, names containing it (case-insensitive).
+        """
+        with self._lock:
+            self._sync()
+            table = self._symbols
+            pending = {path: content for path, content in self._pending().items() if path.endswith(".py")}
+            if pending:
+                # Definitions in pending writes replace those of the files on disk.
+                table = {}
+                for symbol_name, symbols in self._symbols.items():
+                    kept = [symbol for symbol in symbols if symbol.path not in pending]
+                    if kept:
+                        table[symbol_name] = kept
+                for path, content in pending.items():
+                    for symbol in python_symbols(content, path):
+                        table.setdefault(symbol.name, []).append(symbol)
+
+            short_name = name.rsplit(".", 1)[-1]
+            matches = [symbol for symbol in table.get(short_name, [])
+                       if symbol.qualname == name or symbol.qualname.endswith(f".{name}") or "." not in name]
+            if not matches:
+                matches = [symbol for symbol_name in self._names_containing(name.lower(), table)
+                           for symbol in table[symbol_name]]
+        if kind:
+            matches = [symbol for symbol in matches if symbol.kind == kind]
+        return sorted(matches, key=lambda symbol: (symbol.path, symbol.line))[:max_results]
+
+    def _names_containing(self, needle: str, table: Dict[str, List[Symbol]]) -> List[str]:
+        """Symbol names containing `needle` (lowercase), via one substring scan over all names."""
+        if table is not self._symbols:
+            return [symbol_name for symbol_name in table if needle in symbol_name.lower()]
+        if self._names is None:
+            names = list(self._symbols)
+            self._names = ("\n".join(names).lower(), names)
+        blob, names = self._names
+        found, index, counted_to = [], 0, 0
+        position = blob.find(needle)
+        while position >= 0:
+            # Index of the name containing `position` = number of newlines before it.
+            index += blob.count("\n", counted_to, position)
+            counted_to = position
+            found.append(names[index])
+            next_name = blob.find("\n", position)
+            if next_name < 0:
+                break
+            position = blob.find(needle, next_name + 1)
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"files": len(self._ids), "symbols": sum(len(symbols) for symbols in self._symbols.values()),
+                    "files_indexed": self.files_indexed}
+
+
+_index: Optional[CodeIndex] = None
+_index_lock = threading.Lock()
+
+
+def _on_change(path: str) -> None:
+    if _index is not None:
+        _index.mark_dirty(path)
+
+
+add_change_listener(_on_change)
+
+
+def get_code_index() -> CodeIndex:
+    """Index of the current working directory; a new one is built if the directory changed."""
+    global _index
+    with _index_lock:
+        root = os.path.realpath(os.getcwd())
+        if _index is None or _index.root != root:
+            _index = CodeIndex(root)
+        return _index
+
+
+def invalidate_code_index() -> None:
+    """Makes the next lookup re-check the workspace (files may have changed outside the file tools)."""
+    if _index is not None:
+        _index.invalidate()
+
+
+def search_code(query: str, regex: bool = False, path_glob: Optional[str] = None, max_results: int = 50) -> str:
+    """Searches all text files of the workspace for `query`; returns 'path:line: text' lines."""
+    if not query:
+        return "Error: Search query is empty."
+    started = time.perf_counter()
+    try:
+        results, stats = get_code_index().search(query, regex, path_glob, max_results)
+    except re.error as e:
+        return f"Error: Invalid regex '{query}': {e}"
+    except Exception as e:
+        return f"Error searching code: {str(e)}"
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    summary = (f"({stats['searched']} of {stats['files']} files searched via the index "
+               f"in {elapsed_ms:.0f}ms)")
+    if not results:
+        return f"No matches for '{query}' {summary}."
+    lines = [f"{path}:{line}: {text}" for path, line, text in results]
+    if len(results) >= max_results:
+        lines.append(f"[Stopped after {max_results} matches; narrow the query or pass a path glob.]")
+    lines.append(summary)
+    return "\n".join(lines)
+
+
+def find_symbol(name: str, kind: Optional[str] = None) -> str:
+    """Finds where a Python class, function, method or module-level name is defined."""
+    if not name:
+        return "Error: Symbol name is empty."
+    try:
+        symbols = get_code_index().find_symbol(name.strip(), kind)
+    except Exception as e:
+        return f"Error finding symbol: {str(e)}"
+    if not symbols:
+        return f"No definition of '{name}' found."
+    return "\n".join(f"{symbol.path}:{symbol.line}: {symbol.kind} {symbol.qualname}: {symbol.text}"
+                     for symbol in symbols)
@@ -0,0 +1,278 @@
+# tools/edit.py
+"""
+Partial file edits, so changing one function costs output tokens for that function only.
+
+`edit_file` applies any mix of:
+    - search/replace edits: `search` must occur exactly once in the file (include a few
+      surrounding lines when it does not) and is replaced by `replace`;
+    - line-range edits: lines `start_line`..`end_line` (1-based, inclusive, numbered as in
+      the file before the call) are replaced by `replace`; `end_line = start_line - 1`
+      inserts before `start_line`;
+    - a patch: a unified diff of the file, or SEARCH/REPLACE blocks
+          <<<<<<< SEARCH
+          old lines
+          =======
+          new lines
+          >>>>>>> REPLACE
+      Diff hunks are located by their context and removed lines; the line numbers in the
+      hunk header are only a hint, so slightly wrong numbers still apply.
+
+Every result reports the file's new content hash. Passing it back as `expected_hash` makes
+the next edit fail with a conflict instead of applying to a file that changed in between.
+Edits are also checked when they reach the disk: if another subtask committed the same
+file first, search/replace edits and diff hunks are re-applied to its new content, and a
+conflict is reported when they no longer match (line-range edits are never re-applied).
+Files are written atomically through the write overlay or `replace_file`.
+"""
+import asyncio
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from tools.file_system import WriteConflict, content_hash, current_overlay, replace_file
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+
+
+class EditConflict(ValueError):
+    """An edit does not match the file's current content."""
+
+
+# --- Parsing ---
+
+def _parse_search_replace_blocks(patch: str) -> List[Dict[str, Any]]:
+    edits, search, replace, section = [], [], [], None
+    for line in patch.splitlines(keepends=True):
+        marker = line.strip()
+        if marker.startswith("<<<<<<<") and marker.endswith("SEARCH"):
+            search, replace, section = [], [], "search"
+        elif marker == "=======" and section == "search":
+            section = "replace"
+        elif marker.startswith(">>>>>>>") and marker.endswith("REPLACE") and section == "replace":
+            edits.append({"search": "".join(search), "replace": "".join(replace)})
+            section = None
+        elif section == "search":
+            search.append(line)
+        elif section == "replace":
+            replace.append(line)
+    if section is not None:
+        raise EditConflict("unterminated SEARCH/REPLACE block")
+    return edits
+
+
+def _parse_unified_diff(patch: str) -> List[Dict[str, Any]]:
+    hunks, hunk, files, blanks = [], None, 0, 0
+    lines = patch.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            files += 1
+            if files > 1:
+                raise EditConflict("the patch changes more than one file; edit one file per call")
+            hunk = None
+        elif line.startswith("@@"):
+            header = _HUNK_HEADER.match(line)
+            hunk = {"old": [], "new": [], "old_start": int(header.group(1)) if header else None,
+                    "no_newline": False, "added": 0, "removed": 0}
+            hunks.append(hunk)
+            blanks = 0
+        elif hunk is None:
+            continue  # file headers, "diff --git", "index" and other preamble
+        elif not line:
+            blanks += 1  # models drop the space of empty context lines; trailing ones are noise
+        else:
+            hunk["old"] += [""] * blanks
+            hunk["new"] += [""] * blanks
+            blanks = 0
+            if line.startswith("\\"):
+                hunk["no_newline"] = True  # "\\ No newline at end of file"
+            elif line.startswith("-"):
+                hunk["old"].append(line[1:])
+                hunk["removed"] += 1
+            elif line.startswith("+"):
+                hunk["new"].append(line[1:])
+                hunk["added"] += 1
+            else:
+                hunk["old"].append(line[1:])
+                hunk["new"].append(line[1:])
+    return [{"hunk": hunk} for hunk in hunks]
+
+
+def parse_patch(patch: str) -> List[Dict[str, Any]]:
+    """Edits described by a unified diff or by SEARCH/REPLACE blocks."""
+    if re.search(r"^\s*<<<<<<<\s*SEARCH\s*$", patch, re.MULTILINE):
+        edits = _parse_search_replace_blocks(patch)
+    elif re.search(r"^@@", patch, re.MULTILINE):
+        edits = _parse_unified_diff(patch)
+    else:
+        raise EditConflict("the patch is neither a unified diff (with @@ hunks) nor SEARCH/REPLACE blocks")
+    if not edits:
+        raise EditConflict("the patch contains no edits")
+    return edits
+
+
+# --- Applying ---
+
+def _line_ending(lines: Sequence[str]) -> str:
+    return "\r\n" if lines and lines[0].endswith("\r\n") else "\n"
+
+
+def _apply_line_ranges(lines: List[str], edits: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """Applies line-range edits (numbered as in `lines`) bottom-up; returns (added, removed) lines."""
+    added = removed = 0
+    ending = _line_ending(lines)
+    previous_start = len(lines) + 1
+    for edit in sorted(edits, key=lambda edit: edit["start_line"], reverse=True):
+        start, end = edit["start_line"], edit["end_line"]
+        if start < 1 or end < start - 1 or end > len(lines):
+            raise EditConflict(f"line range {start}-{end} is outside the file ({len(lines)} lines)")
+        if end >= previous_start:
+            raise EditConflict(f"line range {start}-{end} overlaps another line-range edit")
+        previous_start = start
+        replacement = edit.get("replace") or ""
+        if replacement and not replacement.endswith("\n"):
+            replacement += "\n"
+        if ending == "\r\n":
+            replacement = re.sub(r"(?<!\r)\n", "\r\n", replacement)
+        new_lines = replacement.splitlines(keepends=True)
+        lines[start - 1:end] = new_lines
+        added += len(new_lines)
+        removed += end - start + 1
+    return added, removed
+
+
+def _apply_search_replace(text: str, search: str, replace: str) -> str:
+    if not search:
+        raise EditConflict("a search/replace edit has an empty search text")
+    if "\r\n" in text and "\r\n" not in search:
+        search, replace = search.replace("\n", "\r\n"), replace.replace("\n", "\r\n")
+    count = text.count(search)
+    if count == 0:
+        first_line = search.strip().splitlines()[0] if search.strip() else search
+        raise EditConflict(f"search text not found (starting with {first_line[:80]!r}); "
+                           f"it must match the file exactly, including indentation")
+    if count > 1:
+        raise EditConflict(f"search text matches {count} places; include more surrounding lines to make it unique")
+    return text.replace(search, replace, 1)
+
+
+def _apply_hunk(lines: List[str], hunk: Dict[str, Any], offset: int) -> int:
+    """Applies a diff hunk where its old lines match, nearest to the header's line; returns the line delta."""
+    old, new = hunk["old"], hunk["new"]
+    ending = _line_ending(lines)
+    hint = max(0, (hunk["old_start"] or 1) - 1 + offset)
+    if old:
+        stripped = [line.rstrip("\r\n") for line in lines]
+        positions = [i for i in range(len(lines) - len(old) + 1)
+                     if stripped[i] == old[0] and stripped[i:i + len(old)] == old]
+        if not positions:
+            raise EditConflict(f"a diff hunk does not match the file (its lines starting with {old[0][:80]!r} "
+                               f"were not found); re-read the lines and edit again")
+        if hunk["old_start"] is None and len(positions) > 1:
+            raise EditConflict(f"a diff hunk without line numbers matches {len(positions)} places; "
+                               f"add more context lines")
+        position = min(positions, key=lambda i: abs(i - hint))
+    else:
+        position = min(hint, len(lines))
+    replacement = [line + ending for line in new]
+    if replacement and hunk["no_newline"] and position + len(old) >= len(lines):
+        replacement[-1] = new[-1]
+    lines[position:position + len(old)] = replacement
+    return len(new) - len(old)
+
+
+def apply_edits(text: str, edits: Sequence[Dict[str, Any]], allow_line_ranges: bool = True) -> Tuple[str, int, int]:
+    """
+    Applies `edits` to `text` and returns (new text, added lines, removed lines). Line-range
+    edits are applied first, numbered as in `text`; the others follow in order. Raises
+    EditConflict when an edit does not match.
+    """
+    line_ranges = [edit for edit in edits if edit.get("start_line") is not None]
+    if line_ranges and not allow_line_ranges:
+        raise EditConflict("line-range edits cannot be re-applied to changed content")
+    added = removed = 0
+    if line_ranges:
+        lines = text.splitlines(keepends=True)
+        added, removed = _apply_line_ranges(lines, line_ranges)
+        text = "".join(lines)
+    offset = 0
+    for edit in edits:
+        if "hunk" in edit:
+            lines = text.splitlines(keepends=True)
+            delta = _apply_hunk(lines, edit["hunk"], offset)
+            offset += delta
+            added += edit["hunk"]["added"]
+            removed += edit["hunk"]["removed"]
+            text = "".join(lines)
+        elif edit.get("search") is not None:
+            text = _apply_search_replace(text, edit["search"], edit.get("replace") or "")
+            added += len((edit.get("replace") or "").splitlines())
+            removed += len(edit["search"].splitlines())
+        elif edit.get("start_line") is None:
+            raise EditConflict("every edit needs either 'search' or 'start_line'/'end_line'")
+    return text, added, removed
+
+
+# --- Tool ---
+
+def _current_text(path: str) -> Tuple[str, Optional[str]]:
+    """The file's content as the worker sees it and the hash of the disk content it comes
+    from (None when it comes from a pending overlay write)."""
+    overlay = current_overlay.get()
+    pending = overlay.read(path) if overlay else None
+    if pending is not None:
+        return pending, None
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return data.decode("utf-8"), content_hash(data)
+    except UnicodeDecodeError:
+        raise EditConflict(f"{path} is not a UTF-8 text file") from None
+
+
+def edit_file(path: str, edits: Optional[Sequence[Dict[str, Any]]] = None, patch: Optional[str] = None,
+              expected_hash: Optional[str] = None) -> str:
+    """
+    Applies search/replace and line-range `edits` and/or a `patch` (unified diff or
+    SEARCH/REPLACE blocks) to an existing file and reports its new content hash.
+    """
+    try:
+        operations = [dict(edit) for edit in edits or []]
+        if patch and patch.strip():
+            operations += parse_patch(patch)
+        if not operations:
+            return "Error: No edits given; pass search/replace or line-range edits, or a patch."
+        text, base_hash = _current_text(path)
+        if expected_hash and content_hash(text) != expected_hash.strip():
+            return (f"Error: Conflict: {path} changed since hash {expected_hash.strip()} "
+                    f"(now {content_hash(text)}); re-read it and edit it again.")
+        new_text, added, removed = apply_edits(text, operations)
+
+        def rebase(current: str) -> str:
+            return apply_edits(current, operations, allow_line_ranges=False)[0]
+
+        overlay = current_overlay.get()
+        if overlay:
+            overlay.write(path, new_text, base_hash=base_hash, rebase=rebase)
+        else:
+            replace_file(path, new_text, base_hash=base_hash, rebase=rebase)
+        return (f"Edited {path}: {len(operations)} edit(s), +{added}/-{removed} lines. "
+                f"Content hash: {content_hash(new_text)}")
+    except FileNotFoundError:
+        return f"Error: File not found at {path}; use WriteFile to create new files."
+    except (EditConflict, WriteConflict) as e:
+        return f"Error: Conflict: {e}"
+    except Exception as e:
+        return f"Error editing file: {str(e)}"
+
+
+async def aedit_file(path: str, edits: Optional[Sequence[Dict[str, Any]]] = None, patch: Optional[str] = None,
+                     expected_hash: Optional[str] = None) -> str:
+    """Async variant of edit_file; the file I/O runs in a worker thread, off the event loop."""
+    return await asyncio.to_thread(edit_file, path, edits, patch, expected_hash)
+
+
+def edit_file_command(params: str) -> str:
+    """Text-input form for ReAct agents: the file path on the first line, then the patch."""
+    path, _, patch = params.strip().partition("\n")
+    if not path.strip() or not patch.strip():
+        return "Error: Input must be the file path on the first line followed by a unified diff or SEARCH/REPLACE blocks."
+    return edit_file(path.strip(), patch=patch)
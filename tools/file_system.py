@@ -1,6 +1,288 @@
 # tools/file_system.py
+import asyncio
+import contextvars
+import errno
+import hashlib
+import io
+import itertools
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from tools.changes import record_change
+
+logger = logging.getLogger(__name__)
+
+# --- Write overlay ---
+# While an overlay is active (see overlay_transaction), write_file only buffers content in
+# memory and every read below sees the buffered version. The batch reaches the disk when the
+# transaction commits, and is dropped (restoring anything already flushed) when it fails.
+
+class WriteConflict(Exception):
+    """An edit no longer applies because its file changed on disk after the edit was made."""
+
+
+def content_hash(content) -> str:
+    """Short SHA-256 of a file's content (str is hashed as UTF-8), used to detect concurrent changes."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+# Held while files are checked against their base hash and renamed into place, so two
+# subtasks flushing edits of the same file cannot both pass the check.
+_disk_lock = threading.Lock()
+
+class FileOverlay:
+    """In-memory buffer of pending file writes for one unit of work, e.g. a worker subtask."""
+
+    def __init__(self):
+        self._pending: Dict[str, str] = {}
+        # Content from before the first flush of each path (None: it did not exist), for rollback.
+        self._originals: Dict[str, Optional[bytes]] = {}
+        # Hash of the content the last flush wrote to each path; rollback only restores a
+        # path that still has it, so it never overwrites another subtask's later write.
+        self._flushed: Dict[str, str] = {}
+        # Paths changed by edits: hash of the disk content they were made against, and the
+        # functions re-applying them if that content has changed by flush time.
+        self._bases: Dict[str, Tuple[str, List[Callable[[str], str]]]] = {}
+        self._lock = threading.Lock()
+        self.buffered_writes = 0
+        self.flushed_paths = 0
+
+    def write(self, path: str, content: str, base_hash: Optional[str] = None,
+              rebase: Optional[Callable[[str], str]] = None) -> None:
+        """
+        Buffers `content` for `path`. Edits pass the hash of the disk content they were made
+        against (`base_hash`, None if they were made on top of a pending write) and a `rebase`
+        function re-applying them to other content; see flush. Plain writes replace the file
+        whatever happened to it in between.
+        """
+        key = os.path.abspath(path)
+        # Fail now, like open() would, rather than when the batch is flushed.
+        if os.path.isdir(key):
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+        if not os.path.isdir(os.path.dirname(key)):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        with self._lock:
+            self._pending[key] = content
+            self.buffered_writes += 1
+            if rebase is None:
+                self._bases.pop(key, None)
+            elif key in self._bases:
+                self._bases[key][1].append(rebase)
+            elif base_hash is not None:
+                self._bases[key] = (base_hash, [rebase])
+
+    def read(self, path: str) -> Optional[str]:
+        """Buffered content of `path`, or None if it has no pending write."""
+        with self._lock:
+            return self._pending.get(os.path.abspath(path))
+
+    def pending(self) -> Dict[str, str]:
+        """Absolute path -> buffered content of every pending write."""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self) -> List[str]:
+        """
+        Writes all pending content to disk and returns the written paths. Every file is
+        written to a temporary file first and only then renamed into place, so a failure
+        while writing leaves the disk untouched. Edited files that changed on disk since the
+        edit (e.g. another subtask committed first) get the edit re-applied to the new
+        content; if it no longer applies, WriteConflict is raised and nothing is written.
+        """
+        with self._lock, _disk_lock:
+            pending, self._pending = self._pending, {}
+            staged = []
+            try:
+                for path, content in pending.items():
+                    if path in self._bases:
+                        content = _rebased(path, content, *self._bases[path])
+                    if path not in self._originals:
+                        self._originals[path] = _read_bytes_if_exists(path)
+                    data = content.encode("utf-8")
+                    staged.append((_write_temp(path, data), path, content_hash(data)))
+            except Exception:
+                for tmp_path, _, _ in staged:
+                    os.unlink(tmp_path)
+                self._pending = {**pending, **self._pending}
+                raise
+            for tmp_path, path, written_hash in staged:
+                os.replace(tmp_path, path)
+                self._flushed[path] = written_hash
+                record_change(path)
+            self._bases.clear()
+            self.flushed_paths += len(staged)
+            return [path for _, path, _ in staged]
+
+    def commit(self) -> List[str]:
+        """Flushes the pending writes and ends the transaction."""
+        written = self.flush()
+        with self._lock:
+            self._originals.clear()
+            self._flushed.clear()
+        return written
+
+    def rollback(self) -> None:
+        """
+        Drops pending writes and restores files flushed earlier in the transaction. A file
+        that changed on disk since this transaction flushed it (another subtask wrote it
+        later) is left alone and the conflict is logged.
+        """
+        with self._lock:
+            self._pending.clear()
+            self._bases.clear()
+            originals, self._originals = self._originals, {}
+            flushed, self._flushed = self._flushed, {}
+        with _disk_lock:
+            for path, original in originals.items():
+                if path not in flushed:
+                    continue  # its flush failed before the file was replaced
+                current = _read_bytes_if_exists(path)
+                if current is None or content_hash(current) != flushed[path]:
+                    logger.warning(f"Rollback conflict: {path} was changed by someone else after this "
+                                   f"subtask wrote it; keeping the newer content.")
+                    continue
+                try:
+                    if original is None:
+                        os.unlink(path)
+                    else:
+                        os.replace(_write_temp(path, original), path)
+                except FileNotFoundError:
+                    pass
+
+
+def _read_bytes_if_exists(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _rebased(path: str, content: str, base_hash: str, rebases: List[Callable[[str], str]]) -> str:
+    """`content` if `path` still has the content it was edited from, else the edits re-applied to the new content."""
+    current = _read_bytes_if_exists(path)
+    if current is not None and content_hash(current) == base_hash:
+        return content
+    if current is None or not rebases:
+        raise WriteConflict(f"{path} was changed or deleted on disk after it was edited; re-read it and edit it again")
+    try:
+        text = current.decode("utf-8")
+        for rebase in rebases:
+            text = rebase(text)
+    except Exception as e:
+        raise WriteConflict(f"{path} changed on disk after it was edited and the edit no longer applies ({e}); "
+                            f"re-read it and edit it again") from None
+    return text
+
+def replace_file(path: str, content: str, base_hash: Optional[str] = None,
+                 rebase: Optional[Callable[[str], str]] = None) -> None:
+    """
+    Writes `content` to `path` atomically (temporary file + rename). With `base_hash`, the
+    file must still have that content or `rebase` must re-apply the edit to its new content,
+    otherwise WriteConflict is raised.
+    """
+    with _disk_lock:
+        if base_hash is not None:
+            content = _rebased(path, content, base_hash, [rebase] if rebase else [])
+        tmp_path = _write_temp(path, content.encode("utf-8"))
+        try:
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    record_change(path)
+
+def _write_temp(path: str, data: bytes) -> str:
+    """Writes `data` to a temporary file next to `path` (keeping its permissions) and returns its name."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".overlay-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~_umask())
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+current_overlay: contextvars.ContextVar[Optional[FileOverlay]] = contextvars.ContextVar(
+    "current_overlay", default=None)
+
+@contextmanager
+def overlay_transaction() -> Iterator[FileOverlay]:
+    """
+    Buffers the file tools' writes made inside the block; they are committed to disk when
+    the block exits normally and rolled back if it (or the commit, e.g. on a WriteConflict) raises.
+    """
+    overlay = FileOverlay()
+    token = current_overlay.set(overlay)
+    try:
+        yield overlay
+    except BaseException:
+        overlay.rollback()
+        raise
+    else:
+        try:
+            overlay.commit()
+        except BaseException:
+            overlay.rollback()
+            raise
+    finally:
+        current_overlay.reset(token)
+
+@asynccontextmanager
+async def aoverlay_transaction():
+    """Async variant of overlay_transaction; the commit/rollback I/O runs in a worker thread."""
+    overlay = FileOverlay()
+    token = current_overlay.set(overlay)
+    try:
+        yield overlay
+    except BaseException:
+        await asyncio.to_thread(overlay.rollback)
+        raise
+    else:
+        try:
+            await asyncio.to_thread(overlay.commit)
+        except BaseException:
+            await asyncio.to_thread(overlay.rollback)
+            raise
+    finally:
+        current_overlay.reset(token)
+
+def flush_overlay() -> List[str]:
+    """Writes the active overlay's pending content to disk (no-op without an overlay).
+    Needed before anything that reads files outside these tools, e.g. shell commands."""
+    overlay = current_overlay.get()
+    return overlay.flush() if overlay else []
+
+def _pending_content(path: str) -> Optional[str]:
+    overlay = current_overlay.get()
+    return overlay.read(path) if overlay else None
+
+def pending_writes() -> Dict[str, str]:
+    """Pending content of the active overlay by absolute path (empty without an overlay)."""
+    overlay = current_overlay.get()
+    return overlay.pending() if overlay else {}
+
 def read_file(path: str) -> str:
     """Reads the content of a file at the given path."""
+    pending = _pending_content(path)
+    if pending is not None:
+        return pending
     try:
         with open(path, 'r') as f:
             content = f.read()
@@ -13,8 +295,164 @@ def read_file(path: str) -> str:
 def write_file(path: str, content: str) -> str:
     """Writes content to a file at the given path. Creates the file if it doesn't exist."""
     try:
-        with open(path, 'w') as f:
-            f.write(content)
+        overlay = current_overlay.get()
+        if overlay:
+            overlay.write(path, content)
+            return f"File written successfully to {path}"
+        replace_file(path, content)
         return f"File written successfully to {path}"
     except Exception as e:
         return f"Error writing file: {str(e)}"
+
+async def aread_file(path: str) -> str:
+    """Async variant of read_file; the file I/O runs in a worker thread, off the event loop."""
+    return await asyncio.to_thread(read_file, path)
+
+async def awrite_file(path: str, content: str) -> str:
+    """Async variant of write_file; the file I/O runs in a worker thread, off the event loop."""
+    return await asyncio.to_thread(write_file, path, content)
+
+# --- Ranged reads ---
+# These never load the whole file: line reads stream through it, byte reads seek, and
+# tail/regex reads scan a memory map, so multi-hundred-MB files stay cheap to inspect.
+# Files with a pending overlay write are served from the buffered content instead.
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace")
+
+@contextmanager
+def _file_buffer(path: str):
+    """The file's bytes as a buffer: the overlay's pending content, or a read-only memory map."""
+    pending = _pending_content(path)
+    if pending is not None:
+        yield pending.encode("utf-8")
+        return
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def read_file_lines(path: str, start: int = 1, end: int = None) -> str:
+    """Reads lines `start`..`end` (1-based, inclusive) of a file. `end=None` reads to the end."""
+    try:
+        if start < 1 or (end is not None and end < start):
+            return f"Error: Invalid line range {start}-{end}."
+        pending = _pending_content(path)
+        if pending is not None:
+            return "".join(itertools.islice(io.StringIO(pending), start - 1, end))
+        with open(path, 'r', errors="replace") as f:
+            return "".join(itertools.islice(f, start - 1, end))
+    except FileNotFoundError:
+        return f"Error: File not found at {path}"
+    except Exception as e:
+        return f"Error reading file: {str(e)}"
+
+def read_file_bytes(path: str, offset: int = 0, length: int = 4096) -> str:
+    """Reads `length` bytes starting at byte `offset` (negative offsets count from the end)."""
+    try:
+        pending = _pending_content(path)
+        if pending is not None:
+            data = pending.encode("utf-8")
+            if offset < 0:
+                offset = max(0, len(data) + offset)
+            return _decode(data[offset:offset + length])
+        with open(path, 'rb') as f:
+            if offset < 0:
+                offset = max(0, f.seek(0, 2) + offset)
+            f.seek(offset)
+            return _decode(f.read(length))
+    except FileNotFoundError:
+        return f"Error: File not found at {path}"
+    except OSError as e:
+        return f"Error reading file: {str(e)}"
+
+def read_file_head(path: str, lines: int = 20) -> str:
+    """Reads the first `lines` lines of a file."""
+    return read_file_lines(path, 1, lines)
+
+def read_file_tail(path: str, lines: int = 20) -> str:
+    """Reads the last `lines` lines of a file by scanning backwards through a memory map."""
+    try:
+        with _file_buffer(path) as mm:
+            if len(mm) == 0 or lines <= 0:
+                return ""
+            end = len(mm)
+            # A trailing newline terminates the last line rather than starting a new one.
+            position = end - 1 if mm[end - 1:end] == b"\n" else end
+            for _ in range(lines):
+                position = mm.rfind(b"\n", 0, position)
+                if position < 0:
+                    break
+            return _decode(mm[position + 1:end])
+    except FileNotFoundError:
+        return f"Error: File not found at {path}"
+    except Exception as e:
+        return f"Error reading file: {str(e)}"
+
+def _count_newlines(mm: mmap.mmap, start: int, end: int, chunk_size: int = 1 << 20) -> int:
+    count = 0
+    for chunk_start in range(start, end, chunk_size):
+        count += mm[chunk_start:min(end, chunk_start + chunk_size)].count(b"\n")
+    return count
+
+def search_file(path: str, pattern: str, context: int = 2, max_matches: int = 50) -> str:
+    """
+    Returns the lines matching the regex `pattern`, with `context` lines around each match.
+    Output lines are prefixed with their line number; matching lines are marked with '>'.
+    """
+    try:
+        regex = re.compile(pattern.encode("utf-8"), re.MULTILINE)
+    except re.error as e:
+        return f"Error: Invalid regex '{pattern}': {e}"
+    try:
+        with _file_buffer(path) as mm:
+            if len(mm) == 0:
+                return f"No matches for '{pattern}' in {path}."
+            shown = {}  # line number -> text, for matches and their context
+            match_lines = set()
+            line_number, counted_to = 1, 0
+            for match in regex.finditer(mm):
+                line_start = mm.rfind(b"\n", 0, match.start()) + 1
+                if line_start < counted_to:
+                    continue  # another match on a line we already reported
+                line_number += _count_newlines(mm, counted_to, line_start)
+                counted_to = line_start
+
+                # Walk back `context` lines, then forward over the match plus `context` lines.
+                block_start, first_line = line_start, line_number
+                while first_line > 1 and first_line > line_number - context:
+                    block_start = mm.rfind(b"\n", 0, block_start - 1) + 1
+                    first_line -= 1
+                block_end = line_start
+                for _ in range(context + 1):
+                    newline = mm.find(b"\n", block_end)
+                    if newline < 0:
+                        block_end = len(mm)
+                        break
+                    block_end = newline + 1
+                for offset, text in enumerate(_decode(mm[block_start:block_end]).splitlines()):
+                    shown.setdefault(first_line + offset, text)
+                match_lines.add(line_number)
+
+                line_number += 1
+                counted_to = mm.find(b"\n", line_start) + 1 or len(mm)
+                if len(match_lines) >= max_matches:
+                    break
+            if not match_lines:
+                return f"No matches for '{pattern}' in {path}."
+
+            output, previous = [], None
+            for number in sorted(shown):
+                if previous is not None and number > previous + 1:
+                    output.append("--")
+                output.append(f"{number}{'>' if number in match_lines else ':'} {shown[number]}")
+                previous = number
+            if len(match_lines) >= max_matches:
+                output.append(f"[stopped after {max_matches} matches]")
+            return "\n".join(output)
+    except FileNotFoundError:
+        return f"Error: File not found at {path}"
+    except Exception as e:
+        return f"Error reading file: {str(e)}"
@@ -1,60 +1,175 @@
 # tools/git.py
+"""
+Git commits for the agent.
+
+By default only the paths recorded by the file tools (tools/changes.py) are committed, using
+plumbing: a temporary index is seeded from HEAD, updated for just those paths and turned
+into a tree and commit object, so the cost does not grow with the size of the working tree
+and untracked build outputs are never staged. Recorded paths matched by .gitignore (logs,
+caches, build artifacts) are skipped unless they are already tracked. `all_changes=True` keeps the old behaviour of
+staging the whole working tree, e.g. for files created through shell commands, which are
+not recorded.
+"""
+import asyncio
+import os
 import subprocess
-import shlex
+import tempfile
+from typing import Dict, List, Optional, Sequence
+
+from tools.changes import changed_paths, forget_changes
+
+GIT_TIMEOUT = 30
+
+
+class GitError(Exception):
+    pass
+
+
+def _git(args: Sequence[str], cwd: str = None, env: Dict[str, str] = None, check: bool = True) -> subprocess.CompletedProcess:
+    result = subprocess.run(["git", *args], cwd=cwd, env=env, capture_output=True, text=True, timeout=GIT_TIMEOUT)
+    if check and result.returncode != 0:
+        raise GitError(result.stderr.strip() or result.stdout.strip())
+    return result
+
+
+def _head_commit(root: str) -> Optional[str]:
+    """Commit id of HEAD, or None on a branch with no commits yet."""
+    result = _git(["rev-parse", "--verify", "--quiet", "HEAD"], cwd=root, check=False)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def switch_branch(branch_name: str, root: str = None) -> str:
+    """Switches to `branch_name`, creating it from HEAD if it does not exist. Uncommitted changes are kept."""
+    _git(["check-ref-format", "--branch", branch_name], cwd=root)
+    current = _git(["symbolic-ref", "--quiet", "--short", "HEAD"], cwd=root, check=False).stdout.strip()
+    if current == branch_name:
+        return f"Already on branch '{branch_name}'."
+    if _head_commit(root) is None:
+        # Unborn branch: there is nothing to check out, just point HEAD at the new name.
+        _git(["symbolic-ref", "HEAD", f"refs/heads/{branch_name}"], cwd=root)
+        return f"Switched to new branch '{branch_name}'."
+    exists = _git(["rev-parse", "--verify", "--quiet", f"refs/heads/{branch_name}"], cwd=root, check=False).returncode == 0
+    if exists:
+        _git(["checkout", branch_name], cwd=root)
+        return f"Switched to branch '{branch_name}'."
+    _git(["checkout", "-b", branch_name], cwd=root)
+    return f"Switched to new branch '{branch_name}'."
+
+
+def _relative_paths(root: str, paths: Sequence[str]) -> List[str]:
+    """Paths relative to the repository root; paths outside the repository are dropped."""
+    relative = []
+    for path in paths:
+        rel = os.path.relpath(os.path.realpath(path), root)
+        if rel != os.curdir and rel.split(os.sep)[0] != os.pardir:
+            relative.append(rel)
+    return relative
+
 
-def git_commit(message: str, branch_name: str = "main") -> str:
+def _without_ignored(root: str, paths: Sequence[str]) -> List[str]:
+    """`paths` minus those matched by .gitignore; tracked files are kept even if a pattern matches them."""
+    if not paths:
+        return []
+    result = subprocess.run(["git", "check-ignore", "-z", "--stdin"], cwd=root, input="\0".join(paths) + "\0",
+                            capture_output=True, text=True, timeout=GIT_TIMEOUT)
+    if result.returncode not in (0, 1):  # 1: none of the paths is ignored
+        raise GitError(result.stderr.strip())
+    ignored = set(result.stdout.split("\0"))
+    return [path for path in paths if path not in ignored]
+
+
+def commit_paths(message: str, paths: Sequence[str], root: str) -> Optional[str]:
+    """
+    Commits the current contents of `paths` (relative to `root`) on top of HEAD without
+    touching other staged or unstaged changes. Deleted paths are removed from the commit.
+    `update-index --add` does not apply .gitignore, so pass paths through _without_ignored first.
+    Returns the new commit id, or None if the paths do not differ from HEAD.
+    """
+    head = _head_commit(root)
+    fd, index_path = tempfile.mkstemp(prefix="agent-index-")
+    os.close(fd)
+    os.unlink(index_path)  # git creates the index file itself
+    env = {**os.environ, "GIT_INDEX_FILE": index_path}
+    try:
+        if head:
+            _git(["read-tree", head], cwd=root, env=env)
+        # Only the dirty paths are hashed and updated; the rest of the index comes from HEAD as is.
+        subprocess.run(["git", "update-index", "--add", "--remove", "-z", "--stdin"], cwd=root, env=env,
+                       input="\0".join(paths) + "\0", capture_output=True, text=True,
+                       timeout=GIT_TIMEOUT, check=True)
+        tree = _git(["write-tree"], cwd=root, env=env).stdout.strip()
+    except subprocess.CalledProcessError as e:
+        raise GitError(e.stderr.strip())
+    finally:
+        if os.path.exists(index_path):
+            os.unlink(index_path)
+
+    if head and tree == _git(["rev-parse", f"{head}^{{tree}}"], cwd=root).stdout.strip():
+        return None
+    commit = _git(["commit-tree", tree, *(["-p", head] if head else []), "-m", message], cwd=root).stdout.strip()
+    # Compare-and-swap on HEAD so a concurrent commit is never overwritten.
+    _git(["update-ref", "-m", f"commit: {message.splitlines()[0] if message else ''}",
+          "HEAD", commit, head or ""], cwd=root)
+    # Bring the real index in line for the committed paths only, so `git status` stays clean for them.
+    subprocess.run(["git", "update-index", "--add", "--remove", "-z", "--stdin"], cwd=root,
+                   input="\0".join(paths) + "\0", capture_output=True, text=True, timeout=GIT_TIMEOUT)
+    return commit
+
+
+def _commit_all(message: str, root: str) -> Optional[str]:
+    _git(["add", "-A"], cwd=root)
+    result = _git(["commit", "-m", message], cwd=root, check=False)
+    if result.returncode != 0:
+        output = (result.stdout + result.stderr).lower()
+        if "nothing to commit" in output or "no changes added to commit" in output:
+            return None
+        raise GitError(result.stderr.strip() or result.stdout.strip())
+    return _head_commit(root)
+
+
+def git_commit(message: str, branch_name: str = None, paths: Sequence[str] = None, all_changes: bool = False) -> str:
     """
     Commits changes to the local git repository with the given message.
-    Optionally, specify a branch. (Note: actual branching might need separate commands)
+    If `branch_name` is given, switches to it first (creating it if needed).
+    Commits `paths` if given, otherwise the paths changed through the file tools; with
+    `all_changes=True` the whole working tree is staged instead.
     This assumes git is initialized in the project and configured.
     """
     try:
-        # Stage all changes
-        stage_command = "git add ."
-        process_stage = subprocess.Popen(shlex.split(stage_command), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout_stage, stderr_stage = process_stage.communicate(timeout=30)
-        if process_stage.returncode != 0:
-            return f"Error staging files: {stderr_stage}"
-
-        # Commit changes
-        commit_command = f"git commit -m \"{message}\"" # Ensure message is quoted
-        process_commit = subprocess.Popen(shlex.split(commit_command), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout_commit, stderr_commit = process_commit.communicate(timeout=30)
-
-        if process_commit.returncode == 0:
-            return f"Successfully committed changes with message: '{message}' to branch '{branch_name}'.\nOutput:\n{stdout_commit}"
+        root = _git(["rev-parse", "--show-toplevel"]).stdout.strip()
+        branch_note = ""
+        if branch_name:
+            branch_note = switch_branch(branch_name, root) + "\n"
+        branch = _git(["symbolic-ref", "--quiet", "--short", "HEAD"], cwd=root, check=False).stdout.strip() or "HEAD"
+
+        if all_changes:
+            commit = _commit_all(message, root)
+            scope = "all changes in the working tree"
         else:
-            # Check for "nothing to commit" scenario
-            if "nothing to commit" in stderr_commit.lower() or "no changes added to commit" in stderr_commit.lower():
-                return "No changes to commit."
-            return f"Error committing changes: {stderr_commit}"
+            targets = list(paths) if paths is not None else changed_paths()
+            if not targets:
+                return (f"{branch_note}No changes recorded by the file tools to commit. "
+                        "Commit with 'all' to stage every change in the working tree.")
+            relative = _without_ignored(root, _relative_paths(root, targets))
+            commit = commit_paths(message, relative, root) if relative else None
+            forget_changes(targets)
+            scope = f"{len(relative)} changed path(s): {', '.join(relative[:10])}{' ...' if len(relative) > 10 else ''}"
+
+        if commit is None:
+            return f"{branch_note}No changes to commit."
+        return (f"{branch_note}Successfully committed changes with message: '{message}' to branch '{branch}'.\n"
+                f"Output:\nCommit {commit[:12]} with {scope}")
     except subprocess.TimeoutExpired:
         return "Error: Git command timed out."
     except FileNotFoundError:
         return "Error: Git command not found. Is Git installed and in PATH?"
+    except GitError as e:
+        return f"Error committing changes: {e}"
     except Exception as e:
         return f"Error performing git commit: {str(e)}"
 
-# Example of how one might add a git_branch function if needed later
-# def git_branch(branch_name: str) -> str:
-#     try:
-#         command = f"git checkout -b {branch_name}"
-#         process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-#         stdout, stderr = process.communicate(timeout=30)
-#         if process.returncode == 0:
-#             return f"Successfully created and switched to new branch: {branch_name}.\nOutput:\n{stdout}"
-#         else:
-#             if "already exists" in stderr:
-#                 # If branch exists, just check it out
-#                 command_checkout = f"git checkout {branch_name}"
-#                 process_checkout = subprocess.Popen(shlex.split(command_checkout), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-#                 stdout_co, stderr_co = process_checkout.communicate(timeout=30)
-#                 if process_checkout.returncode == 0:
-#                     return f"Successfully switched to existing branch: {branch_name}.\nOutput:\n{stdout_co}"
-#                 else:
-#                     return f"Error switching to existing branch {branch_name}: {stderr_co}"
-#             return f"Error creating branch {branch_name}: {stderr}"
-#     except subprocess.TimeoutExpired:
-#         return "Error: Git branch command timed out."
-#     except Exception as e:
-#         return f"Error creating git branch: {str(e)}"
+
+async def agit_commit(message: str, branch_name: str = None, paths: Sequence[str] = None,
+                      all_changes: bool = False) -> str:
+    """Async variant of git_commit; the blocking git calls run in a worker thread."""
+    return await asyncio.to_thread(git_commit, message, branch_name, paths, all_changes)
@@ -0,0 +1,175 @@
+# tools/output.py
+"""
+Output shaping shared by all tools.
+
+Everything a tool returns ends up in the worker's prompt for the rest of the subtask, so a
+long build log or test run makes every later LLM call slower and more expensive. Outputs
+over the budget are compacted to their first lines, the error-looking lines from the
+middle (tracebacks, failures) and their last lines. The full output is spilled to a file
+under .agent_cache/tool_outputs that the worker can page through with ReadFileLines or
+SearchFile; outputs of file-reading tools are not spilled, since the file they read can be
+paged through directly.
+
+Configuration (environment variables):
+    AGENT_TOOL_OUTPUT_MAX_TOKENS   token budget per tool output (default: 1500, ~4 chars per token)
+    AGENT_TOOL_OUTPUT_MAX_BYTES    byte budget per tool output (default: 16384)
+    AGENT_TOOL_OUTPUT_DIR          spill directory (default: .agent_cache/tool_outputs)
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+MAX_TOKENS = int(os.getenv("AGENT_TOOL_OUTPUT_MAX_TOKENS", "1500"))
+MAX_BYTES = int(os.getenv("AGENT_TOOL_OUTPUT_MAX_BYTES", str(16 * 1024)))
+SPILL_DIR = os.getenv("AGENT_TOOL_OUTPUT_DIR", os.path.join(".agent_cache", "tool_outputs"))
+CHARS_PER_TOKEN = 4
+MAX_LINE_CHARS = 400
+MAX_ERROR_LINES = 30
+# Share of the budget for the first lines, the error lines from the middle and the last lines;
+# the end of a log usually holds the summary and the final error.
+HEAD_SHARE, ERROR_SHARE = 0.25, 0.25
+
+_ERROR_LINE = re.compile(
+    r"error|exception|traceback|fail|fatal|panic|assert|denied|not found|undefined|warning", re.IGNORECASE)
+
+
+class CompactedOutput(NamedTuple):
+    text: str
+    original_tokens: int
+    tokens_saved: int
+    spill_path: Optional[str]
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class OutputStats:
+    """Process-wide counters of compacted tool outputs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"outputs": 0, "compacted": 0, "spilled": 0, "tokens_in": 0, "tokens_saved": 0}
+
+    def record(self, result: CompactedOutput) -> None:
+        with self._lock:
+            self._counts["outputs"] += 1
+            self._counts["tokens_in"] += result.original_tokens
+            if result.tokens_saved:
+                self._counts["compacted"] += 1
+                self._counts["tokens_saved"] += result.tokens_saved
+            if result.spill_path:
+                self._counts["spilled"] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+output_stats = OutputStats()
+
+
+def spill(text: str, source: str, directory: Optional[str] = None) -> str:
+    """Writes `text` to the spill directory (once per distinct content) and returns the file path."""
+    directory = directory or SPILL_DIR
+    data = text.encode("utf-8")
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", source)
+    path = os.path.join(directory, f"{name}-{hashlib.sha256(data).hexdigest()[:16]}.log")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return path
+
+
+def _clip(line: str) -> str:
+    return line if len(line) <= MAX_LINE_CHARS else f"{line[:MAX_LINE_CHARS]} ... [{len(line) - MAX_LINE_CHARS} chars]"
+
+
+def _take(lines: Iterable[str], budget: int) -> List[str]:
+    taken, used = [], 0
+    for line in lines:
+        used += len(line) + 1
+        if used > budget and taken:
+            break
+        taken.append(line)
+    return taken
+
+
+def compact_output(text: Any, source: str = "tool", max_tokens: Optional[int] = None,
+                   max_bytes: Optional[int] = None, spill_full: bool = True) -> CompactedOutput:
+    """
+    Returns `text` unchanged if it fits the budget, otherwise its head, the error lines of
+    the omitted middle (with line numbers) and its tail, with a note on where the full
+    output was saved. Never raises: if the spill file cannot be written, the note says so.
+    """
+    text = str(text)
+    original_tokens = estimate_tokens(text)
+    budget = min((max_tokens or MAX_TOKENS) * CHARS_PER_TOKEN, max_bytes or MAX_BYTES)
+    if len(text) <= budget and len(text.encode("utf-8")) <= (max_bytes or MAX_BYTES):
+        return CompactedOutput(text, original_tokens, 0, None)
+
+    lines = text.splitlines()
+    head = _take((_clip(line) for line in lines), int(budget * HEAD_SHARE))
+    tail = _take((_clip(line) for line in reversed(lines[len(head):])), int(budget * (1 - HEAD_SHARE - ERROR_SHARE)))
+    tail.reverse()
+    middle_end = len(lines) - len(tail)
+    errors = _take((f"{number}: {_clip(lines[number - 1])}" for number in range(len(head) + 1, middle_end + 1)
+                    if _ERROR_LINE.search(lines[number - 1])), int(budget * ERROR_SHARE))[:MAX_ERROR_LINES]
+
+    spill_path, note = None, "Read other parts of the file with ReadFileLines or SearchFile."
+    if spill_full:
+        try:
+            spill_path = spill(text, source)
+            note = (f"Full output ({len(lines)} lines) saved to {spill_path}; "
+                    "page through it with ReadFileLines or SearchFile.")
+        except OSError as e:
+            note = f"The full output could not be saved: {e}."
+    parts = list(head)
+    if middle_end > len(head):
+        parts.append(f"... [{middle_end - len(head)} lines omitted" + ("; error lines among them:]" if errors else "]"))
+        parts += [f"  {line}" for line in errors]
+        if errors:
+            parts.append("...")
+    parts += tail
+    parts.append(f"[Output compacted from ~{original_tokens} tokens. {note}]")
+    compacted = "\n".join(parts)
+    return CompactedOutput(compacted, original_tokens, max(0, original_tokens - estimate_tokens(compacted)), spill_path)
+
+
+def compact_tools(tools: List[Any], spill_exempt: Iterable[str] = (),
+                  on_compacted: Optional[Callable[[CompactedOutput], None]] = None) -> List[Any]:
+    """
+    Wraps the sync and async entry points of LangChain tools, in place, so their outputs
+    are compacted. Tools named in `spill_exempt` (file readers) are compacted without
+    spilling. `on_compacted` is called with every result, e.g. to record it in a trace.
+    """
+    spill_exempt = set(spill_exempt)
+
+    def _shape(tool_name: str, result: Any) -> str:
+        compacted = compact_output(result, tool_name, spill_full=tool_name not in spill_exempt)
+        output_stats.record(compacted)
+        if on_compacted:
+            on_compacted(compacted)
+        return compacted.text
+
+    for tool in tools:
+        if getattr(tool, "func", None):
+            def _sync(*args, _func=tool.func, _name=tool.name, **kwargs):
+                return _shape(_name, _func(*args, **kwargs))
+            tool.func = _sync
+        if getattr(tool, "coroutine", None):
+            async def _async(*args, _func=tool.coroutine, _name=tool.name, **kwargs):
+                result = await _func(*args, **kwargs)
+                if len(str(result)) <= MAX_BYTES:
+                    return _shape(_name, result)
+                # Large outputs are scanned and spilled off the event loop.
+                return await asyncio.to_thread(_shape, _name, result)
+            tool.coroutine = _async
+    return tools
@@ -1,31 +1,268 @@
 # tools/shell.py
-import subprocess
+import asyncio
+import atexit
+import contextvars
+import os
+import select
 import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+DEFAULT_TIMEOUT = float(os.getenv("AGENT_SHELL_TIMEOUT", "60"))
+DEFAULT_MAX_OUTPUT_BYTES = int(os.getenv("AGENT_SHELL_MAX_OUTPUT_BYTES", str(256 * 1024)))
+DEFAULT_POOL_SIZE = int(os.getenv("AGENT_SHELL_POOL_SIZE", "4"))
+
+# Name of the shell session used by run_command when none is passed explicitly.
+# Callers (e.g. a worker running one subtask) can set it to get their own cwd/env.
+current_session: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_shell_session", default="default")
+
+
+class ShellTimeout(Exception):
+    pass
+
+
+class CommandResult:
+    def __init__(self, returncode: int, stdout: str, stderr: str, truncated_bytes: int = 0):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.truncated_bytes = truncated_bytes
+
+
+class _StreamReader:
+    """
+    Accumulates one pipe of a session up to a byte cap and detects the end-of-command marker.
+    Bytes beyond the cap are drained and counted but not kept.
+    """
+
+    def __init__(self, marker: bytes, max_bytes: int, on_output: Optional[Callable[[str], None]]):
+        self.marker = marker
+        self.max_bytes = max_bytes
+        self.on_output = on_output
+        self.kept = bytearray()
+        self.dropped = 0
+        self.pending = bytearray()
+        self.trailer: Optional[bytearray] = None  # bytes after the marker, once seen
+
+    def feed(self, chunk: bytes) -> None:
+        if self.trailer is not None:
+            self.trailer += chunk
+            return
+        self.pending += chunk
+        index = self.pending.find(self.marker)
+        if index >= 0:
+            self._emit(bytes(self.pending[:index]))
+            self.trailer = bytearray(self.pending[index + len(self.marker):])
+            self.pending = bytearray()
+        else:
+            # Hold back only a tail that could be the start of a marker split across reads.
+            hold = 0
+            for size in range(min(len(self.marker) - 1, len(self.pending)), 0, -1):
+                if self.pending.endswith(self.marker[:size]):
+                    hold = size
+                    break
+            cut = len(self.pending) - hold
+            self._emit(bytes(self.pending[:cut]))
+            del self.pending[:cut]
+
+    def _emit(self, data: bytes) -> None:
+        if not data:
+            return
+        room = self.max_bytes - len(self.kept)
+        if room > 0:
+            self.kept += data[:room]
+        self.dropped += max(0, len(data) - max(room, 0))
+        if self.on_output:
+            self.on_output(data.decode("utf-8", errors="replace"))
+
+    def done(self) -> bool:
+        return self.trailer is not None and b"\n" in self.trailer
+
+    def text(self) -> str:
+        return self.kept.decode("utf-8", errors="replace")
+
+
+class ShellSession:
+    """
+    A long-lived bash process. Commands run in the same shell one after another, so the
+    working directory and exported variables persist between calls.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self._marker = f"__AGENT_SHELL_DONE_{uuid.uuid4().hex}__"
+        self.process = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=os.getcwd(), env=os.environ.copy(), start_new_session=True)
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
 
-def run_command(command: str) -> str:
+    def run(self, command: str, timeout: float = DEFAULT_TIMEOUT,
+            max_output_bytes: int = DEFAULT_MAX_OUTPUT_BYTES,
+            on_output: Optional[Callable[[str], None]] = None) -> CommandResult:
+        """
+        Runs `command` in this session. Output is read incrementally as it is produced;
+        `on_output` (if given) receives each stdout chunk. Raises ShellTimeout after
+        `timeout` seconds, in which case the session is killed and must be discarded.
+        """
+        # eval keeps a syntax error in `command` from swallowing the end-of-command markers.
+        script = (
+            f"eval {shlex.quote(command)} < /dev/null\n"
+            f"printf '\\n%s %s\\n' {self._marker} $?\n"
+            f"printf '\\n%s\\n' {self._marker} >&2\n"
+        )
+        marker = f"\n{self._marker}".encode()
+        stdout = _StreamReader(marker, max_output_bytes, on_output)
+        stderr = _StreamReader(marker, max_output_bytes, None)
+        readers = {self.process.stdout.fileno(): stdout, self.process.stderr.fileno(): stderr}
+
+        self.process.stdin.write(script.encode())
+        self.process.stdin.flush()
+
+        deadline = time.monotonic() + timeout
+        while not (stdout.done() and stderr.done()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.close()
+                raise ShellTimeout(f"Command exceeded {timeout}s timeout.")
+            ready, _, _ = select.select(list(readers), [], [], remaining)
+            for fd in ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    # The shell exited (e.g. the command ran `exit`).
+                    self.close()
+                    return CommandResult(self.process.returncode or 0, stdout.text(), stderr.text(),
+                                         stdout.dropped + stderr.dropped)
+                readers[fd].feed(chunk)
+
+        returncode = int(stdout.trailer.split(b"\n", 1)[0].strip() or b"0")
+        return CommandResult(returncode, stdout.text(), stderr.text(), stdout.dropped + stderr.dropped)
+
+    def close(self) -> None:
+        if self.alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            pipe.close()
+
+
+class ShellPool:
+    """
+    Named shell sessions, created on first use. At most `size` sessions are kept; the least
+    recently used idle session is closed to make room for a new one.
+    """
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE):
+        self.size = size
+        self._sessions: "OrderedDict[str, ShellSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, name: str) -> ShellSession:
+        """Returns the session `name` with its lock held; release with `release()`."""
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None or not session.alive():
+                self._make_room()
+                session = ShellSession(name)
+                self._sessions[name] = session
+            self._sessions.move_to_end(name)
+        session.lock.acquire()
+        return session
+
+    def release(self, session: ShellSession) -> None:
+        session.lock.release()
+        if not session.alive():
+            with self._lock:
+                if self._sessions.get(session.name) is session:
+                    del self._sessions[session.name]
+
+    def _make_room(self) -> None:
+        for name, session in list(self._sessions.items()):
+            if len(self._sessions) < self.size:
+                return
+            if session.lock.acquire(blocking=False):
+                del self._sessions[name]
+                session.close()
+                session.lock.release()
+
+    def discard(self, name: str) -> None:
+        """Closes the session `name` (waiting for a running command) if it exists."""
+        with self._lock:
+            session = self._sessions.pop(name, None)
+        if session is None:
+            return
+        with session.lock:
+            session.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_pool = ShellPool()
+atexit.register(_pool.close)
+
+
+def run_command(command: str, timeout: Optional[float] = None, session: Optional[str] = None,
+                max_output_bytes: Optional[int] = None,
+                on_output: Optional[Callable[[str], None]] = None) -> str:
     """
-    Runs a shell command and returns its output.
+    Runs a shell command in a persistent shell session and returns its output.
+    The session keeps its working directory and environment between calls; `session`
+    selects which one (default: the `current_session` context variable).
     For safety, this should ideally run in a sandboxed environment.
     Destructive commands should be handled with extreme care or require user confirmation.
     """
     try:
-        # For now, we'll implement a basic version.
-        # Consider adding safety checks for destructive commands (e.g., rm -rf)
-        # or a mechanism for user confirmation.
         if "rm -rf" in command or "sudo" in command: # Basic safety check
             # In a real agent, this might ask for user confirmation
             # or prevent the command altogether.
             return "Error: Destructive or privileged command detected. Execution aborted for safety."
 
-        process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        stdout, stderr = process.communicate(timeout=60) # Added timeout
-        if process.returncode == 0:
-            return f"Command executed successfully.\nOutput:\n{stdout}"
+        shell = _pool.acquire(session or current_session.get())
+        try:
+            result = shell.run(command, timeout=timeout or DEFAULT_TIMEOUT,
+                               max_output_bytes=max_output_bytes or DEFAULT_MAX_OUTPUT_BYTES,
+                               on_output=on_output)
+        finally:
+            _pool.release(shell)
+
+        note = f"\n[output truncated: {result.truncated_bytes} bytes omitted]" if result.truncated_bytes else ""
+        if result.returncode == 0:
+            return f"Command executed successfully.\nOutput:\n{result.stdout}{note}"
         else:
-            return f"Command failed with error code {process.returncode}.\nError:\n{stderr}"
-    except subprocess.TimeoutExpired:
+            return f"Command failed with error code {result.returncode}.\nError:\n{result.stderr}{note}"
+    except ShellTimeout:
         return "Error: Command timed out."
     except FileNotFoundError:
         return f"Error: Command not found (it may not be installed or not in PATH)."
     except Exception as e:
         return f"Error running command: {str(e)}"
+
+def close_session(name: str) -> None:
+    """Closes the shell session `name`, e.g. when the subtask that used it has finished."""
+    _pool.discard(name)
+
+
+async def aclose_session(name: str) -> None:
+    """Async variant of close_session; waiting for the session runs in a worker thread."""
+    await asyncio.to_thread(close_session, name)
+
+
+async def arun_command(command: str) -> str:
+    """Async variant of run_command; the blocking subprocess call runs in a worker thread."""
+    return await asyncio.to_thread(run_command, command)
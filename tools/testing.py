@@ -1,17 +1,320 @@
 # tools/testing.py
-def run_tests(_=None):
+"""
+Incremental, parallel and cached pytest runs.
+
+Every test file gets a dependency key: the content hashes of the file itself, of the local
+modules it imports (transitively), of the conftest.py files above it, of the pytest config
+files and of the non-Python files (fixtures, data, templates) in its directory and below.
+Files whose key matches the previous run reuse their cached per-test results;
+only the impacted files are run, spread over several pytest processes. The tool returns a
+compact summary (counts plus one line per failure) instead of the raw pytest output.
+
+The granularity is the test file: a changed dependency re-runs every test in the file. Data
+a test reads from outside its directory (other than through imported modules) is not part
+of the key; pass "full" when such a file changed.
+"""
+import ast
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+CACHE_PATH = os.getenv("AGENT_TEST_CACHE_PATH", os.path.join(".agent_cache", "test_results.json"))
+SHARD_TIMEOUT = float(os.getenv("AGENT_TEST_TIMEOUT", "600"))
+MAX_WORKERS = int(os.getenv("AGENT_TEST_WORKERS", str(os.cpu_count() or 1)))
+MAX_REPORTED_FAILURES = 10
+
+EXCLUDED_DIRS = {".git", ".agent_cache", "__pycache__", ".venv", "venv", "env", "node_modules",
+                 ".tox", ".nox", ".pytest_cache", ".mypy_cache", ".ruff_cache", "build", "dist"}
+CONFIG_FILES = ("pytest.ini", "pyproject.toml", "setup.cfg", "tox.ini")
+# Written while tests or the agent run; never test inputs.
+IGNORED_DATA_SUFFIXES = (".pyc", ".pyo", ".log", ".tmp", ".swp")
+
+# path -> (mtime, size, value); avoids re-hashing/re-parsing files that did not change.
+_hash_memo: Dict[str, Tuple[float, int, str]] = {}
+_imports_memo: Dict[str, Tuple[float, int, List[str]]] = {}
+# Serializes cache merges within the process; a file lock covers other processes.
+_cache_lock = threading.Lock()
+
+
+def _workspace_files(root: str) -> Tuple[List[str], List[str]]:
+    """The workspace's Python files and its other (data) files."""
+    python_files, data_files = [], []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in EXCLUDED_DIRS and not d.startswith(".")]
+        for name in filenames:
+            if name.endswith(".py"):
+                python_files.append(os.path.join(dirpath, name))
+            elif not name.startswith(".") and not name.endswith(IGNORED_DATA_SUFFIXES):
+                data_files.append(os.path.join(dirpath, name))
+    return python_files, data_files
+
+
+def _is_test_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py"))
+
+
+def _file_hash(path: str) -> str:
+    stat = os.stat(path)
+    memo = _hash_memo.get(path)
+    if memo and memo[0] == stat.st_mtime and memo[1] == stat.st_size:
+        return memo[2]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _hash_memo[path] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+
+def _module_name(path: str, root: str) -> str:
+    parts = os.path.relpath(path, root)[:-3].split(os.sep)
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def _imported_modules(path: str, root: str) -> List[str]:
+    """Dotted names this file imports (including `pkg.name` candidates for `from pkg import name`)."""
+    stat = os.stat(path)
+    memo = _imports_memo.get(path)
+    if memo and memo[0] == stat.st_mtime and memo[1] == stat.st_size:
+        return memo[2]
+    try:
+        with open(path, "rb") as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (SyntaxError, ValueError):
+        tree = ast.Module(body=[], type_ignores=[])
+
+    package = _module_name(path, root).split(".")
+    if not path.endswith("__init__.py"):
+        package = package[:-1]
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base_parts = package[:len(package) - node.level + 1] if node.level <= len(package) + 1 else []
+                base = ".".join(base_parts + ([node.module] if node.module else []))
+            else:
+                base = node.module or ""
+            if base:
+                modules.append(base)
+            modules.extend(f"{base}.{alias.name}" if base else alias.name for alias in node.names)
+    _imports_memo[path] = (stat.st_mtime, stat.st_size, modules)
+    return modules
+
+
+def _dependencies(test_file: str, module_index: Dict[str, str], root: str) -> Set[str]:
+    """Local files the test file depends on, following imports transitively."""
+    seen = {test_file}
+    stack = [test_file]
+    while stack:
+        current = stack.pop()
+        # pytest puts the test's directory on sys.path, so sibling modules resolve by bare name.
+        local_prefix = _module_name(os.path.join(os.path.dirname(current), "x.py"), root)[:-1]
+        for module in _imported_modules(current, root):
+            for name in (module, local_prefix + module if local_prefix else None):
+                if not name:
+                    continue
+                parts = name.split(".")
+                # Importing a.b.c also executes a/__init__.py and a/b/__init__.py.
+                for i in range(1, len(parts) + 1):
+                    target = module_index.get(".".join(parts[:i]))
+                    if target and target not in seen:
+                        seen.add(target)
+                        stack.append(target)
+    return seen
+
+
+def _dependency_key(test_file: str, deps: Set[str], root: str, data_files: Sequence[str] = ()) -> str:
+    files = set(deps)
+    # Fixtures and data files next to the test (or below its directory) that it may read.
+    prefix = os.path.join(os.path.dirname(test_file), "")
+    files.update(path for path in data_files if path.startswith(prefix))
+    directory = os.path.dirname(test_file)
+    while True:
+        conftest = os.path.join(directory, "conftest.py")
+        if os.path.exists(conftest):
+            files.add(conftest)
+        if os.path.abspath(directory) == os.path.abspath(root) or directory == os.path.dirname(directory):
+            break
+        directory = os.path.dirname(directory)
+    files.update(os.path.join(root, name) for name in CONFIG_FILES if os.path.exists(os.path.join(root, name)))
+
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        digest.update(os.path.relpath(path, root).encode())
+        digest.update(_file_hash(path).encode())
+    return digest.hexdigest()
+
+
+def _load_cache() -> Dict[str, Dict]:
+    try:
+        with open(CACHE_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_cache(updates: Dict[str, Dict], current_files: Set[str]) -> None:
     """
-    Runs project tests. This is a stub function.
-    In a real implementation, this would integrate with a test runner like pytest.
+    Merges this run's `updates` into the cache file. Concurrent runs (parallel subtasks,
+    service jobs) each write their own temporary file and merge under a lock, so no run's
+    results are lost; entries of test files that no longer exist are dropped.
     """
-    # Placeholder implementation
-    # In a real scenario, you might use:
-    # import pytest
-    # result_code = pytest.main()
-    # return f"Pytest run completed with exit code {result_code}."
-    from subprocess import run, PIPE
-    result = run(["pytest"], stdout=PIPE, stderr=PIPE, text=True)
-    if result.returncode == 0:
-        return "Tests passed successfully.\n" + result.stdout
-    else:
-        return f"Tests failed!\nSTDOUT:\n{result.stdout}\nSTDERR:\n{result.stderr}"
+    directory = os.path.dirname(CACHE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=".test_results.", suffix=".tmp")
+    try:
+        with _cache_lock, open(f"{CACHE_PATH}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # other processes sharing the cache
+            cache = _load_cache()
+            cache.update(updates)
+            cache = {path: entry for path, entry in cache.items() if path in current_files}
+            with os.fdopen(fd, "w") as f:
+                fd = None
+                json.dump(cache, f)
+            os.replace(tmp_path, CACHE_PATH)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _shards(files: List[str], durations: Dict[str, float], workers: int) -> List[List[str]]:
+    """Longest-processing-time-first split of test files over `workers` pytest processes."""
+    shards: List[Tuple[float, List[str]]] = [(0.0, []) for _ in range(min(workers, len(files)))]
+    for path in sorted(files, key=lambda p: durations.get(p, 1.0), reverse=True):
+        load, members = min(shards, key=lambda shard: shard[0])
+        shards.remove((load, members))
+        shards.append((load + durations.get(path, 1.0), members + [path]))
+    return [members for _, members in shards if members]
+
+
+def _parse_junit(xml_path: str, shard: List[str]) -> Tuple[Dict[str, Dict[str, Dict]], Dict[str, Dict]]:
+    """Returns per-file test results for the shard, plus results that could not be tied to a file."""
+    by_file: Dict[str, Dict[str, Dict]] = {path: {} for path in shard}
+    unattributed: Dict[str, Dict] = {}
+    for case in ET.parse(xml_path).getroot().iter("testcase"):
+        outcome, message = "passed", ""
+        for tag in ("failure", "error", "skipped"):
+            element = case.find(tag)
+            if element is not None:
+                outcome = {"failure": "failed", "error": "error", "skipped": "skipped"}[tag]
+                message = (element.get("message") or (element.text or "")).strip().splitlines()
+                message = message[0][:300] if message else ""
+                break
+        reported_file = os.path.normpath(case.get("file") or "")
+        test_id = f"{reported_file or case.get('classname', '')}::{case.get('name', '')}"
+        result = {"outcome": outcome, "message": message}
+        owner = next((path for path in shard if reported_file and (
+            path == reported_file or path.endswith(os.sep + reported_file) or reported_file.endswith(path))), None)
+        if owner:
+            by_file[owner][test_id] = result
+        else:
+            unattributed[test_id] = result
+    return by_file, unattributed
+
+
+def _run_shard(shard: List[str], timeout: float) -> Tuple[Dict[str, Dict[str, Dict]], Dict[str, Dict], Optional[str], float]:
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_path = os.path.join(tmp_dir, "junit.xml")
+        command = [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "--continue-on-collection-errors",
+                   "-o", "junit_family=xunit1", f"--junitxml={xml_path}", *shard]
+        try:
+            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {}, {}, f"pytest timed out after {timeout:.0f}s on {shard}", time.monotonic() - started
+        if not os.path.exists(xml_path):
+            tail = (process.stdout + process.stderr).strip().splitlines()[-5:]
+            return {}, {}, f"pytest exited with code {process.returncode}: " + " | ".join(tail), time.monotonic() - started
+        by_file, unattributed = _parse_junit(xml_path, shard)
+        return by_file, unattributed, None, time.monotonic() - started
+
+
+def run_tests(_=None, force: bool = False, workers: Optional[int] = None, timeout: Optional[float] = None):
+    """
+    Runs the project's pytest suite incrementally.
+    Only test files whose dependencies changed since their last run are executed, in
+    parallel pytest processes; the others reuse cached results. Passing "full" as the tool
+    input (or force=True) ignores the cache.
+    """
+    started = time.monotonic()
+    force = force or (isinstance(_, str) and _.strip().lower() in ("full", "all", "force"))
+    try:
+        root = os.getcwd()
+        python_files, data_files = _workspace_files(root)
+        test_files = sorted(os.path.relpath(path, root) for path in python_files if _is_test_file(path))
+        if not test_files:
+            return "No tests found (no test_*.py or *_test.py files in the workspace)."
+
+        module_index = {_module_name(path, root): path for path in python_files}
+        cache = {} if force else _load_cache()
+        keys, to_run, results, updates = {}, [], {}, {}
+        for test_file in test_files:
+            absolute = os.path.join(root, test_file)
+            keys[test_file] = _dependency_key(absolute, _dependencies(absolute, module_index, root), root, data_files)
+            entry = cache.get(test_file)
+            if entry and entry.get("key") == keys[test_file]:
+                results.update(entry["results"])
+            else:
+                to_run.append(test_file)
+        cached_count = len(results)
+
+        problems, durations = [], {path: entry.get("duration", 1.0) for path, entry in cache.items()}
+        shards = _shards(to_run, durations, workers or MAX_WORKERS) if to_run else []
+        with ThreadPoolExecutor(max_workers=max(1, len(shards))) as pool:
+            outcomes = list(pool.map(lambda shard: _run_shard(shard, timeout or SHARD_TIMEOUT), shards))
+        for shard, (by_file, unattributed, problem, elapsed) in zip(shards, outcomes):
+            if problem:
+                problems.append(problem)
+                continue
+            results.update(unattributed)
+            for test_file, file_results in by_file.items():
+                results.update(file_results)
+                # Files without attributable results or with errors (usually environmental,
+                # e.g. a missing package) are rerun next time.
+                if file_results and all(r["outcome"] != "error" for r in file_results.values()):
+                    updates[test_file] = {"key": keys[test_file], "results": file_results,
+                                          "duration": elapsed / len(shard)}
+        # Forget files that no longer exist so the cache does not grow without bound.
+        _save_cache(updates, set(keys))
+    except Exception as e:
+        return f"Error running tests: {str(e)}"
+
+    counts: Dict[str, int] = {}
+    for result in results.values():
+        counts[result["outcome"]] = counts.get(result["outcome"], 0) + 1
+    failures = [(test_id, result) for test_id, result in sorted(results.items())
+                if result["outcome"] in ("failed", "error")]
+    summary = ", ".join(f"{count} {outcome}" for outcome, count in sorted(counts.items())) or "0 tests"
+    details = (f"({cached_count} from cache, {len(to_run)} of {len(test_files)} files run"
+               f" on {len(shards)} worker(s)) in {time.monotonic() - started:.1f}s.")
+
+    if not failures and not problems:
+        return f"Tests passed successfully. {summary} {details}"
+    lines = [f"Tests failed! {summary} {details}"]
+    lines.extend(f"FAILED {test_id} - {result['message']}" for test_id, result in failures[:MAX_REPORTED_FAILURES])
+    if len(failures) > MAX_REPORTED_FAILURES:
+        lines.append(f"... and {len(failures) - MAX_REPORTED_FAILURES} more failures.")
+    lines.extend(f"ERROR {problem}" for problem in problems)
+    return "\n".join(lines)
+
+async def arun_tests(_=None):
+    """Async variant of run_tests; pytest runs in a worker thread, off the event loop."""
+    return await asyncio.to_thread(run_tests, _)
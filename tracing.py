@@ -0,0 +1,335 @@
+# tracing.py
+"""
+Timing and token instrumentation for agent runs.
+
+Spans are recorded around graph nodes, LLM calls (via a LangChain callback handler) and
+tool calls, and appended as JSON lines to one trace file per run
+(`.agent_cache/traces/<run_id>.jsonl`). `summarize()` turns a run's spans into a small
+report: critical path through the plan, slowest subtasks, token totals and tool latency
+percentiles.
+
+Configuration (environment variables):
+    AGENT_TRACING     "0"/"false"/"off" disables tracing (default: on)
+    AGENT_TRACE_DIR   trace directory (default: .agent_cache/traces)
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger(__name__)
+
+TRACE_DIR = os.getenv("AGENT_TRACE_DIR", os.path.join(".agent_cache", "traces"))
+ENABLED = os.getenv("AGENT_TRACING", "on").lower() not in ("0", "false", "off", "no")
+
+# Run id used when a span is recorded outside a LangGraph run (e.g. agent.py).
+current_run_id: contextvars.ContextVar[str] = contextvars.ContextVar("trace_run_id", default="default")
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_span", default=None)
+_current_attrs: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("trace_attrs", default=None)
+_write_lock = threading.Lock()
+
+
+def _run_id() -> str:
+    try:
+        from langgraph.config import get_config
+        thread_id = get_config().get("configurable", {}).get("thread_id")
+        if thread_id:
+            return str(thread_id)
+    except Exception:
+        pass  # not inside a graph run
+    return current_run_id.get()
+
+
+def trace_path(run_id: str) -> str:
+    return os.path.join(TRACE_DIR, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', run_id)}.jsonl")
+
+
+def _write(record: Dict[str, Any]) -> None:
+    if not ENABLED:
+        return
+    try:
+        with _write_lock:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(trace_path(record["run_id"]), "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        logger.warning(f"Tracing: could not write span: {e}")
+
+
+@contextmanager
+def span(kind: str, name: str, run_id: Optional[str] = None, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Records a span around the block. The yielded dict can be filled with extra attributes.
+    Nested spans (e.g. a tool call inside a worker node) are linked through parent_id.
+    """
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    attrs_token = _current_attrs.set(attrs)
+    started_at, started = time.time(), time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_span.reset(token)
+        _current_attrs.reset(attrs_token)
+        _write({"run_id": run_id or _run_id(), "span_id": span_id, "parent_id": parent_id, "kind": kind,
+                "name": name, "start": started_at, "duration_ms": (time.perf_counter() - started) * 1000,
+                "status": status, **attrs})
+
+
+def annotate_span(**attrs: Any) -> None:
+    """Adds attributes to the innermost open span (no-op outside a span)."""
+    current = _current_attrs.get()
+    if current is not None:
+        current.update(attrs)
+
+
+def trace_compaction(result: Any) -> None:
+    """`on_compacted` hook for tools.output.compact_tools: records the tokens saved on the tool span."""
+    if result.tokens_saved:
+        annotate_span(tokens_saved=result.tokens_saved, spill_path=result.spill_path)
+
+
+def tool_exit_code(output: Any) -> int:
+    """Exit status implied by a tool's string result (tools report failures as text)."""
+    text = str(output)
+    match = re.match(r"Command failed with error code (-?\d+)", text)
+    if match:
+        return int(match.group(1))
+    if text.startswith("Error") or text.startswith("Tests failed!"):
+        return 1
+    return 0
+
+
+def traced(kind: str, name: str, attrs: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    Decorator recording a span per call of a sync or async function. `attrs(*args, **kwargs)`
+    may add call-specific attributes. Tool spans also record exit code and output bytes.
+    """
+    def decorate(func):
+        def _finish(record: Dict[str, Any], result: Any) -> None:
+            if kind == "tool":
+                record["exit_code"] = tool_exit_code(result)
+                record["output_bytes"] = len(str(result).encode("utf-8"))
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(kind, name, **(attrs(*args, **kwargs) if attrs else {})) as record:
+                    result = await func(*args, **kwargs)
+                    _finish(record, result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(kind, name, **(attrs(*args, **kwargs) if attrs else {})) as record:
+                result = func(*args, **kwargs)
+                _finish(record, result)
+                return result
+        return wrapper
+    return decorate
+
+
+def instrument_tools(tools: List[Any]) -> List[Any]:
+    """Wraps the sync and async entry points of LangChain tools with tool spans, in place."""
+    for tool in tools:
+        if getattr(tool, "func", None):
+            tool.func = traced("tool", tool.name)(tool.func)
+        if getattr(tool, "coroutine", None):
+            tool.coroutine = traced("tool", tool.name)(tool.coroutine)
+    return tools
+
+
+class LLMTraceHandler(BaseCallbackHandler):
+    """LangChain callback handler recording one span per LLM call with latency and token usage."""
+
+    def __init__(self):
+        self._pending: Dict[UUID, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, serialized: Optional[Dict[str, Any]], run_id: UUID, metadata: Optional[Dict[str, Any]]) -> None:
+        metadata = metadata or {}
+        name = (metadata.get("ls_model_name") or (serialized or {}).get("name")
+                or metadata.get("ls_provider") or "llm")
+        with self._lock:
+            self._pending[run_id] = {
+                "run_id": str(metadata.get("thread_id") or _run_id()), "name": name,
+                "parent_id": _current_span.get(), "node": metadata.get("langgraph_node"),
+                "start": time.time(), "perf": time.perf_counter()}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        self._start(serialized, run_id, metadata)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        self._start(serialized, run_id, metadata)
+
+    def _finish(self, run_id: UUID, status: str, tokens: Dict[str, int]) -> None:
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        _write({"run_id": pending["run_id"], "span_id": uuid.uuid4().hex[:16], "parent_id": pending["parent_id"],
+                "kind": "llm", "name": pending["name"], "node": pending["node"], "start": pending["start"],
+                "duration_ms": (time.perf_counter() - pending["perf"]) * 1000, "status": status, **tokens})
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        self._finish(run_id, "ok", {**_token_usage(response), **_rate_limit_info(response)})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, "error", {})
+
+
+def _token_usage(response: LLMResult) -> Dict[str, int]:
+    """Best-effort prompt/completion token counts across providers (Gemini, Ollama, OpenAI-style)."""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            info = generation.generation_info or {}
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+            elif "prompt_eval_count" in info or "eval_count" in info:
+                prompt_tokens += info.get("prompt_eval_count") or 0
+                completion_tokens += info.get("eval_count") or 0
+    if not (prompt_tokens or completion_tokens):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+def _rate_limit_info(response: LLMResult) -> Dict[str, Any]:
+    """Time the call waited for the rate limiter and its retries (see rate_limit.py), if limited."""
+    info = (response.llm_output or {}).get("rate_limit")
+    for generations in response.generations:
+        for generation in generations:
+            info = info or (generation.generation_info or {}).get("rate_limit")
+    return {"queued_ms": info["queued_ms"], "retries": info["retries"]} if info else {}
+
+
+llm_trace_handler = LLMTraceHandler()
+
+
+def load_spans(run_id: str) -> List[Dict[str, Any]]:
+    try:
+        with open(trace_path(run_id), "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    # Nearest-rank percentile.
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(spans: List[Dict[str, Any]], plan: Optional[List[Dict[str, Any]]] = None, top: int = 5) -> Dict[str, Any]:
+    """
+    Per-run report: time per node kind, slowest subtasks, token totals, tool latency
+    percentiles and, if the plan is given, the critical path through its dependencies.
+    """
+    nodes: Dict[str, Dict[str, float]] = {}
+    subtask_ms: Dict[int, float] = {}
+    tools: Dict[str, List[float]] = {}
+    tool_failures: Dict[str, int] = {}
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "llm_calls": 0, "llm_ms": 0.0,
+              "llm_queued_ms": 0.0, "llm_retries": 0, "tool_tokens_saved": 0, "tool_outputs_compacted": 0}
+    for record in spans:
+        if record["kind"] == "node":
+            stats = nodes.setdefault(record["name"], {"calls": 0, "total_ms": 0.0})
+            stats["calls"] += 1
+            stats["total_ms"] += record["duration_ms"]
+            if record.get("subtask_index") is not None and not record.get("started_early"):
+                # A resumed subtask keeps its latest timing; a subtask started while the plan was
+                # streaming is timed by its early_worker span, not by the step awaiting it.
+                subtask_ms[record["subtask_index"]] = record["duration_ms"]
+        elif record["kind"] == "llm":
+            tokens["llm_calls"] += 1
+            tokens["llm_ms"] += record["duration_ms"]
+            tokens["prompt_tokens"] += record.get("prompt_tokens", 0)
+            tokens["completion_tokens"] += record.get("completion_tokens", 0)
+            tokens["llm_queued_ms"] += record.get("queued_ms", 0.0)
+            tokens["llm_retries"] += record.get("retries", 0)
+        elif record["kind"] == "tool":
+            tools.setdefault(record["name"], []).append(record["duration_ms"])
+            if record.get("tokens_saved"):
+                tokens["tool_tokens_saved"] += record["tokens_saved"]
+                tokens["tool_outputs_compacted"] += 1
+            if record.get("exit_code"):
+                tool_failures[record["name"]] = tool_failures.get(record["name"], 0) + 1
+
+    def _label(index: int) -> str:
+        if plan and 0 <= index < len(plan):
+            return f"{plan[index]['id']}: {plan[index]['subtask'][:60]}"
+        return str(index)
+
+    slowest = sorted(subtask_ms.items(), key=lambda item: item[1], reverse=True)[:top]
+    report: Dict[str, Any] = {
+        "nodes": nodes,
+        "slowest_subtasks": [{"subtask": _label(index), "ms": ms} for index, ms in slowest],
+        "tokens": tokens,
+        "tools": {name: {"calls": len(durations), "failures": tool_failures.get(name, 0),
+                         "p50_ms": _percentile(durations, 50), "p90_ms": _percentile(durations, 90),
+                         "p99_ms": _percentile(durations, 99), "max_ms": max(durations)}
+                  for name, durations in tools.items()},
+    }
+
+    if plan:
+        index_of = {item["id"]: index for index, item in enumerate(plan)}
+        best: Dict[int, tuple] = {}  # index -> (path ms, path)
+
+        def _longest(index: int) -> tuple:
+            if index not in best:
+                previous = max((_longest(index_of[dep]) for dep in plan[index].get("depends_on", [])
+                                if dep in index_of), default=(0.0, []), key=lambda item: item[0])
+                best[index] = (previous[0] + subtask_ms.get(index, 0.0), previous[1] + [index])
+            return best[index]
+
+        total, path = max((_longest(index) for index in range(len(plan))), default=(0.0, []), key=lambda item: item[0])
+        report["critical_path"] = {"ms": total, "subtasks": [_label(index) for index in path]}
+    return report
+
+
+def format_summary(report: Dict[str, Any]) -> str:
+    lines = ["Run performance summary:"]
+    for name, stats in report["nodes"].items():
+        lines.append(f"  node {name}: {stats['calls']} calls, {stats['total_ms'] / 1000:.2f}s total")
+    tokens = report["tokens"]
+    lines.append(f"  LLM: {tokens['llm_calls']} calls, {tokens['llm_ms'] / 1000:.2f}s, "
+                 f"{tokens['prompt_tokens']} prompt + {tokens['completion_tokens']} completion tokens")
+    if tokens.get("llm_queued_ms") or tokens.get("llm_retries"):
+        lines.append(f"  LLM rate limiting: {tokens['llm_queued_ms'] / 1000:.2f}s queued vs "
+                     f"{(tokens['llm_ms'] - tokens['llm_queued_ms']) / 1000:.2f}s in service, "
+                     f"{tokens['llm_retries']} retries")
+    if tokens.get("tool_tokens_saved"):
+        lines.append(f"  tool output compaction: {tokens['tool_outputs_compacted']} outputs, "
+                     f"~{tokens['tool_tokens_saved']} tokens saved")
+    if "critical_path" in report:
+        path = report["critical_path"]
+        lines.append(f"  critical path ({path['ms'] / 1000:.2f}s): " + " -> ".join(path["subtasks"]))
+    for entry in report["slowest_subtasks"]:
+        lines.append(f"  slow subtask {entry['subtask']}: {entry['ms'] / 1000:.2f}s")
+    for name, stats in report["tools"].items():
+        lines.append(f"  tool {name}: {stats['calls']} calls, {stats['failures']} failed, "
+                     f"p50 {stats['p50_ms']:.0f}ms, p90 {stats['p90_ms']:.0f}ms, p99 {stats['p99_ms']:.0f}ms")
+    return "\n".join(lines)